@@ -0,0 +1,90 @@
+import discord
+import logging
+import time
+from typing import Optional
+from audio_stats import GuildAudioStats, pipe_occupancy
+
+logger = logging.getLogger(__name__)
+
+# Discord voice frames are 20 ms of audio
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+# Sample the FFmpeg pipe once a second rather than every frame
+BUFFER_SAMPLE_FRAMES = 50
+
+class TrackedAudioSource(discord.AudioSource):
+    """Wraps an audio source and tracks the playback position from frames sent
+    
+    The voice client reads one frame per packet, so counting successful reads
+    gives the position without asking FFmpeg. ``start_offset`` is the position
+    the underlying source was started at (for seeks and resumes).
+    
+    When ``stats`` is given, each read also records how long the source took
+    to produce the frame, the jitter of the read cadence, underruns and the
+    FFmpeg pipe occupancy.
+    """
+    
+    def __init__(self, original: discord.AudioSource, start_offset: float = 0.0,
+                 stats: Optional[GuildAudioStats] = None):
+        self.original = original
+        self.start_offset = max(0.0, start_offset)
+        self.frames = 0
+        self.stats = stats
+        self._last_read_at: Optional[float] = None
+    
+    @property
+    def position(self) -> float:
+        """Current playback position in seconds"""
+        return self.start_offset + self.frames * FRAME_SECONDS
+    
+    @property
+    def volume(self) -> Optional[float]:
+        return getattr(self.original, 'volume', None)
+    
+    @volume.setter
+    def volume(self, value: float):
+        if hasattr(self.original, 'volume'):
+            self.original.volume = value
+    
+    def read(self) -> bytes:
+        if self.stats is None:
+            data = self.original.read()
+            if data:
+                self.frames += 1
+            return data
+        
+        started = time.perf_counter()
+        data = self.original.read()
+        finished = time.perf_counter()
+        if data:
+            self.frames += 1
+            self._record(started, finished)
+        return data
+    
+    def _record(self, started: float, finished: float):
+        """Update the guild's send-path statistics for one frame"""
+        stats = self.stats
+        latency = finished - started
+        stats.frames += 1
+        stats.read_latency.observe(latency * 1000)
+        if latency > FRAME_SECONDS:
+            # The frame was not ready in time for its send slot
+            stats.underruns += 1
+        
+        if self._last_read_at is not None:
+            interval = started - self._last_read_at
+            # Long intervals are pauses, not jitter
+            if interval < 1.0:
+                stats.jitter.observe(abs(interval - FRAME_SECONDS) * 1000)
+        self._last_read_at = started
+        
+        if self.frames % BUFFER_SAMPLE_FRAMES == 1:
+            occupancy = pipe_occupancy(self.original)
+            if occupancy is not None:
+                stats.buffer.observe(occupancy)
+    
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+    
+    def cleanup(self):
+        self.original.cleanup()
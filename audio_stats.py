@@ -0,0 +1,113 @@
+import bisect
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+try:
+    import fcntl
+    import termios
+except ImportError:  # Windows: pipe occupancy is not available
+    fcntl = None
+    termios = None
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds; the last bucket catches everything above
+LATENCY_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 40, 80, 160, 320, 640, 1280]
+# Upper bounds in bytes (one 20 ms PCM frame is 3840 bytes)
+BUFFER_BUCKETS_BYTES = [0, 3840, 7680, 15360, 30720, 61440, 65536]
+
+class Histogram:
+    """Fixed-bucket histogram that is cheap enough to update per audio frame"""
+    
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+    
+    def percentile(self, percent: float) -> float:
+        """Approximate a percentile as the upper bound of the bucket containing it"""
+        if not self.count:
+            return 0.0
+        target = self.count * percent / 100
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+class GuildAudioStats:
+    """Send-path measurements for one guild"""
+    
+    def __init__(self):
+        self.read_latency = Histogram(LATENCY_BUCKETS_MS)   # time spent waiting on the source
+        self.jitter = Histogram(LATENCY_BUCKETS_MS)         # deviation from the 20 ms frame cadence
+        self.buffer = Histogram(BUFFER_BUCKETS_BYTES)       # FFmpeg stdout bytes waiting to be read
+        self.frames = 0
+        self.underruns = 0
+        self.started_at = time.monotonic()
+
+class AudioStatsRegistry:
+    """Per-guild audio statistics, ranked to find the worst guilds"""
+    
+    def __init__(self):
+        self.enabled = Config.AUDIO_STATS_ENABLED
+        self._guilds: Dict[int, GuildAudioStats] = {}
+    
+    def get(self, guild_id: int) -> Optional[GuildAudioStats]:
+        """Get (or create) the stats for a guild, or None when disabled"""
+        if not self.enabled:
+            return None
+        stats = self._guilds.get(guild_id)
+        if stats is None:
+            stats = GuildAudioStats()
+            self._guilds[guild_id] = stats
+        return stats
+    
+    def reset(self, guild_id: int = None):
+        """Clear stats for one guild or all guilds"""
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
+    
+    def worst(self, limit: int = 5) -> List[Tuple[int, GuildAudioStats]]:
+        """Guilds ranked by underrun rate, then by p99 jitter"""
+        def score(item):
+            stats = item[1]
+            underrun_rate = stats.underruns / stats.frames if stats.frames else 0.0
+            return (underrun_rate, stats.jitter.percentile(99))
+        return sorted(self._guilds.items(), key=score, reverse=True)[:limit]
+
+def pipe_occupancy(source) -> Optional[int]:
+    """Bytes waiting in an FFmpeg source's stdout pipe, if it can be measured"""
+    if fcntl is None:
+        return None
+    # Unwrap volume transformers and other wrappers down to the FFmpeg source
+    while source is not None and not hasattr(source, '_stdout'):
+        source = getattr(source, 'original', None)
+    stdout = getattr(source, '_stdout', None)
+    if stdout is None:
+        return None
+    try:
+        buffer = bytearray(4)
+        fcntl.ioctl(stdout.fileno(), termios.FIONREAD, buffer)
+        return int.from_bytes(buffer, 'little')
+    except (OSError, ValueError, AttributeError):
+        # Closed pipe, or the source was already cleaned up
+        return None
@@ -0,0 +1,230 @@
+"""Measure discord.py's cache cost per 1,000 guilds for each gateway cache profile
+
+Feeds synthetic GUILD_CREATE, GUILD_MEMBERS_CHUNK and MESSAGE_CREATE
+payloads into discord.py's own parsers, without a network connection or a
+token. For each profile it reports the memory the caches hold afterwards
+(tracemalloc) and the time spent parsing, both scaled to 1,000 guilds.
+
+Profiles:
+  default  the bot's normal settings (default intents, voice member cache, 1000 messages)
+  lean     LEAN_GATEWAY_CACHE=true (see gateway_cache.py)
+  members  members intent with chunking at startup, for comparison
+
+Chunking also costs gateway round trips that grow with guild size; those
+aren't simulated here, so startup times for 'members' are a lower bound.
+
+    python bench_gateway_cache.py --guilds 2000 --voice-users 8
+"""
+import argparse
+import asyncio
+import copy
+import gc
+import os
+import random
+import time
+import tracemalloc
+from typing import Dict, Iterable, List
+
+import discord
+from discord.state import ChunkRequest, ConnectionState
+
+BOT_ID = 1 << 40
+
+def snowflake(counter=[10 ** 15]) -> str:
+    counter[0] += 1
+    return str(counter[0])
+
+def user_payload(user_id: str, bot: bool = False) -> Dict:
+    return {'id': user_id, 'username': f'user{user_id[-6:]}', 'discriminator': '0',
+            'global_name': None, 'avatar': None, 'bot': bot}
+
+def member_payload(user_id: str, roles: List[str], bot: bool = False) -> Dict:
+    return {'user': user_payload(user_id, bot), 'roles': roles, 'joined_at': '2024-01-01T00:00:00+00:00',
+            'deaf': False, 'mute': False, 'flags': 0, 'nick': None, 'avatar': None}
+
+def guild_payloads(args) -> List[Dict]:
+    """GUILD_CREATE payloads, each with the members Discord includes without the members intent"""
+    guilds = []
+    for _ in range(args.guilds):
+        guild_id = snowflake()
+        roles = [{'id': guild_id, 'name': '@everyone', 'permissions': '104324673', 'position': 0,
+                  'color': 0, 'hoist': False, 'managed': False, 'mentionable': False, 'flags': 0}]
+        roles += [{'id': snowflake(), 'name': f'role{i}', 'permissions': '0', 'position': i + 1,
+                   'color': 0, 'hoist': False, 'managed': False, 'mentionable': False, 'flags': 0}
+                  for i in range(args.roles)]
+        channels = [{'id': snowflake(), 'type': 0, 'name': f'text{i}', 'position': i,
+                     'permission_overwrites': [], 'nsfw': False, 'parent_id': None}
+                    for i in range(args.text_channels)]
+        voice_channels = [{'id': snowflake(), 'type': 2, 'name': f'voice{i}', 'position': i,
+                           'permission_overwrites': [], 'bitrate': 64000, 'user_limit': 0, 'parent_id': None}
+                          for i in range(args.voice_channels)]
+        emojis = [{'id': snowflake(), 'name': f'emoji{i}', 'roles': [], 'require_colons': True,
+                   'managed': False, 'animated': False, 'available': True}
+                  for i in range(args.emojis)]
+
+        voice_users = [snowflake() for _ in range(args.voice_users)]
+        members = [member_payload(str(BOT_ID), [], bot=True)]
+        members += [member_payload(user_id, [random.choice(roles)['id']]) for user_id in voice_users]
+        voice_states = [{'user_id': user_id, 'channel_id': random.choice(voice_channels)['id'],
+                         'session_id': 'x', 'deaf': False, 'mute': False, 'self_deaf': False,
+                         'self_mute': False, 'self_video': False, 'suppress': False,
+                         'request_to_speak_timestamp': None}
+                        for user_id in voice_users]
+        guilds.append({
+            'id': guild_id, 'name': f'guild{guild_id[-6:]}', 'icon': None, 'owner_id': voice_users[0] if voice_users else str(BOT_ID),
+            'region': 'europe', 'afk_channel_id': None, 'afk_timeout': 300, 'verification_level': 1,
+            'default_message_notifications': 1, 'explicit_content_filter': 0, 'features': [],
+            'mfa_level': 0, 'system_channel_id': channels[0]['id'], 'system_channel_flags': 0,
+            'rules_channel_id': None, 'vanity_url_code': None, 'description': None, 'banner': None,
+            'premium_tier': 0, 'preferred_locale': 'en-US', 'public_updates_channel_id': None,
+            'nsfw_level': 0, 'premium_progress_bar_enabled': False, 'stickers': [],
+            'roles': roles, 'emojis': emojis, 'channels': channels + voice_channels,
+            'members': members, 'voice_states': voice_states, 'presences': [], 'threads': [],
+            'stage_instances': [], 'guild_scheduled_events': [], 'soundboard_sounds': [],
+            'member_count': args.members, 'large': args.members > 250, 'unavailable': False,
+            'joined_at': '2024-01-01T00:00:00+00:00',
+        })
+    return guilds
+
+def chunk_payloads(guilds: List[Dict], args) -> List[Dict]:
+    """GUILD_MEMBERS_CHUNK payloads a members-intent bot would request for every guild"""
+    chunks = []
+    for guild in guilds:
+        role_ids = [role['id'] for role in guild['roles'][1:]] or [guild['id']]
+        members = [member_payload(snowflake(), [random.choice(role_ids)]) for _ in range(args.members)]
+        for start in range(0, len(members), 1000):
+            chunks.append({'guild_id': guild['id'], 'members': members[start:start + 1000],
+                           'chunk_index': start // 1000, 'chunk_count': -(-len(members) // 1000)})
+    return chunks
+
+def message_payloads(guilds: List[Dict], args) -> List[Dict]:
+    """MESSAGE_CREATE payloads spread over the guilds' text channels"""
+    messages = []
+    for _ in range(args.messages):
+        guild = random.choice(guilds)
+        channel = random.choice([c for c in guild['channels'] if c['type'] == 0])
+        author = snowflake()
+        messages.append({
+            'id': snowflake(), 'channel_id': channel['id'], 'guild_id': guild['id'], 'type': 0,
+            'content': '!play some song name by some artist', 'author': user_payload(author),
+            'member': {k: v for k, v in member_payload(author, []).items() if k != 'user'},
+            'timestamp': '2024-01-01T00:00:00+00:00', 'edited_timestamp': None, 'tts': False,
+            'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+            'embeds': [], 'pinned': False, 'flags': 0, 'components': [],
+        })
+    return messages
+
+def profile_options(name: str) -> Dict:
+    if name == 'default':
+        intents = discord.Intents.default()
+        intents.message_content = True
+        return {'intents': intents}
+    if name == 'lean':
+        # Same settings as build_intents() and cache_options() with LEAN_GATEWAY_CACHE=true
+        os.environ['LEAN_GATEWAY_CACHE'] = 'true'
+        from gateway_cache import build_intents, cache_options
+        return {'intents': build_intents(), **cache_options()}
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = True
+    # The chunks are fed in below instead of being requested over the gateway
+    return {'intents': intents, 'chunk_guilds_at_startup': False}
+
+def fresh(payloads: List[Dict], lazy: bool) -> Iterable[Dict]:
+    """Copies of the payloads, since discord.py adds keys to the dicts it parses
+
+    Lazy copies are dropped right after parsing, so only what the caches keep
+    is measured; eager copies keep copying out of the timed section.
+    """
+    if lazy:
+        return (copy.deepcopy(data) for data in payloads)
+    return copy.deepcopy(payloads)
+
+async def run_profile(name: str, guilds: List[Dict], chunks: List[Dict], messages: List[Dict],
+                      measure_memory: bool) -> Dict:
+    loop = asyncio.get_running_loop()
+    options = profile_options(name)
+    state = ConnectionState(dispatch=lambda *args, **kwargs: None, handlers={}, hooks={},
+                            http=discord.http.HTTPClient(loop), **options)
+    state.loop = loop
+    guilds = fresh(guilds, measure_memory)
+    chunks = fresh(chunks, measure_memory) if name == 'members' else []
+    messages = fresh(messages, measure_memory)
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+
+    state.clear()
+    state.user = discord.ClientUser(state=state, data=user_payload(str(BOT_ID), bot=True))
+    for data in guilds:
+        state.parse_guild_create(data)
+    if name == 'members':
+        # What the startup chunker does: one caching request per guild, answered by chunks
+        nonces = {}
+        for guild in state.guilds:
+            request = ChunkRequest(guild.id, 0, loop, state._get_guild, cache=True)
+            state._chunk_requests[request.nonce] = request
+            nonces[guild.id] = request.nonce
+        for data in chunks:
+            state.parse_guild_members_chunk({**data, 'nonce': nonces[int(data['guild_id'])]})
+    startup = time.perf_counter() - started
+    gc.collect()
+    guild_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    started = time.perf_counter()
+    for data in messages:
+        state.parse_message_create(data)
+    message_seconds = time.perf_counter() - started
+    gc.collect()
+    total_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    result = {
+        'members': sum(len(guild.members) for guild in state.guilds),
+        'users': len(state._users),
+        'messages': len(state._messages or ()),
+        'guild_bytes': guild_bytes,
+        'total_bytes': total_bytes,
+        'startup': startup,
+        'message_seconds': message_seconds,
+    }
+    await state.http.close()
+    return result
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--members', type=int, default=500, help='members per guild (chunked by the members profile)')
+    parser.add_argument('--voice-users', type=int, default=5, help='users in voice per guild')
+    parser.add_argument('--text-channels', type=int, default=15)
+    parser.add_argument('--voice-channels', type=int, default=5)
+    parser.add_argument('--roles', type=int, default=15)
+    parser.add_argument('--emojis', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5000, help='messages received after startup')
+    parser.add_argument('--profiles', default='default,lean,members')
+    args = parser.parse_args()
+
+    random.seed(0)
+    guilds = guild_payloads(args)
+    chunks = chunk_payloads(guilds, args) if 'members' in args.profiles else []
+    messages = message_payloads(guilds, args)
+    scale = 1000 / args.guilds
+
+    print(f"{args.guilds} guilds, {args.members} members and {args.voice_users} in voice each, "
+          f"{args.messages} messages; cache sizes and startup per 1,000 guilds")
+    print(f"{'profile':<8} {'cached members':>14} {'users':>8} {'messages':>8} "
+          f"{'guild cache':>12} {'with messages':>14} {'startup parse':>14} {'msg parse':>10}")
+    for name in args.profiles.split(','):
+        # Timed without tracemalloc, which slows allocation down several times
+        result = await run_profile(name.strip(), guilds, chunks, messages, measure_memory=False)
+        tracemalloc.start()
+        memory = await run_profile(name.strip(), guilds, chunks, messages, measure_memory=True)
+        tracemalloc.stop()
+        result.update(guild_bytes=memory['guild_bytes'], total_bytes=memory['total_bytes'])
+        print(f"{name:<8} {result['members'] * scale:>14.0f} {result['users'] * scale:>8.0f} {result['messages']:>8} "
+              f"{result['guild_bytes'] * scale / (1024 * 1024):>9.1f} MiB "
+              f"{result['total_bytes'] * scale / (1024 * 1024):>10.1f} MiB "
+              f"{result['startup'] * scale * 1000:>11.0f} ms "
+              f"{result['message_seconds'] * 1000:>7.0f} ms")
+
+if __name__ == '__main__':
+    asyncio.run(main())
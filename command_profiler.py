@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from discord.ext import commands
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Executor worker threads run this function from concurrent.futures.thread
+_WORKER_FUNCTION = '_worker'
+
+# The bot's own modules, whose functions are summarized after a capture
+_PROJECT_FILES = {name for name in os.listdir(os.path.dirname(os.path.abspath(__file__)))
+                  if name.endswith('.py') and name != os.path.basename(__file__)}
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _folded_stack(frame) -> Tuple[str, ...]:
+    """A frame's call stack, outermost first"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+class Capture:
+    """Stack samples taken during one profiled command invocation
+
+    A sampler thread records the stacks of the event loop thread while the
+    command's task, or a ``play_next`` task for the same guild, is running
+    on it, and of every executor worker thread that is running a job
+    (yt-dlp extraction, loudness analysis, ...). Voice and heartbeat
+    threads are left out. Sampling continues for PROFILE_FOLLOW_SECONDS
+    after the command returns, to catch the playback it started.
+    """
+
+    def __init__(self, command: str, guild_id: Optional[int], loop: asyncio.AbstractEventLoop, task: asyncio.Task):
+        self.command = command
+        self.guild_id = guild_id
+        self.loop = loop
+        self.task = task
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None  # how long the command itself took
+        self._loop_thread = threading.get_ident()
+        self._sampler_thread = None
+        self._followed: Dict[int, bool] = {}  # id(task) -> whether its samples belong to the capture
+        self._stop = threading.Event()
+
+    def start(self):
+        self._sampler_thread = threading.Thread(target=self._run, name='command-profiler', daemon=True)
+        self._sampler_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler_thread is not None:
+            self._sampler_thread.join()
+
+    def _belongs(self, task: Optional[asyncio.Task]) -> bool:
+        """Whether the loop thread's current task is part of this command's work"""
+        if task is None:
+            return False
+        if task is self.task:
+            return True
+        followed = self._followed.get(id(task))
+        if followed is None:
+            coro = task.get_coro()
+            frame = getattr(coro, 'cr_frame', None)
+            followed = (getattr(coro, '__name__', '') == 'play_next' and frame is not None
+                        and frame.f_locals.get('guild_id') == self.guild_id)
+            self._followed[id(task)] = followed
+        return followed
+
+    def _run(self):
+        interval = max(0.001, Config.PROFILE_SAMPLE_INTERVAL)
+        names: Dict[int, str] = {}
+        while not self._stop.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._loop_thread:
+                    if not self._belongs(asyncio.current_task(self.loop)):
+                        continue
+                    thread_name = 'event-loop'
+                elif frame.f_code.co_name == _WORKER_FUNCTION:
+                    # An idle executor thread waiting for its next job
+                    continue
+                else:
+                    if thread_id not in names:
+                        names.update((thread.ident, thread.name.rstrip('0123456789_-')) for thread in threading.enumerate())
+                    thread_name = names.get(thread_id, 'thread')
+                stack = _folded_stack(frame)
+                if thread_id != self._loop_thread and not any(label.startswith(_WORKER_FUNCTION + ' (') for label in stack):
+                    continue
+                self.samples[(thread_name,) + stack] += 1
+            self.sample_count += 1
+
+    def write(self, path: str):
+        """Save the samples as folded stacks, one 'frame;frame;... count' line each
+
+        The format is read directly by flamegraph.pl, speedscope and inferno.
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def hottest(self, limit: int = 5) -> Tuple[List[Tuple[str, float]], List[Tuple[str, float]]]:
+        """The bot's own functions by time including callees, and all functions by time
+        spent in themselves, each as (label, share of samples)"""
+        total = sum(self.samples.values())
+        if not total:
+            return [], []
+        inclusive = Counter()
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack[-1]] += count
+            for label in set(stack[1:]):
+                if label[label.rindex('(') + 1:label.rindex(':')] in _PROJECT_FILES:
+                    inclusive[label] += count
+        return ([(label, count / total) for label, count in inclusive.most_common(limit)],
+                [(label, count / total) for label, count in leaves.most_common(limit)])
+
+class CommandProfiler:
+    """Profiles the next invocations of a named command on demand
+
+    ``arm`` swaps the command's callback for a wrapper that samples stacks
+    (see Capture) and writes a folded-stack file per invocation to
+    PROFILE_DIR. The original callback is put back after the last capture
+    or on ``disarm``, so commands that aren't being profiled run exactly as
+    before and nothing is sampled while the profiler is off.
+    """
+
+    def __init__(self, bot: commands.Bot, directory: str = Config.PROFILE_DIR):
+        self.bot = bot
+        self.directory = directory
+        self.command: Optional[commands.Command] = None
+        self.remaining = 0
+        self.guild_id: Optional[int] = None  # only profile invocations in this guild, if set
+        self.captures: List[Tuple[str, Capture]] = []  # (file path, capture) of the current session
+        self._original = None
+        self._active: Optional[Capture] = None
+        self._on_done: Optional[Callable[[List[Tuple[str, Capture]]], Awaitable[None]]] = None
+
+    @property
+    def armed(self) -> bool:
+        return self.command is not None
+
+    def arm(self, name: str, count: int, guild_id: Optional[int] = None,
+            on_done: Optional[Callable[[List[Tuple[str, Capture]]], Awaitable[None]]] = None) -> commands.Command:
+        """Profile the next ``count`` invocations of a command; raises ValueError if it doesn't exist"""
+        command = self.bot.get_command(name)
+        if command is None:
+            raise ValueError(f"Unknown command: {name}")
+        self.disarm()
+        os.makedirs(self.directory, exist_ok=True)
+        self.command = command
+        self.remaining = max(1, min(count, Config.PROFILE_MAX_INVOCATIONS))
+        self.guild_id = guild_id
+        self.captures = []
+        self._on_done = on_done
+        self._original = command.callback
+        command.callback = self._wrap(self._original)
+        logger.info(f"Profiling the next {self.remaining} invocations of {command.qualified_name}")
+        return command
+
+    def disarm(self):
+        """Put the original callback back"""
+        if self.command is not None:
+            self.command.callback = self._original
+            logger.info(f"Stopped profiling {self.command.qualified_name}")
+        self.command = None
+        self._original = None
+        self.remaining = 0
+
+    def _wrap(self, callback):
+        @functools.wraps(callback)
+        async def profiled(ctx, *args, **kwargs):
+            guild_id = ctx.guild.id if ctx.guild else None
+            if self._active is not None or self.remaining <= 0 or (self.guild_id and guild_id != self.guild_id):
+                return await callback(ctx, *args, **kwargs)
+
+            capture = Capture(ctx.command.qualified_name, guild_id, asyncio.get_running_loop(), asyncio.current_task())
+            self._active = capture
+            self.remaining -= 1
+            capture.start()
+            try:
+                return await callback(ctx, *args, **kwargs)
+            finally:
+                capture.duration = time.perf_counter() - capture.started
+                asyncio.get_running_loop().create_task(self._finish(capture))
+        return profiled
+
+    async def _finish(self, capture: Capture):
+        """Keep sampling the playback the command started, then save the capture"""
+        try:
+            await asyncio.sleep(Config.PROFILE_FOLLOW_SECONDS)
+        finally:
+            # The sampler wakes up at least every PROFILE_SAMPLE_INTERVAL, so this is a short wait
+            capture.stop()
+            self._active = None
+
+        loop = asyncio.get_running_loop()
+        name = f"{capture.command.replace(' ', '_')}-{time.strftime('%Y%m%d-%H%M%S')}-{len(self.captures) + 1}.folded"
+        path = os.path.join(self.directory, name)
+        try:
+            await loop.run_in_executor(None, capture.write, path)
+        except OSError as e:
+            logger.error(f"Could not save profile {path}: {e}")
+            return
+        self.captures.append((path, capture))
+        logger.info(f"Saved profile of {capture.command} ({capture.duration * 1000:.0f} ms, "
+                    f"{sum(capture.samples.values())} samples) to {path}")
+
+        if self.remaining <= 0 and self.armed:
+            captures, on_done = self.captures, self._on_done
+            self.disarm()
+            if on_done:
+                try:
+                    await on_done(captures)
+                except Exception as e:
+                    logger.warning(f"Could not report profiles: {e}")
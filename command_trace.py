@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = '# musicbot-trace v1'
+
+# Arguments that carry no personal information (positions, ranges, volumes, on/off...) are kept as typed
+_LITERAL_ARGS = re.compile(r'^[\d\s.:\-]*$|^(on|off|enable|disable|true|false|reset|rescan|types|snapshot|diff|stop|all)$',
+                           re.IGNORECASE)
+
+class TraceRecord:
+    """One recorded command invocation"""
+
+    __slots__ = ('offset', 'command', 'guild', 'user', 'args', 'duration', 'status')
+
+    def __init__(self, offset: float, command: str, guild: str, user: str, args: str, duration: float, status: str):
+        self.offset = offset      # seconds since the recording started
+        self.command = command    # qualified command name (aliases resolved)
+        self.guild = guild        # anonymized guild id
+        self.user = user          # anonymized user id
+        self.args = args          # literal arguments, '#<hash>/<kind><count>' for free text, or '-'
+        self.duration = duration  # seconds the handler took
+        self.status = status      # 'ok' or 'err'
+
+    def to_line(self) -> str:
+        return (f"{self.offset * 1000:.0f}\t{self.command}\t{self.guild}\t{self.user}\t"
+                f"{self.args}\t{self.duration * 1000:.1f}\t{self.status}\n")
+
+    @classmethod
+    def from_line(cls, line: str) -> 'TraceRecord':
+        offset, command, guild, user, args, duration, status = line.rstrip('\n').split('\t')
+        return cls(int(offset) / 1000, command, guild, user, args, float(duration) / 1000, status)
+
+def describe_args(text: str) -> Tuple[str, int]:
+    """Classify free-text arguments as (kind, number of queries)
+
+    Kinds: 'l' playlist URL, 'u' other URL, 's' search text.
+    """
+    queries = [query.strip() for line in text.splitlines() for query in line.split(';') if query.strip()]
+    first = queries[0] if queries else text
+    if first.startswith(('http://', 'https://')):
+        kind = 'l' if 'list=' in first else 'u'
+    else:
+        kind = 's'
+    return kind, max(1, len(queries))
+
+def read_trace(path: str) -> Iterator[List[TraceRecord]]:
+    """Yield the recording sessions in a trace file, each a list of records"""
+    session: List[TraceRecord] = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(TRACE_HEADER):
+                if session:
+                    yield session
+                session = []
+            elif line.strip() and not line.startswith('#'):
+                try:
+                    session.append(TraceRecord.from_line(line))
+                except ValueError:
+                    # A line cut short when the bot stopped mid-write
+                    logger.warning(f"Skipping malformed trace line: {line.strip()[:80]}")
+    if session:
+        yield session
+
+class CommandTraceRecorder:
+    """Appends an anonymized line per prefix command to COMMAND_TRACE_FILE
+
+    Guild and user ids and free-text arguments are replaced by keyed hashes,
+    so repeated queries and busy guilds stay recognizable without recording
+    what was played or by whom. Each bot start begins a new session in the
+    file. When no file is configured the hooks are never installed.
+    """
+
+    def __init__(self, path: str = Config.COMMAND_TRACE_FILE, salt: str = Config.COMMAND_TRACE_SALT):
+        self.path = path
+        # Without a configured salt hashes only match within one run
+        self._key = hashlib.blake2b((salt or os.urandom(16).hex()).encode(), digest_size=16).digest()
+        self._file = None
+        self._started = time.monotonic()
+        self._started_at: Dict[int, float] = {}  # id(ctx) -> perf_counter at invoke
+        self.recorded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def install(self, bot):
+        """Register the recording hooks on the bot, if recording is enabled"""
+        if not self.enabled:
+            return
+        try:
+            self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+            self._file.write(f"{TRACE_HEADER} {time.time():.0f}\n")
+        except OSError as e:
+            logger.error(f"Could not open command trace file {self.path}: {e}")
+            return
+        self._started = time.monotonic()
+        bot.before_invoke(self.before_invoke)
+        bot.after_invoke(self.after_invoke)
+        logger.info(f"Recording command traces to {self.path}")
+
+    def _hash(self, value: str, length: int = 8) -> str:
+        return hashlib.blake2b(value.encode(), key=self._key, digest_size=length // 2).hexdigest()
+
+    def anonymize_args(self, text: str) -> str:
+        """Keep harmless arguments, hash everything else"""
+        text = text.strip()
+        if not text:
+            return '-'
+        if _LITERAL_ARGS.match(text):
+            return ' '.join(text.split())
+        kind, count = describe_args(text)
+        return f"#{self._hash(text.lower(), 12)}/{kind}{count}"
+
+    async def before_invoke(self, ctx):
+        self._started_at[id(ctx)] = time.perf_counter()
+
+    async def after_invoke(self, ctx):
+        started = self._started_at.pop(id(ctx), None)
+        if started is None or self._file is None:
+            return
+        duration = time.perf_counter() - started
+        prefix_length = len(ctx.prefix or '') + len(ctx.invoked_with or '')
+        record = TraceRecord(
+            offset=time.monotonic() - self._started - duration,
+            command=ctx.command.qualified_name,
+            guild=self._hash(str(ctx.guild.id)) if ctx.guild else '-',
+            user=self._hash(str(ctx.author.id)),
+            args=self.anonymize_args(ctx.message.content[prefix_length:]),
+            duration=duration,
+            status='err' if ctx.command_failed else 'ok',
+        )
+        try:
+            self._file.write(record.to_line())
+            self.recorded += 1
+        except OSError as e:
+            logger.error(f"Could not write command trace: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
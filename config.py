@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -12,18 +13,74 @@ class Config:
     BOT_PREFIX = os.getenv('BOT_PREFIX', '!')
     BOT_NAME = os.getenv('BOT_NAME', 'MusicBot')
     
+    # Slash Commands
+    SLASH_COMMANDS_ENABLED = os.getenv('SLASH_COMMANDS_ENABLED', 'true').lower() == 'true'
+    SLASH_COMMANDS_SYNC = os.getenv('SLASH_COMMANDS_SYNC', 'true').lower() == 'true'  # publish commands at startup
+    MESSAGE_CONTENT_INTENT = os.getenv('MESSAGE_CONTENT_INTENT', 'true').lower() == 'true'  # needed for prefix commands
+    
+    # Gateway Cache (lean mode for bots in many servers)
+    LEAN_GATEWAY_CACHE = os.getenv('LEAN_GATEWAY_CACHE', 'false').lower() == 'true'  # minimal intents, member and message caches
+    LEAN_MAX_MESSAGES = int(os.getenv('LEAN_MAX_MESSAGES', '100'))  # messages kept in lean mode
+    
     # Music Configuration
-    MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', '100'))
-    MAX_PLAYLIST_SIZE = int(os.getenv('MAX_PLAYLIST_SIZE', '50'))
+    LARGE_QUEUES = os.getenv('LARGE_QUEUES', 'false').lower() == 'true'  # spill queues past the first songs to the database
+    MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', '50000' if LARGE_QUEUES else '100'))
+    MAX_PLAYLIST_SIZE = int(os.getenv('MAX_PLAYLIST_SIZE', '5000' if LARGE_QUEUES else '50'))
+    QUEUE_WINDOW_SIZE = int(os.getenv('QUEUE_WINDOW_SIZE', '50'))  # songs kept in memory per queue with LARGE_QUEUES
     MAX_SONG_LENGTH = int(os.getenv('MAX_SONG_LENGTH', '600'))  # 10 minutes in seconds
+    RESOLVE_CONCURRENCY = int(os.getenv('RESOLVE_CONCURRENCY', '4'))  # parallel lookups for bulk imports
+    
+    # Queue Display Configuration
+    QUEUE_PAGE_SIZE = int(os.getenv('QUEUE_PAGE_SIZE', '10'))
+    QUEUE_VIEW_TIMEOUT = int(os.getenv('QUEUE_VIEW_TIMEOUT', '120'))  # seconds
+    
+    # Search Result Storage
+    SEARCH_RESULTS_MAX_USERS = int(os.getenv('SEARCH_RESULTS_MAX_USERS', '1000'))
+    SEARCH_RESULTS_TTL = int(os.getenv('SEARCH_RESULTS_TTL', '900'))  # seconds
+    METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '5000'))  # tracks
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() == 'true'  # resolve results while the user picks
+    PREFETCH_RESULTS = int(os.getenv('PREFETCH_RESULTS', '3'))          # top results resolved in the background
+    PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', '2'))
+    PREFETCH_TTL = int(os.getenv('PREFETCH_TTL', '600'))                # seconds a resolved stream URL is kept
+    
+    # Play History Configuration
+    HISTORY_LOOKUP_ENABLED = os.getenv('HISTORY_LOOKUP_ENABLED', 'true').lower() == 'true'
+    HISTORY_MATCH_THRESHOLD = float(os.getenv('HISTORY_MATCH_THRESHOLD', '0.9'))  # share of query trigrams matched
+    HISTORY_MIN_SIMILARITY = float(os.getenv('HISTORY_MIN_SIMILARITY', '0.8'))    # trigram similarity of query and title
+    HISTORY_INDEX_SIZE = int(os.getenv('HISTORY_INDEX_SIZE', '50000'))            # tracks loaded at startup
+    AUTOPLAY_HISTORY_SIZE = int(os.getenv('AUTOPLAY_HISTORY_SIZE', '20'))         # recent tracks autoplay won't repeat
     
     # Auto-disconnect Configuration
     AUTO_DISCONNECT_DELAY = int(os.getenv('AUTO_DISCONNECT_DELAY', '10'))  # seconds
     
+    # Message Dispatch Configuration (local mirrors of Discord rate limits)
+    DISPATCH_MESSAGE_RATE = int(os.getenv('DISPATCH_MESSAGE_RATE', '5'))        # sends/edits per channel...
+    DISPATCH_MESSAGE_PER = float(os.getenv('DISPATCH_MESSAGE_PER', '5.0'))      # ...per this many seconds
+    DISPATCH_REACTION_INTERVAL = float(os.getenv('DISPATCH_REACTION_INTERVAL', '0.25'))  # seconds between reactions
+    DISPATCH_GLOBAL_RATE = int(os.getenv('DISPATCH_GLOBAL_RATE', '50'))         # requests per second overall
+    DISPATCH_IDLE_TIMEOUT = float(os.getenv('DISPATCH_IDLE_TIMEOUT', '30.0'))   # seconds before an idle channel worker exits
+    
+    # Voice Health Monitoring
+    VOICE_HEALTH_INTERVAL = float(os.getenv('VOICE_HEALTH_INTERVAL', '2.0'))     # seconds between checks
+    VOICE_DEAD_TIMEOUT = float(os.getenv('VOICE_DEAD_TIMEOUT', '6.0'))           # disconnected this long = dead
+    VOICE_STALL_TIMEOUT = float(os.getenv('VOICE_STALL_TIMEOUT', '8.0'))         # playing without packets = stalled
+    VOICE_GAP_THRESHOLD = float(os.getenv('VOICE_GAP_THRESHOLD', '0.1'))         # packet spacing counted as a gap
+    VOICE_RECONNECT_ATTEMPTS = int(os.getenv('VOICE_RECONNECT_ATTEMPTS', '3'))
+    VOICE_CONNECT_TIMEOUT = float(os.getenv('VOICE_CONNECT_TIMEOUT', '15.0'))    # seconds
+    
     # Audio Configuration
+    AUDIO_STATS_ENABLED = os.getenv('AUDIO_STATS_ENABLED', 'true').lower() == 'true'
     DEFAULT_VOLUME = float(os.getenv('DEFAULT_VOLUME', '0.5'))
     MAX_VOLUME = float(os.getenv('MAX_VOLUME', '1.0'))
     
+    # Loudness Normalization (EBU R128, measured once per track in the background)
+    LOUDNESS_NORMALIZATION = os.getenv('LOUDNESS_NORMALIZATION', 'true').lower() == 'true'
+    LOUDNESS_TARGET = float(os.getenv('LOUDNESS_TARGET', '-16.0'))  # LUFS
+    LOUDNESS_MAX_GAIN_DB = float(os.getenv('LOUDNESS_MAX_GAIN_DB', '6.0'))  # cap on boost/cut
+    LOUDNESS_WORKERS = int(os.getenv('LOUDNESS_WORKERS', '2'))
+    LOUDNESS_TIMEOUT = int(os.getenv('LOUDNESS_TIMEOUT', '120'))  # seconds per analysis
+    LOUDNESS_RETRY_AFTER = int(os.getenv('LOUDNESS_RETRY_AFTER', '86400'))  # seconds before a failed analysis is retried
+    
     # YouTube Configuration
     YOUTUBE_DL_OPTIONS = {
         'format': 'bestaudio/best',
@@ -37,15 +94,91 @@ class Config:
         'source_address': '0.0.0.0'
     }
     
+    # Stream Format Selection
+    FORMAT_POLICY = os.getenv('FORMAT_POLICY', 'efficient').lower()              # 'efficient' or 'legacy'
+    FORMAT_CODECS = os.getenv('FORMAT_CODECS', 'opus,vorbis,mp4a,aac')          # preferred codecs, best first
+    FORMAT_CONTAINERS = os.getenv('FORMAT_CONTAINERS', 'webm,m4a,mp4')         # preferred containers, best first
+    FORMAT_MAX_BITRATE = int(os.getenv('FORMAT_MAX_BITRATE', '0'))             # kbps, 0 = from channel bitrate
+    FORMAT_BITRATE_HEADROOM = float(os.getenv('FORMAT_BITRATE_HEADROOM', '1.25'))  # ceiling = channel bitrate x this
+    FORMAT_CACHE_SIZE = int(os.getenv('FORMAT_CACHE_SIZE', '5000'))            # tracks
+    
     # FFmpeg Configuration
     FFMPEG_OPTIONS = {
         'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
         'options': '-vn'
     }
     
+    LOCAL_FFMPEG_OPTIONS = {
+        'options': '-vn'
+    }
+    
+    # FFmpeg Process Limits
+    FFMPEG_MAX_PROCESSES = int(os.getenv('FFMPEG_MAX_PROCESSES', '50'))        # 0 = unlimited
+    FFMPEG_NICE = int(os.getenv('FFMPEG_NICE', '5'))                            # added niceness (POSIX)
+    FFMPEG_MAX_MEMORY_MB = int(os.getenv('FFMPEG_MAX_MEMORY_MB', '0'))          # data segment limit (Linux), 0 = none
+    FFMPEG_MAX_CPU_SECONDS = int(os.getenv('FFMPEG_MAX_CPU_SECONDS', '0'))      # CPU time limit, 0 = none
+    FFMPEG_REAP_GRACE = float(os.getenv('FFMPEG_REAP_GRACE', '3.0'))            # seconds before killing leftovers
+    FFMPEG_REAP_INTERVAL = float(os.getenv('FFMPEG_REAP_INTERVAL', '30.0'))     # seconds between orphan sweeps
+    
+    # Local Music Library (searched before YouTube; empty path = disabled)
+    LOCAL_LIBRARY_PATH = os.getenv('LOCAL_LIBRARY_PATH', '')
+    LOCAL_LIBRARY_EXTENSIONS = os.getenv('LOCAL_LIBRARY_EXTENSIONS', '.mp3,.flac,.ogg,.opus,.m4a,.aac,.wav,.wma')
+    LOCAL_LIBRARY_WORKERS = int(os.getenv('LOCAL_LIBRARY_WORKERS', '4'))                  # parallel ffprobe processes
+    LOCAL_LIBRARY_SCAN_INTERVAL = int(os.getenv('LOCAL_LIBRARY_SCAN_INTERVAL', '300'))    # seconds between rescans, 0 = startup only
+    LOCAL_LIBRARY_PROBE_TIMEOUT = float(os.getenv('LOCAL_LIBRARY_PROBE_TIMEOUT', '15.0'))  # seconds per file
+    LOCAL_LIBRARY_MATCH_THRESHOLD = float(os.getenv('LOCAL_LIBRARY_MATCH_THRESHOLD', '0.8'))  # share of query trigrams matched
+    LOCAL_LIBRARY_MIN_SIMILARITY = float(os.getenv('LOCAL_LIBRARY_MIN_SIMILARITY', '0.8'))    # trigram similarity of query and title
+    
+    # Opus Cache (popular tracks stored as Opus frames and played without FFmpeg)
+    OPUS_CACHE_ENABLED = os.getenv('OPUS_CACHE_ENABLED', 'true').lower() == 'true'
+    OPUS_CACHE_DIR = os.getenv('OPUS_CACHE_DIR', 'opus_cache')
+    OPUS_CACHE_MIN_PLAYS = int(os.getenv('OPUS_CACHE_MIN_PLAYS', '3'))       # plays across all guilds before a track is stored
+    OPUS_CACHE_MAX_MB = int(os.getenv('OPUS_CACHE_MAX_MB', '2048'))          # least recently played tracks go first, 0 = no limit
+    OPUS_CACHE_BITRATE = int(os.getenv('OPUS_CACHE_BITRATE', '96'))          # kbps
+    OPUS_CACHE_WORKERS = int(os.getenv('OPUS_CACHE_WORKERS', '1'))           # parallel encodes
+    OPUS_CACHE_TIMEOUT = int(os.getenv('OPUS_CACHE_TIMEOUT', '600'))         # seconds per encode
+    
+    # Command Profiling (!profile)
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))  # seconds between stack samples
+    PROFILE_FOLLOW_SECONDS = float(os.getenv('PROFILE_FOLLOW_SECONDS', '5.0'))      # keep sampling playback started by the command
+    PROFILE_MAX_INVOCATIONS = int(os.getenv('PROFILE_MAX_INVOCATIONS', '20'))
+    
+    # Command Tracing (anonymized command log for replay_trace.py; empty file = off)
+    COMMAND_TRACE_FILE = os.getenv('COMMAND_TRACE_FILE', '')
+    COMMAND_TRACE_SALT = os.getenv('COMMAND_TRACE_SALT', '')  # keeps hashes stable across restarts; random if empty
+    
+    # Memory Diagnostics
+    MEMORY_SAMPLE_INTERVAL = int(os.getenv('MEMORY_SAMPLE_INTERVAL', '300'))  # seconds between RSS samples, 0 = off
+    MEMORY_HISTORY_SIZE = int(os.getenv('MEMORY_HISTORY_SIZE', '288'))        # samples kept (24 h at 5 min)
+    MEMORY_TRACE_FRAMES = int(os.getenv('MEMORY_TRACE_FRAMES', '1'))          # stack depth recorded by tracemalloc
+    
+    # Shared Streams (one decode for guilds starting the same track together)
+    BROKER_ENABLED = os.getenv('BROKER_ENABLED', 'true').lower() == 'true'
+    BROKER_JOIN_WINDOW = float(os.getenv('BROKER_JOIN_WINDOW', '10.0'))        # seconds a broadcast accepts new guilds
+    BROKER_LEAD_SECONDS = float(os.getenv('BROKER_LEAD_SECONDS', '3.0'))       # decode ahead of the fastest guild
+    BROKER_BUFFER_SECONDS = float(os.getenv('BROKER_BUFFER_SECONDS', '30.0'))  # max audio kept; slower guilds go private
+    
+    # Shared State (several bot nodes; 'memory' for a single node or redis://[:password@]host:port/db)
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+    STATE_NODE_ID = os.getenv('STATE_NODE_ID', f"{socket.gethostname()}-{os.getpid()}")
+    STATE_KEY_PREFIX = os.getenv('STATE_KEY_PREFIX', 'musicbot:')
+    STATE_LEASE_TTL = float(os.getenv('STATE_LEASE_TTL', '15.0'))         # seconds a node owns a guild without renewing
+    STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '0.5'))  # seconds between batched writes
+    STATE_TIMEOUT = float(os.getenv('STATE_TIMEOUT', '5.0'))               # seconds per request to the store
+    
     # Database Configuration (if using persistent storage)
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///musicbot.db')
     
+    # Startup Configuration
+    STARTUP_CONNECTIVITY_CHECK = os.getenv('STARTUP_CONNECTIVITY_CHECK', 'true').lower() == 'true'
+    STARTUP_PROBE_TIMEOUT = float(os.getenv('STARTUP_PROBE_TIMEOUT', '5.0'))  # seconds per endpoint
+    
+    # Reconnect Configuration (jittered exponential backoff)
+    RECONNECT_BASE_DELAY = float(os.getenv('RECONNECT_BASE_DELAY', '5.0'))  # seconds
+    RECONNECT_MAX_DELAY = float(os.getenv('RECONNECT_MAX_DELAY', '300.0'))  # seconds
+    RECONNECT_MAX_RETRIES = int(os.getenv('RECONNECT_MAX_RETRIES', '0'))    # 0 = retry forever
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'musicbot.log')
@@ -0,0 +1,214 @@
+import asyncio
+import discord
+import logging
+import os
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits or nice levels
+    resource = None
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class FFmpegLimitReached(RuntimeError):
+    """Raised when starting another FFmpeg process would exceed the configured limit"""
+
+def limit_process(pid: int):
+    """Lower a freshly started FFmpeg process's priority and cap its resources
+
+    Applied from the parent after the spawn: the bot runs several threads, and
+    code run in the child between fork and exec (preexec_fn) can deadlock there.
+    The memory cap limits the data segment rather than the address space,
+    which glibc reserves generously per thread. Limits need Linux (prlimit).
+    """
+    try:
+        if Config.FFMPEG_NICE and hasattr(os, 'setpriority'):
+            os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + Config.FFMPEG_NICE)
+        if resource is not None and hasattr(resource, 'prlimit'):
+            if Config.FFMPEG_MAX_MEMORY_MB:
+                limit = Config.FFMPEG_MAX_MEMORY_MB * 1024 * 1024
+                resource.prlimit(pid, resource.RLIMIT_DATA, (limit, limit))
+            if Config.FFMPEG_MAX_CPU_SECONDS:
+                resource.prlimit(pid, resource.RLIMIT_CPU, (Config.FFMPEG_MAX_CPU_SECONDS, Config.FFMPEG_MAX_CPU_SECONDS))
+    except (OSError, ValueError) as e:
+        # The process may already have exited
+        logger.debug(f"Could not limit FFmpeg process {pid}: {e}")
+
+class _ProcessEntry:
+    """A live FFmpeg child and who owns it"""
+
+    def __init__(self, guild_id: int, process: subprocess.Popen, source: discord.AudioSource):
+        self.guild_id = guild_id
+        self.process = process
+        self.source = source
+        self.started_at = time.monotonic()
+        self.last_cpu: Optional[float] = None
+        self.last_sampled_at: Optional[float] = None
+
+class SupervisedFFmpegPCMAudio(discord.FFmpegPCMAudio):
+    """FFmpegPCMAudio whose process is limited and tracked by an FFmpegSupervisor"""
+
+    def __init__(self, source: str, *, supervisor: 'FFmpegSupervisor', guild_id: int, **kwargs):
+        # Must be set before FFmpegAudio.__init__ spawns the process
+        self._supervisor = supervisor
+        self._guild_id = guild_id
+        super().__init__(source, **kwargs)
+
+    def _spawn_process(self, args, **subprocess_kwargs) -> subprocess.Popen:
+        process = super()._spawn_process(args, **subprocess_kwargs)
+        limit_process(process.pid)
+        self._supervisor.register(self._guild_id, process, self)
+        return process
+
+    def cleanup(self):
+        process = self._process
+        super().cleanup()
+        self._supervisor.unregister(process)
+
+class FFmpegSupervisor:
+    """Tracks every FFmpeg child the player starts
+
+    Enforces a maximum number of live processes, applies nice levels and
+    rlimits (Linux only), kills processes left behind by skips, stops and
+    playback errors, and reports per-process CPU time and RSS (Linux only).
+    """
+
+    def __init__(self):
+        self._processes: Dict[int, _ProcessEntry] = {}  # pid -> entry
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.spawned = 0
+        self.reaped = 0
+
+    @property
+    def live_count(self) -> int:
+        return len(self._processes)
+
+    def create_source(self, guild_id: Optional[int], url: str, **ffmpeg_options) -> SupervisedFFmpegPCMAudio:
+        """Start a supervised FFmpeg source, respecting the process limit
+        
+        ``guild_id`` is None for shared sources, which the stream broker cleans up itself.
+        """
+        if Config.FFMPEG_MAX_PROCESSES and self.live_count >= Config.FFMPEG_MAX_PROCESSES:
+            self._collect_exited()
+            if self.live_count >= Config.FFMPEG_MAX_PROCESSES:
+                raise FFmpegLimitReached(f"FFmpeg process limit reached ({Config.FFMPEG_MAX_PROCESSES})")
+        return SupervisedFFmpegPCMAudio(url, supervisor=self, guild_id=guild_id, **ffmpeg_options)
+
+    def run(self, args: List[str], timeout: float) -> subprocess.CompletedProcess:
+        """Run a background FFmpeg job (no audio source) to completion under the same limits
+
+        Counts against FFMPEG_MAX_PROCESSES and shows up in the stats like
+        playback processes. Raises FFmpegLimitReached if no slot is free and
+        subprocess.TimeoutExpired (after killing the process) on timeout.
+        """
+        if Config.FFMPEG_MAX_PROCESSES and self.live_count >= Config.FFMPEG_MAX_PROCESSES:
+            self._collect_exited()
+            if self.live_count >= Config.FFMPEG_MAX_PROCESSES:
+                raise FFmpegLimitReached(f"FFmpeg process limit reached ({Config.FFMPEG_MAX_PROCESSES})")
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True)
+        limit_process(process.pid)
+        self.register(None, process, None)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            self.unregister(process)
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def register(self, guild_id: int, process: subprocess.Popen, source: discord.AudioSource):
+        self._processes[process.pid] = _ProcessEntry(guild_id, process, source)
+        self.spawned += 1
+
+    def unregister(self, process: subprocess.Popen):
+        if process is not None and hasattr(process, 'pid'):
+            self._processes.pop(process.pid, None)
+
+    def _collect_exited(self):
+        """Forget processes that have already exited"""
+        for pid, entry in list(self._processes.items()):
+            if entry.process.poll() is not None:
+                del self._processes[pid]
+
+    def _kill(self, entry: _ProcessEntry, reason: str):
+        logger.warning(f"Killing FFmpeg process {entry.process.pid} for guild {entry.guild_id} ({reason})")
+        try:
+            entry.process.kill()
+            entry.process.wait(timeout=1)
+        except Exception as e:
+            logger.warning(f"Error killing FFmpeg process {entry.process.pid}: {e}")
+        self._processes.pop(entry.process.pid, None)
+        self.reaped += 1
+
+    def reap(self, guild_id: int, keep: Optional[discord.AudioSource] = None) -> int:
+        """Kill a guild's FFmpeg processes except the one belonging to ``keep``"""
+        killed = 0
+        for entry in list(self._processes.values()):
+            if entry.guild_id != guild_id or entry.source is keep:
+                continue
+            if entry.process.poll() is None:
+                self._kill(entry, "no longer playing")
+                killed += 1
+            else:
+                self._processes.pop(entry.process.pid, None)
+        return killed
+
+    def reap_later(self, guild_id: int, get_keep: Callable[[int], Optional[discord.AudioSource]]):
+        """Reap a guild after a grace period, giving the player time to clean up itself"""
+        loop = asyncio.get_running_loop()
+        loop.call_later(Config.FFMPEG_REAP_GRACE, lambda: self.reap(guild_id, get_keep(guild_id)))
+
+    def ensure_reaper(self, get_keep: Callable[[int], Optional[discord.AudioSource]]):
+        """Start the periodic orphan reaper if it isn't running; call from the event loop"""
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.get_running_loop().create_task(self._reap_periodically(get_keep))
+
+    async def _reap_periodically(self, get_keep: Callable[[int], Optional[discord.AudioSource]]):
+        while True:
+            await asyncio.sleep(Config.FFMPEG_REAP_INTERVAL)
+            try:
+                now = time.monotonic()
+                self._collect_exited()
+                for entry in list(self._processes.values()):
+                    if entry.guild_id is None or now - entry.started_at < Config.FFMPEG_REAP_GRACE:
+                        continue
+                    if entry.source is not get_keep(entry.guild_id):
+                        self._kill(entry, "orphaned")
+            except Exception as e:
+                logger.error(f"Error in FFmpeg reaper: {e}")
+
+    def _sample(self, entry: _ProcessEntry) -> Dict:
+        """Read CPU time and RSS for one process from /proc"""
+        pid = entry.process.pid
+        info = {'pid': pid, 'guild_id': entry.guild_id, 'age': time.monotonic() - entry.started_at,
+                'cpu_seconds': None, 'cpu_percent': None, 'rss_mb': None}
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # Fields after the command name (which may contain spaces)
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks = os.sysconf('SC_CLK_TCK')
+            cpu = (int(fields[11]) + int(fields[12])) / ticks   # utime + stime
+            rss_pages = int(fields[21])
+            now = time.monotonic()
+            info['cpu_seconds'] = cpu
+            info['rss_mb'] = rss_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+            if entry.last_cpu is not None and now > entry.last_sampled_at:
+                info['cpu_percent'] = 100 * (cpu - entry.last_cpu) / (now - entry.last_sampled_at)
+            entry.last_cpu = cpu
+            entry.last_sampled_at = now
+        except (OSError, ValueError, IndexError, AttributeError):
+            pass  # Not Linux, or the process just exited
+        return info
+
+    def get_stats(self) -> List[Dict]:
+        """Per-process stats for all live FFmpeg children"""
+        self._collect_exited()
+        return [self._sample(entry) for entry in list(self._processes.values())]
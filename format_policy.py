@@ -0,0 +1,184 @@
+import logging
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Discord's default voice channel bitrate, used when the channel's is unknown
+DEFAULT_CHANNEL_BITRATE = 64000  # bits per second
+
+def _number(value) -> float:
+    """Convert an optional yt-dlp numeric field to a float (0.0 if missing or invalid)"""
+    try:
+        return float(value or 0)
+    except (ValueError, TypeError):
+        return 0.0
+
+def has_audio(fmt: Dict) -> bool:
+    return fmt.get('acodec') != 'none'
+
+def is_audio_only(fmt: Dict) -> bool:
+    return has_audio(fmt) and fmt.get('vcodec') == 'none'
+
+def bitrate(fmt: Dict) -> float:
+    """Audio bitrate in kbps, falling back to the total bitrate (0.0 if unknown)"""
+    return _number(fmt.get('abr')) or _number(fmt.get('tbr'))
+
+def estimated_size(fmt: Dict, duration: int) -> float:
+    """Estimated number of bytes streamed for a whole track in this format"""
+    size = _number(fmt.get('filesize')) or _number(fmt.get('filesize_approx'))
+    if not size:
+        size = _number(fmt.get('tbr')) or bitrate(fmt)
+        size = size * 1000 / 8 * (duration or 0)
+    return size
+
+def legacy_sort_key(fmt: Dict) -> Tuple[bool, float, float]:
+    """The ordering play_next used before format policies existed"""
+    return (
+        fmt.get('acodec', '') == 'none',  # Prefer audio-only
+        _number(fmt.get('abr')),          # Higher bitrate
+        _number(fmt.get('filesize'))      # Larger file size
+    )
+
+def legacy_select(formats: List[Dict]) -> Optional[Dict]:
+    """Pick a format the way play_next used to"""
+    candidates = [f for f in formats if has_audio(f)] or list(formats)
+    candidates = [f for f in candidates if f.get('url')]
+    if not candidates:
+        return None
+    return min(candidates, key=legacy_sort_key)
+
+class FormatPolicy:
+    """Chooses which of a track's formats to stream
+
+    Discord re-encodes everything to Opus at no more than the voice channel's
+    bitrate, so anything much above that is wasted bandwidth. The ``efficient``
+    policy walks a fallback chain until a stage has a candidate:
+
+    1. audio-only streams in a preferred codec within the bitrate ceiling
+    2. any audio-only stream within the ceiling
+    3. the smallest audio-only stream above the ceiling (or of unknown bitrate)
+    4. the smallest stream that has audio (video included)
+    5. anything with a URL
+
+    The ``legacy`` policy keeps the old ordering. Choices are cached per video
+    id and ceiling, and the bytes streamed are compared with what the legacy
+    ordering would have picked.
+    """
+
+    def __init__(self, name: str = Config.FORMAT_POLICY, max_entries: int = Config.FORMAT_CACHE_SIZE):
+        self.name = name if name in ('efficient', 'legacy') else 'efficient'
+        self.codecs = [c.strip().lower() for c in Config.FORMAT_CODECS.split(',') if c.strip()]
+        self.containers = [c.strip().lower() for c in Config.FORMAT_CONTAINERS.split(',') if c.strip()]
+        self.max_entries = max(1, max_entries)
+        self._cache: "OrderedDict[Tuple[str, int], str]" = OrderedDict()  # (video id, ceiling) -> format id
+        self.selections = 0
+        self.cache_hits = 0
+        self.bytes_selected = 0.0
+        self.bytes_legacy = 0.0
+        self.stages: Counter = Counter()  # fallback stage -> times used
+        self.codecs_used: Counter = Counter()
+
+    def ceiling(self, channel_bitrate: Optional[int]) -> int:
+        """Highest audio bitrate worth streaming, in kbps"""
+        if Config.FORMAT_MAX_BITRATE:
+            return Config.FORMAT_MAX_BITRATE
+        channel_kbps = (channel_bitrate or DEFAULT_CHANNEL_BITRATE) / 1000
+        return int(channel_kbps * Config.FORMAT_BITRATE_HEADROOM)
+
+    def _codec_rank(self, fmt: Dict) -> int:
+        acodec = (fmt.get('acodec') or '').lower()
+        for rank, codec in enumerate(self.codecs):
+            if acodec.startswith(codec):
+                return rank
+        return len(self.codecs)
+
+    def _container_rank(self, fmt: Dict) -> int:
+        ext = (fmt.get('ext') or '').lower()
+        return self.containers.index(ext) if ext in self.containers else len(self.containers)
+
+    def rank(self, formats: List[Dict], ceiling: int) -> Tuple[Optional[Dict], int]:
+        """Pick the best format under the policy; returns (format, fallback stage)"""
+        playable = [f for f in formats if f.get('url')]
+        audio_only = [f for f in playable if is_audio_only(f)]
+        within = [f for f in audio_only if 0 < bitrate(f) <= ceiling]
+
+        def best_within(fmt):
+            # Highest bitrate the channel can still make use of
+            return (self._codec_rank(fmt), -bitrate(fmt), self._container_rank(fmt))
+
+        def smallest(fmt):
+            return (bitrate(fmt) or float('inf'), self._codec_rank(fmt), self._container_rank(fmt))
+
+        preferred = [f for f in within if self._codec_rank(f) < len(self.codecs)]
+        if preferred:
+            return min(preferred, key=best_within), 1
+        if within:
+            return min(within, key=best_within), 2
+        if audio_only:
+            return min(audio_only, key=smallest), 3
+        with_audio = [f for f in playable if has_audio(f)]
+        if with_audio:
+            return min(with_audio, key=smallest), 4
+        if playable:
+            return playable[0], 5
+        return None, 0
+
+    def select(self, formats: List[Dict], video_id: str = None, channel_bitrate: int = None,
+               duration: int = 0) -> Optional[Dict]:
+        """Choose the format to stream for a track"""
+        if self.name == 'legacy':
+            chosen, stage = legacy_select(formats), 0
+        else:
+            ceiling = self.ceiling(channel_bitrate)
+            chosen, stage = self._cached(formats, video_id, ceiling), 0
+            if chosen is not None:
+                self.cache_hits += 1
+            else:
+                chosen, stage = self.rank(formats, ceiling)
+                if chosen is not None and video_id and chosen.get('format_id'):
+                    self._remember(video_id, ceiling, chosen['format_id'])
+
+        if chosen is None:
+            return None
+
+        self.selections += 1
+        if stage:
+            self.stages[stage] += 1
+        self.codecs_used[(chosen.get('acodec') or 'unknown').split('.')[0]] += 1
+        baseline = legacy_select(formats)
+        self.bytes_selected += estimated_size(chosen, duration)
+        self.bytes_legacy += estimated_size(baseline, duration) if baseline else 0.0
+        return chosen
+
+    def _cached(self, formats: List[Dict], video_id: Optional[str], ceiling: int) -> Optional[Dict]:
+        """Look up the format chosen last time, if it is still offered"""
+        format_id = self._cache.get((video_id, ceiling)) if video_id else None
+        if format_id is None:
+            return None
+        self._cache.move_to_end((video_id, ceiling))
+        for fmt in formats:
+            if fmt.get('format_id') == format_id and fmt.get('url'):
+                return fmt
+        return None
+
+    def _remember(self, video_id: str, ceiling: int, format_id: str):
+        self._cache[(video_id, ceiling)] = format_id
+        self._cache.move_to_end((video_id, ceiling))
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """Selection counts and estimated bandwidth compared with the legacy ordering"""
+        return {
+            'policy': self.name,
+            'selections': self.selections,
+            'cache_hits': self.cache_hits,
+            'cached_tracks': len(self._cache),
+            'stages': dict(self.stages),
+            'codecs': dict(self.codecs_used),
+            'bytes_selected': self.bytes_selected,
+            'bytes_legacy': self.bytes_legacy,
+            'bytes_saved': self.bytes_legacy - self.bytes_selected,
+        }
@@ -0,0 +1,74 @@
+import discord
+import logging
+from typing import Dict, Set
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def build_intents() -> discord.Intents:
+    """Gateway intents for the bot
+
+    The lean profile only subscribes to what the player uses: guilds and
+    their channels, voice states, guild messages for prefix commands and
+    reactions for search picks. Typing, DMs, emoji, invite, webhook and
+    moderation events are never sent to the bot.
+    """
+    if Config.LEAN_GATEWAY_CACHE:
+        intents = discord.Intents.none()
+        intents.guild_messages = True
+        intents.guild_reactions = True
+    else:
+        intents = discord.Intents.default()
+    intents.message_content = Config.MESSAGE_CONTENT_INTENT
+    intents.voice_states = True
+    intents.guilds = True
+    return intents
+
+def cache_options() -> Dict:
+    """Member and message cache settings passed to the bot
+
+    In lean mode no members are cached except the bot itself, guilds are
+    never chunked and only the last LEAN_MAX_MESSAGES messages are kept.
+    Voice states are still tracked, so voice channel occupancy and
+    ``member.voice`` keep working (see VoiceListenerCounter).
+    """
+    if not Config.LEAN_GATEWAY_CACHE:
+        return {}
+    return {
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        # Reactions are only dispatched for cached messages, so search prompts must stay in the cache
+        'max_messages': max(1, Config.LEAN_MAX_MESSAGES),
+    }
+
+class VoiceListenerCounter:
+    """Counts the people in a voice channel from its voice states
+
+    ``channel.members`` only lists members that are in the member cache,
+    which lean mode leaves empty. Voice states are always tracked, but don't
+    say whether a user is a bot, so bot accounts are remembered from the
+    voice state updates they cause. A user not seen since startup counts as
+    a listener: the bot would rather stay than leave people in silence.
+    """
+
+    def __init__(self):
+        self._bots: Set[int] = set()
+
+    def observe(self, member: discord.Member):
+        """Remember whether the user behind a voice state update is a bot"""
+        if member.bot:
+            self._bots.add(member.id)
+        else:
+            self._bots.discard(member.id)
+
+    def count(self, channel: discord.abc.GuildChannel) -> int:
+        """Number of non-bot users connected to a voice channel"""
+        guild = channel.guild
+        listeners = 0
+        for user_id in channel.voice_states:
+            member = guild.get_member(user_id)
+            if member is not None:
+                listeners += not member.bot
+            elif user_id not in self._bots:
+                listeners += 1
+        return listeners
@@ -0,0 +1,134 @@
+import logging
+import random
+import re
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from config import Config
+from metadata_db import MetadataDB
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+# Queries shorter than this (about four characters) are too vague to answer from history
+MIN_QUERY_TRIGRAMS = 6
+
+def normalize(text: str) -> str:
+    """Lowercase and reduce to letters, digits and single spaces"""
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+def trigrams(text: str) -> Set[str]:
+    """Character trigrams of a normalized string, padded at word edges"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class HistoryIndex:
+    """In-memory trigram index over previously played tracks
+
+    Lets ``!play`` answer queries for familiar songs without a YouTube
+    search, and picks autoplay tracks from per-guild co-occurrence
+    statistics stored in the metadata database.
+    """
+
+    def __init__(self, db: MetadataDB):
+        self.db = db
+        self._grams: Dict[str, Set[str]] = {}       # trigram -> video ids
+        self._track_grams: Dict[str, Set[str]] = {} # video id -> trigrams of its title
+        self._recent: Dict[int, Deque[str]] = {}    # guild_id -> recently played video ids
+        self._load()
+
+    def __len__(self):
+        return len(self._track_grams)
+
+    def _load(self):
+        """Build the index from the tracks in the database"""
+        started = time.perf_counter()
+        try:
+            for video_id, title in self.db.get_played_tracks(Config.HISTORY_INDEX_SIZE):
+                self.add(video_id, title)
+        except Exception as e:
+            logger.error(f"Could not load play history index: {e}")
+        logger.info(f"Loaded {len(self)} tracks into history index in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def add(self, video_id: str, title: str):
+        """Index a track's title (no-op if already indexed)"""
+        if video_id in self._track_grams or not title:
+            return
+        grams = trigrams(normalize(title))
+        self._track_grams[video_id] = grams
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(video_id)
+
+    def record_play(self, guild_id: int, video_id: str, title: str, prev_video_id: str = None):
+        """Update play statistics and the index after a track starts"""
+        self.add(video_id, title)
+        recent = self._recent.setdefault(guild_id, deque(maxlen=Config.AUTOPLAY_HISTORY_SIZE))
+        recent.append(video_id)
+        self.db.record_play(guild_id, video_id, prev_video_id)
+
+    def search(self, query: str, guild_id: int, limit: int = 5) -> List[Tuple[str, float, float]]:
+        """Fuzzy-match a query against the titles of tracks the guild has played
+
+        Returns (video_id, coverage, similarity) triples. Coverage is the
+        fraction of the query's trigrams found in the title; similarity is
+        the Dice coefficient of both trigram sets, which also drops when the
+        title has much more in it than the query (remixes, loops, edits).
+        Ranked by similarity, then the guild's play count and recency.
+        """
+        query_grams = trigrams(normalize(query))
+        if len(query_grams) < MIN_QUERY_TRIGRAMS:
+            return []
+
+        overlaps = Counter()
+        for gram in query_grams:
+            for video_id in self._grams.get(gram, ()):
+                overlaps[video_id] += 1
+        if not overlaps:
+            return []
+
+        # The index is shared by all guilds: take the closest titles, then keep the guild's own
+        similar = sorted(((2 * overlap / (len(query_grams) + len(self._track_grams[video_id])), overlap, video_id)
+                          for video_id, overlap in overlaps.items()), reverse=True)[:limit * 20]
+        plays = self.db.get_guild_plays(guild_id, [video_id for _, _, video_id in similar])
+        now = time.time()
+
+        scored = []
+        for similarity, overlap, video_id in similar:
+            if video_id not in plays:
+                continue
+            play_count, last_played = plays[video_id]
+            popularity = min(play_count, 100) / 1000
+            recency = 0.05 / (1 + (now - last_played) / 86400) if last_played else 0.0
+            scored.append((similarity + popularity + recency, overlap / len(query_grams), similarity, video_id))
+
+        scored.sort(reverse=True)
+        return [(video_id, coverage, similarity) for _, coverage, similarity, video_id in scored[:limit]]
+
+    def find_match(self, query: str, guild_id: int) -> Optional[str]:
+        """Get the best near-exact match for a query among the guild's played tracks, if any"""
+        for video_id, coverage, similarity in self.search(query, guild_id):
+            if coverage >= Config.HISTORY_MATCH_THRESHOLD and similarity >= Config.HISTORY_MIN_SIMILARITY:
+                return video_id
+        return None
+
+    def pick_next(self, guild_id: int, prev_video_id: Optional[str]) -> Optional[str]:
+        """Pick an autoplay track from what usually follows the previous one"""
+        recent = set(self._recent.get(guild_id, ()))
+
+        candidates = []
+        if prev_video_id:
+            candidates = [(video_id, count) for video_id, count
+                          in self.db.get_next_candidates(guild_id, prev_video_id)
+                          if video_id not in recent]
+        if not candidates:
+            # Nothing usually follows this track: fall back to the guild's favourites
+            candidates = [(video_id, count) for video_id, count
+                          in self.db.get_top_tracks(guild_id)
+                          if video_id not in recent]
+        if not candidates:
+            return None
+
+        # Weighted choice so autoplay doesn't always repeat the same chain
+        video_ids, weights = zip(*candidates)
+        return random.choices(video_ids, weights=weights, k=1)[0]
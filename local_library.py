@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from config import Config
+from history_index import MIN_QUERY_TRIGRAMS, normalize, trigrams
+from metadata_db import MetadataDB
+
+logger = logging.getLogger(__name__)
+
+# Rows are written to the database in batches of this many files
+WRITE_BATCH_SIZE = 500
+
+LOCAL_PREFIX = 'local:'
+
+def is_remote(url: str) -> bool:
+    """Whether a stream URL needs the network (as opposed to a local file)"""
+    return url.startswith(('http://', 'https://'))
+
+def is_local_id(video_id: Optional[str]) -> bool:
+    """Whether a track id refers to a file in the local library"""
+    return bool(video_id) and video_id.startswith(LOCAL_PREFIX)
+
+def track_id(path: str) -> str:
+    """Stable track id for a library file, used wherever a video id would be"""
+    return LOCAL_PREFIX + hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+
+def display_title(path: str, title: Optional[str], artist: Optional[str]) -> str:
+    """'Artist - Title' from the tags, or the file name if untagged"""
+    title = title or os.path.splitext(os.path.basename(path))[0]
+    return f"{artist} - {title}" if artist else title
+
+def probe(path: str) -> Optional[Tuple[Optional[str], Optional[str], Optional[str], int]]:
+    """Read (title, artist, album, duration) with ffprobe; None if it isn't playable audio"""
+    args = [
+        'ffprobe', '-v', 'error', '-of', 'json',
+        '-show_entries', 'format=duration:format_tags:stream=codec_type',
+        path
+    ]
+    try:
+        result = subprocess.run(args, capture_output=True, text=True, timeout=Config.LOCAL_LIBRARY_PROBE_TIMEOUT)
+        info = json.loads(result.stdout or '{}')
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        logger.warning(f"Could not probe {path}: {e}")
+        return None
+    if not any(stream.get('codec_type') == 'audio' for stream in info.get('streams', [])):
+        return None
+    fmt = info.get('format', {})
+    # Tag names vary in case between containers (ID3 TITLE, Vorbis title, ...)
+    tags = {key.lower(): value for key, value in fmt.get('tags', {}).items()}
+    try:
+        duration = int(float(fmt.get('duration', 0)))
+    except (TypeError, ValueError):
+        duration = 0
+    return tags.get('title'), tags.get('artist'), tags.get('album'), duration
+
+class LocalLibrary:
+    """Index of a local music directory, searched before YouTube
+
+    Scans are incremental: files whose size and modification time are
+    unchanged since the last scan aren't probed again. New and changed files
+    are probed in parallel with ffprobe and stored in the metadata database,
+    so restarts only need to stat the tree. The tree is rescanned every
+    LOCAL_LIBRARY_SCAN_INTERVAL seconds to pick up changes.
+    """
+
+    def __init__(self, db: MetadataDB, root: str = Config.LOCAL_LIBRARY_PATH):
+        self.db = db
+        self.root = os.path.abspath(os.path.expanduser(root)) if root else ''
+        self.extensions = {ext.strip().lower() for ext in Config.LOCAL_LIBRARY_EXTENSIONS.split(',') if ext.strip()}
+        self._tracks: Dict[str, Tuple[str, str, int]] = {}  # track id -> (path, display title, duration)
+        self._grams: Dict[str, Set[str]] = {}               # trigram -> track ids
+        self._track_grams: Dict[str, Set[str]] = {}         # track id -> trigrams of its search text
+        self._names: Dict[str, Tuple[str, ...]] = {}        # track id -> title, artist and title, file name (normalized)
+        self._lock = threading.Lock()  # scans run in a worker thread while lookups run on the event loop
+        self._scan_lock = threading.Lock()
+        self._watcher: Optional[asyncio.Task] = None
+        self.last_scan: Optional[Dict] = None
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def _load(self):
+        """Build the search index from the files indexed by previous scans"""
+        started = time.perf_counter()
+        try:
+            for row in self.db.get_library_tracks(os.path.join(self.root, '')):
+                self._index(*row)
+        except Exception as e:
+            logger.error(f"Could not load local library index: {e}")
+        logger.info(f"Loaded {len(self)} local tracks in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _index(self, path: str, title: Optional[str], artist: Optional[str], album: Optional[str], duration: int):
+        key = track_id(path)
+        self._unindex(key)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        grams = trigrams(normalize(' '.join(part for part in (artist, title, album, stem) if part)))
+        names = {normalize(name) for name in (title, f"{artist} {title}" if artist and title else None, stem) if name}
+        with self._lock:
+            self._tracks[key] = (path, display_title(path, title, artist), duration or 0)
+            self._track_grams[key] = grams
+            self._names[key] = tuple(names)
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(key)
+
+    def _unindex(self, key: str):
+        with self._lock:
+            self._tracks.pop(key, None)
+            self._names.pop(key, None)
+            for gram in self._track_grams.pop(key, ()):
+                keys = self._grams.get(gram)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self._grams[gram]
+
+    def _walk(self) -> Dict[str, Tuple[float, int]]:
+        """Collect {path: (mtime, size)} for every audio file under the root"""
+        files = {}
+        pending = [self.root]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif os.path.splitext(entry.name)[1].lower() in self.extensions:
+                                stat = entry.stat()
+                                files[entry.path] = (stat.st_mtime, stat.st_size)
+                        except OSError:
+                            continue
+            except OSError as e:
+                logger.warning(f"Could not read {directory}: {e}")
+        return files
+
+    def scan(self) -> Dict:
+        """Bring the index up to date with the directory tree (blocking)"""
+        with self._scan_lock:
+            started = time.perf_counter()
+            current = self._walk()
+            known = self.db.get_library_files(os.path.join(self.root, ''))
+            changed = [path for path, signature in current.items() if known.get(path) != signature]
+            removed = [path for path in known if path not in current]
+
+            failed = 0
+            rows = []
+            with ThreadPoolExecutor(max_workers=max(1, Config.LOCAL_LIBRARY_WORKERS),
+                                    thread_name_prefix='library-probe') as pool:
+                for path, info in zip(changed, pool.map(probe, changed)):
+                    mtime, size = current[path]
+                    if info is None:
+                        # Remembered without a duration so it isn't probed again until it changes
+                        failed += 1
+                        rows.append((path, mtime, size, None, None, None, None))
+                        self._unindex(track_id(path))
+                    else:
+                        rows.append((path, mtime, size, *info))
+                        self._index(path, *info)
+                    if len(rows) >= WRITE_BATCH_SIZE:
+                        self.db.upsert_library_files(rows)
+                        rows = []
+            if rows:
+                self.db.upsert_library_files(rows)
+
+            if removed:
+                self.db.delete_library_files(removed)
+                for path in removed:
+                    self._unindex(track_id(path))
+
+            self.last_scan = {
+                'files': len(current),
+                'probed': len(changed),
+                'failed': failed,
+                'removed': len(removed),
+                'seconds': time.perf_counter() - started,
+                'finished_at': time.time(),
+            }
+        if changed or removed:
+            logger.info(f"Scanned local library: {len(current)} files, {len(changed)} new or changed, "
+                        f"{len(removed)} removed, {failed} unplayable in {self.last_scan['seconds']:.1f}s")
+        return self.last_scan
+
+    def start(self):
+        """Scan in the background now and then every LOCAL_LIBRARY_SCAN_INTERVAL seconds"""
+        if not self.enabled:
+            return
+        if not os.path.isdir(self.root):
+            logger.error(f"Local library directory {self.root} does not exist")
+            return
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.scan)
+            except Exception as e:
+                logger.error(f"Local library scan failed: {e}")
+            if Config.LOCAL_LIBRARY_SCAN_INTERVAL <= 0:
+                return
+            await asyncio.sleep(Config.LOCAL_LIBRARY_SCAN_INTERVAL)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[str, float, float]]:
+        """Fuzzy-match a query against the library; (track id, coverage, similarity) triples, best first
+
+        Coverage is the share of the query's trigrams found in the file's tags
+        and name. Similarity is the best Dice coefficient between the query
+        and the title, artist and title, or file name, so a file whose name
+        only contains the query among other words scores low.
+        """
+        query_grams = trigrams(normalize(query))
+        if len(query_grams) < MIN_QUERY_TRIGRAMS:
+            return []
+        overlaps = Counter()
+        with self._lock:
+            for gram in query_grams:
+                for key in self._grams.get(gram, ()):
+                    overlaps[key] += 1
+            candidates = [(key, overlap, self._names.get(key, ())) for key, overlap in overlaps.most_common(limit * 20)]
+        scored = []
+        for key, overlap, names in candidates:
+            similarity = 0.0
+            for name in names:
+                grams = trigrams(name)
+                similarity = max(similarity, 2 * len(query_grams & grams) / (len(query_grams) + len(grams)))
+            scored.append((similarity, overlap / len(query_grams), key))
+        scored.sort(reverse=True)
+        return [(key, coverage, similarity) for similarity, coverage, key in scored[:limit]]
+
+    def find(self, query: str) -> Optional[Tuple[str, str, str, int]]:
+        """Best match for a query as (track id, path, title, duration), if close enough"""
+        results = self.search(query, limit=1)
+        if (not results or results[0][1] < Config.LOCAL_LIBRARY_MATCH_THRESHOLD
+                or results[0][2] < Config.LOCAL_LIBRARY_MIN_SIMILARITY):
+            return None
+        key = results[0][0]
+        with self._lock:
+            track = self._tracks.get(key)
+        return (key, *track) if track else None
@@ -0,0 +1,118 @@
+import json
+import logging
+import math
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Set
+from config import Config
+from local_library import is_remote
+from metadata_db import MetadataDB
+
+logger = logging.getLogger(__name__)
+
+class LoudnessAnalyzer:
+    """Measures track loudness (EBU R128) in the background, once per track
+    
+    Analysis runs FFmpeg's loudnorm filter in measurement mode on a worker
+    pool. The resulting gain is stored in the metadata database and folded
+    into the playback volume, so normalization costs nothing at play time.
+    Tracks that have not been analyzed yet play at unity gain.
+    """
+    
+    def __init__(self, db: MetadataDB, max_workers: int = Config.LOUDNESS_WORKERS):
+        self.db = db
+        self.enabled = Config.LOUDNESS_NORMALIZATION
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='loudness')
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+    
+    def get_gain(self, key: str) -> float:
+        """Get the linear gain factor for a track (1.0 if not analyzed)"""
+        if not self.enabled or not key:
+            return 1.0
+        try:
+            gain_db = self.db.get_gain_db(key)
+        except Exception as e:
+            logger.warning(f"Could not read loudness gain for {key}: {e}")
+            return 1.0
+        if gain_db is None:
+            return 1.0
+        return 10 ** (gain_db / 20)
+    
+    def schedule(self, key: str, url: str):
+        """Queue a track for analysis unless it is analyzed or already queued"""
+        if not self.enabled or not key or not url:
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        try:
+            gain_db, analyzed_at = self.db.get_loudness_state(key)
+        except Exception as e:
+            logger.warning(f"Could not read loudness state for {key}: {e}")
+            with self._lock:
+                self._pending.discard(key)
+            return
+        # Don't download and decode the whole track again on every play after a failure
+        recently_failed = analyzed_at is not None and time.time() - analyzed_at < Config.LOUDNESS_RETRY_AFTER
+        if gain_db is not None or recently_failed:
+            with self._lock:
+                self._pending.discard(key)
+            return
+        self._executor.submit(self._analyze, key, url)
+    
+    def _analyze(self, key: str, url: str):
+        """Measure integrated loudness with FFmpeg and store the gain"""
+        try:
+            loudness = self.measure(url)
+            if loudness is None:
+                self.db.mark_loudness_failed(key)
+                return
+            gain_db = max(-Config.LOUDNESS_MAX_GAIN_DB, min(Config.LOUDNESS_TARGET - loudness, Config.LOUDNESS_MAX_GAIN_DB))
+            self.db.set_loudness(key, loudness, gain_db)
+            logger.info(f"Analyzed loudness for {key}: {loudness:.1f} LUFS, gain {gain_db:+.1f} dB")
+        except Exception as e:
+            logger.warning(f"Loudness analysis failed for {key}: {e}")
+            try:
+                self.db.mark_loudness_failed(key)
+            except Exception as e:
+                logger.warning(f"Could not record failed analysis for {key}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+    
+    def measure(self, url: str) -> Optional[float]:
+        """Run a loudnorm measurement pass and return integrated loudness in LUFS"""
+        # Local files can't take the reconnect options
+        ffmpeg_options = Config.FFMPEG_OPTIONS if is_remote(url) else Config.LOCAL_FFMPEG_OPTIONS
+        args = [
+            'ffmpeg', '-hide_banner', '-nostats',
+            *ffmpeg_options.get('before_options', '').split(),
+            '-i', url, '-vn',
+            '-af', f'loudnorm=I={Config.LOUDNESS_TARGET}:print_format=json',
+            '-f', 'null', '-'
+        ]
+        result = subprocess.run(args, capture_output=True, text=True, timeout=Config.LOUDNESS_TIMEOUT)
+        
+        # loudnorm prints its JSON summary at the end of stderr
+        output = result.stderr
+        start = output.rfind('{')
+        end = output.rfind('}')
+        if start == -1 or end < start:
+            logger.warning(f"No loudnorm output (exit code {result.returncode})")
+            return None
+        
+        stats = json.loads(output[start:end + 1])
+        try:
+            loudness = float(stats['input_i'])
+        except (KeyError, ValueError):
+            return None
+        # Silent tracks report -inf
+        return None if math.isinf(loudness) else loudness
+    
+    def shutdown(self):
+        """Stop accepting work and let running analyses finish"""
+        self._executor.shutdown(wait=False)
@@ -1,9 +1,21 @@
+import time
+STARTUP_STARTED = time.perf_counter()
+
 import discord
 from discord.ext import commands
 import asyncio
 import logging
 from config import Config
-from music_player import MusicPlayer, Song
+from music_player import MusicPlayer, Song, format_duration, get_yt_dlp, video_url
+from queue_view import QueuePaginator, QueueView
+from message_dispatcher import MessageDispatcher, PRIORITY_COSMETIC
+from supervisor import GatewaySupervisor
+from slash_commands import setup_slash_commands, sync_slash_commands
+from memory_diagnostics import MemoryDiagnostics, rss_mb
+from state_backend import GuildOwnedElsewhere
+from command_trace import CommandTraceRecorder
+from command_profiler import CommandProfiler
+from gateway_cache import VoiceListenerCounter, build_intents, cache_options
 
 # Configure logging
 logging.basicConfig(
@@ -16,20 +28,69 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Bot setup
-intents = discord.Intents.default()
-intents.message_content = True
-intents.voice_states = True
-intents.guilds = True
+# Startup phases: (name, seconds since process start)
+startup_timings = [('imports', time.perf_counter() - STARTUP_STARTED)]
+
+def mark_startup(phase: str):
+    """Record when a startup phase finished"""
+    startup_timings.append((phase, time.perf_counter() - STARTUP_STARTED))
+
+def format_startup_timings() -> str:
+    """Format the startup phases as a per-phase breakdown"""
+    parts = []
+    previous = 0.0
+    for phase, elapsed in startup_timings:
+        parts.append(f"{phase} {elapsed - previous:.2f}s")
+        previous = elapsed
+    return f"{', '.join(parts)} (total {previous:.2f}s)"
+
+# Bot setup (LEAN_GATEWAY_CACHE trims intents and caches, see gateway_cache.py)
+intents = build_intents()
 
-bot = commands.Bot(command_prefix=Config.BOT_PREFIX, intents=intents, help_command=None)
+# Without message content, prefix commands only work when they start with a mention of the bot
+command_prefix = Config.BOT_PREFIX if Config.MESSAGE_CONTENT_INTENT else commands.when_mentioned_or(Config.BOT_PREFIX)
+
+bot = commands.Bot(command_prefix=command_prefix, intents=intents, help_command=None, **cache_options())
 music_player = MusicPlayer(bot)
+queue_paginator = QueuePaginator(music_player)
+if Config.SLASH_COMMANDS_ENABLED:
+    setup_slash_commands(bot, music_player, queue_paginator)
+dispatcher = MessageDispatcher()
+memory = MemoryDiagnostics(music_player, bot)
+command_trace = CommandTraceRecorder()
+command_trace.install(bot)
+profiler = CommandProfiler(bot)
+supervisor = GatewaySupervisor(bot, Config.DISCORD_TOKEN)
+voice_listeners = VoiceListenerCounter()
+mark_startup('setup')
+
+@bot.event
+async def setup_hook():
+    """Called after login, before connecting to the gateway"""
+    mark_startup('login')
+    
+    # Probe connectivity in the background instead of delaying the connection
+    if Config.STARTUP_CONNECTIVITY_CHECK:
+        bot.loop.create_task(test_discord_connectivity())
+    
+    if Config.SLASH_COMMANDS_ENABLED and Config.SLASH_COMMANDS_SYNC:
+        bot.loop.create_task(sync_slash_commands(bot))
 
 @bot.event
 async def on_ready():
     """Called when the bot is ready"""
     logger.info(f'{bot.user} has connected to Discord!')
     logger.info(f'Bot is in {len(bot.guilds)} guilds')
+    supervisor.note_connected()
+    
+    if not any(phase == 'ready' for phase, _ in startup_timings):
+        mark_startup('ready')
+        logger.info(f"Startup time: {format_startup_timings()}")
+        
+        # Warm up yt-dlp off the event loop so the first !play doesn't pay for the import
+        bot.loop.run_in_executor(None, get_yt_dlp)
+        memory.start_sampling()
+        music_player.library.start()
     
     # Set bot status
     await bot.change_presence(
@@ -39,6 +100,17 @@ async def on_ready():
         )
     )
 
+@bot.event
+async def on_disconnect():
+    """Called when the gateway connection drops"""
+    logger.warning("Disconnected from Discord gateway")
+    supervisor.note_disconnect()
+
+@bot.event
+async def on_resumed():
+    """Called when the gateway session is resumed after a drop"""
+    supervisor.note_connected()
+
 @bot.event
 async def on_command_error(ctx, error):
     """Handle command errors"""
@@ -66,16 +138,18 @@ async def join(ctx):
     channel = ctx.author.voice.channel
     
     try:
-        voice_client = await channel.connect()
-        music_player.voice_clients[ctx.guild.id] = voice_client
-        
-        # Ensure volume is properly initialized
-        music_player.set_volume(ctx.guild.id, Config.DEFAULT_VOLUME)
+        await music_player.connect(channel)
         
         await ctx.send(f"🎵 Joined **{channel.name}** and ready to play music!")
-        logger.info(f"Bot joined voice channel {channel.name} in guild {ctx.guild.id}")
         logger.info(f"Initialized volume for guild {ctx.guild.id}: {music_player.get_volume(ctx.guild.id)}")
         
+        # Pick up a queue handed over by another node
+        if music_player.get_queue(ctx.guild.id) and not music_player.now_playing.get(ctx.guild.id):
+            await ctx.send(f"📋 Resuming the saved queue ({len(music_player.get_queue(ctx.guild.id))} songs)")
+            await music_player.play_next(ctx.guild.id)
+        
+    except GuildOwnedElsewhere:
+        await ctx.send("❌ Another instance of the bot is already playing in this server!")
     except Exception as e:
         logger.error(f"Error joining voice channel: {e}")
         await ctx.send("❌ Failed to join the voice channel!")
@@ -95,13 +169,11 @@ async def search(ctx, *, query: str):
         songs = await music_player.search_youtube_multiple(query, max_results=5)
         
         if not songs:
-            await searching_msg.edit(content="❌ No songs found for that query!")
+            dispatcher.edit(searching_msg, content="❌ No songs found for that query!")
             return
         
         # Store search results for this user (for playresult command)
-        if not hasattr(music_player, 'last_search_results'):
-            music_player.last_search_results = {}
-        music_player.last_search_results[ctx.author.id] = songs
+        music_player.search_results.put(ctx.author.id, songs)
         
         # Create search results embed
         embed = discord.Embed(
@@ -121,12 +193,15 @@ async def search(ctx, *, query: str):
         embed.set_footer(text="React with 1️⃣ 2️⃣ 3️⃣ 4️⃣ 5️⃣ to play, or wait 60 seconds")
         
         # Send the search results
-        search_msg = await searching_msg.edit(content="", embed=embed)
+        search_msg = searching_msg
+        dispatcher.edit(search_msg, content="", embed=embed)
         
-        # Add reaction options
+        # Add reaction options in the background so the user can react right away
         reactions = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣']
-        for i, reaction in enumerate(reactions[:len(songs)]):
-            await search_msg.add_reaction(reaction)
+        dispatcher.add_reactions(search_msg, reactions[:len(songs)])
+        
+        # Resolve the top results while the user decides, so the pick starts playing right away
+        prefetch = music_player.prefetcher.start(songs, ctx.author.voice.channel.bitrate)
         
         # Wait for user reaction
         def check(reaction, user):
@@ -138,13 +213,14 @@ async def search(ctx, *, query: str):
             # Get the selected song index
             song_index = reactions.index(str(reaction.emoji))
             selected_song = songs[song_index]
+            prefetch.cancel(keep=selected_song.video_id)
             
             # Set the requester
             selected_song.requester = ctx.author
             
             # Check song length
             if selected_song.duration > Config.MAX_SONG_LENGTH:
-                await search_msg.edit(content=f"❌ **{selected_song.title}** is too long! Maximum allowed: {Config.MAX_SONG_LENGTH // 60} minutes")
+                dispatcher.edit(search_msg, content=f"❌ **{selected_song.title}** is too long! Maximum allowed: {Config.MAX_SONG_LENGTH // 60} minutes")
                 return
             
             # Ensure bot is in voice channel
@@ -155,22 +231,23 @@ async def search(ctx, *, query: str):
             added = await music_player.add_to_queue(ctx.guild.id, selected_song)
             
             if not added:
-                await search_msg.edit(content="❌ Queue is full!")
+                dispatcher.edit(search_msg, content="❌ Queue is full!")
                 return
             
             # Update message
-            await search_msg.edit(content=f"✅ Added to queue: **{selected_song.title}** ({selected_song.formatted_duration})")
+            dispatcher.edit(search_msg, content=f"✅ Added to queue: **{selected_song.title}** ({selected_song.formatted_duration})")
             
             # Start playing if nothing is currently playing
             if not music_player.now_playing.get(ctx.guild.id):
                 await music_player.play_next(ctx.guild.id)
                 
         except asyncio.TimeoutError:
-            await search_msg.edit(content="⏰ Search timed out. Use `!play <query>` to play directly.")
+            prefetch.cancel()
+            dispatcher.edit(search_msg, priority=PRIORITY_COSMETIC, content="⏰ Search timed out. Use `!play <query>` to play directly.")
             
     except Exception as e:
         logger.error(f"Error in search command: {e}")
-        await searching_msg.edit(content="❌ An error occurred while searching!")
+        dispatcher.edit(searching_msg, content="❌ An error occurred while searching!")
 
 @bot.command(name='quicksearch', aliases=['qs'])
 async def quicksearch(ctx, *, query: str):
@@ -187,13 +264,11 @@ async def quicksearch(ctx, *, query: str):
         songs = await music_player.search_youtube_multiple(query, max_results=5)
         
         if not songs:
-            await searching_msg.edit(content="❌ No songs found for that query!")
+            dispatcher.edit(searching_msg, content="❌ No songs found for that query!")
             return
         
         # Store search results for this user (for playresult command)
-        if not hasattr(music_player, 'last_search_results'):
-            music_player.last_search_results = {}
-        music_player.last_search_results[ctx.author.id] = songs
+        music_player.search_results.put(ctx.author.id, songs)
         
         # Create simple search results
         result_text = f"🔍 **Search Results for: {query}**\n\n"
@@ -205,11 +280,11 @@ async def quicksearch(ctx, *, query: str):
         
         result_text += "💡 **Tip:** Use `!search <query>` for interactive selection with reactions!"
         
-        await searching_msg.edit(content=result_text)
+        dispatcher.edit(searching_msg, content=result_text)
         
     except Exception as e:
         logger.error(f"Error in quicksearch command: {e}")
-        await searching_msg.edit(content="❌ An error occurred while searching!")
+        dispatcher.edit(searching_msg, content="❌ An error occurred while searching!")
 
 @bot.command(name='playresult')
 async def playresult(ctx, number: int):
@@ -219,10 +294,7 @@ async def playresult(ctx, number: int):
         return
     
     # Check if there are stored search results for this user
-    if not hasattr(music_player, 'last_search_results'):
-        music_player.last_search_results = {}
-    
-    user_results = music_player.last_search_results.get(ctx.author.id, [])
+    user_results = music_player.search_results.get(ctx.author.id)
     
     if not user_results:
         await ctx.send("❌ No search results found! Use `!search <query>` first.")
@@ -252,21 +324,17 @@ async def playresult(ctx, number: int):
         await ctx.send("❌ Queue is full!")
         return
     
-            # Update message
-        await ctx.send(f"✅ Added to queue: **{selected_song.title}** ({selected_song.formatted_duration})")
+    # Update message
+    await ctx.send(f"✅ Added to queue: **{selected_song.title}** ({selected_song.formatted_duration})")
     
-        # Start playing if nothing is currently playing
-        if not music_player.now_playing.get(ctx.guild.id):
-            await music_player.play_next(ctx.guild.id)
+    # Start playing if nothing is currently playing
+    if not music_player.now_playing.get(ctx.guild.id):
+        await music_player.play_next(ctx.guild.id)
 
 @bot.command(name='clearsearch')
 async def clearsearch(ctx):
     """Clear stored search results for the user"""
-    if not hasattr(music_player, 'last_search_results'):
-        music_player.last_search_results = {}
-    
-    if ctx.author.id in music_player.last_search_results:
-        del music_player.last_search_results[ctx.author.id]
+    if music_player.search_results.remove(ctx.author.id):
         await ctx.send("🗑️ Cleared your stored search results!")
     else:
         await ctx.send("📭 No stored search results to clear!")
@@ -300,6 +368,27 @@ async def autodisconnect(ctx, setting: str):
         await ctx.send(f"❓ **Current setting:** Auto-disconnect is **{status}**\n"
                       f"Use `{Config.BOT_PREFIX}autodisconnect on` or `{Config.BOT_PREFIX}autodisconnect off`")
 
+@bot.command(name='autoplay', aliases=['ap'])
+async def autoplay(ctx, setting: str = None):
+    """Enable or disable autoplay from play history when the queue runs out"""
+    setting = (setting or '').lower()
+    
+    if setting in ['on', 'enable', 'true', '1']:
+        music_player.set_autoplay(ctx.guild.id, True)
+        await ctx.send("✅ **Autoplay enabled!** When the queue runs out I'll pick songs this server likes.")
+        logger.info(f"Autoplay enabled for guild {ctx.guild.id}")
+        
+    elif setting in ['off', 'disable', 'false', '0']:
+        music_player.set_autoplay(ctx.guild.id, False)
+        await ctx.send("❌ **Autoplay disabled!** I'll stop when the queue runs out.")
+        logger.info(f"Autoplay disabled for guild {ctx.guild.id}")
+        
+    else:
+        current_setting = music_player.autoplay_enabled.get(ctx.guild.id, False)
+        status = "enabled" if current_setting else "disabled"
+        await ctx.send(f"❓ **Current setting:** Autoplay is **{status}**\n"
+                      f"Use `{Config.BOT_PREFIX}autoplay on` or `{Config.BOT_PREFIX}autoplay off`")
+
 @bot.command(name='play', aliases=['p'])
 async def play(ctx, *, query: str):
     """Play a song from YouTube"""
@@ -307,6 +396,11 @@ async def play(ctx, *, query: str):
         await ctx.send("❌ You need to be in a voice channel first!")
         return
     
+    # Several songs pasted on separate lines are queued as a batch
+    if len(query.strip().splitlines()) > 1:
+        await ctx.invoke(bot.get_command('playmany'), queries=query)
+        return
+    
     if not ctx.guild.voice_client:
         await ctx.invoke(bot.get_command('join'))
     
@@ -314,11 +408,13 @@ async def play(ctx, *, query: str):
     searching_msg = await ctx.send(f"🔍 Searching for: **{query}**")
     
     try:
-        # Search for the song
-        song = await music_player.search_youtube(query)
+        # Local files and songs this server has played before are answered without YouTube
+        song = music_player.find_known(query, ctx.guild.id)
+        if not song:
+            song = await music_player.search_youtube(query)
         
         if not song:
-            await searching_msg.edit(content="❌ No songs found for that query!")
+            dispatcher.edit(searching_msg, content="❌ No songs found for that query!")
             return
         
         # Set the requester
@@ -326,18 +422,18 @@ async def play(ctx, *, query: str):
         
         # Check song length
         if song.duration > Config.MAX_SONG_LENGTH:
-            await searching_msg.edit(content=f"❌ Song is too long! Maximum allowed: {Config.MAX_SONG_LENGTH // 60} minutes")
+            dispatcher.edit(searching_msg, content=f"❌ Song is too long! Maximum allowed: {Config.MAX_SONG_LENGTH // 60} minutes")
             return
         
         # Add to queue
         added = await music_player.add_to_queue(ctx.guild.id, song)
         
         if not added:
-            await searching_msg.edit(content="❌ Queue is full!")
+            dispatcher.edit(searching_msg, content="❌ Queue is full!")
             return
         
         # Update message
-        await searching_msg.edit(content=f"✅ Added to queue: **{song.title}** ({song.formatted_duration})")
+        dispatcher.edit(searching_msg, content=f"✅ Added to queue: **{song.title}** ({song.formatted_duration})")
         
         # Start playing if nothing is currently playing
         if not music_player.now_playing.get(ctx.guild.id):
@@ -345,7 +441,64 @@ async def play(ctx, *, query: str):
         
     except Exception as e:
         logger.error(f"Error in play command: {e}")
-        await searching_msg.edit(content="❌ An error occurred while searching for the song!")
+        dispatcher.edit(searching_msg, content="❌ An error occurred while searching for the song!")
+
+def split_queries(text: str):
+    """Split a batch request into queries, one per line or separated by ';'"""
+    return [query.strip() for line in text.splitlines() for query in line.split(';') if query.strip()]
+
+@bot.command(name='playmany', aliases=['pm'])
+async def playmany(ctx, *, queries: str):
+    """Queue several songs at once, one per line or separated by ';'"""
+    if not ctx.author.voice:
+        await ctx.send("❌ You need to be in a voice channel first!")
+        return
+    
+    queries = split_queries(queries)[:Config.MAX_PLAYLIST_SIZE]
+    if not queries:
+        await ctx.send(f"❌ Give me some songs, e.g. `{Config.BOT_PREFIX}playmany despacito; billie jean`")
+        return
+    
+    if not ctx.guild.voice_client:
+        await ctx.invoke(bot.get_command('join'))
+    
+    processing_msg = await ctx.send(f"🔍 Searching for **{len(queries)}** songs...")
+    
+    added = 0
+    failed = []
+    play_task = None
+    try:
+        # Lookups run concurrently but songs are queued in the order they were asked for
+        async for query, song in music_player.resolve_many(queries, guild_id=ctx.guild.id):
+            if not song or song.duration > Config.MAX_SONG_LENGTH:
+                failed.append(query)
+                continue
+            
+            song.requester = ctx.author
+            if not await music_player.add_to_queue(ctx.guild.id, song):
+                failed.append(query)
+                break
+            added += 1
+            
+            # Start the first song right away instead of waiting for the whole batch
+            if play_task is None and not music_player.now_playing.get(ctx.guild.id):
+                play_task = asyncio.create_task(music_player.play_next(ctx.guild.id))
+            
+            # Edits are coalesced by the dispatcher, so progress updates are cheap
+            dispatcher.edit(processing_msg, content=f"🔍 Queued **{added}**/{len(queries)} songs... (latest: **{song.title}**)")
+        
+        if not added:
+            dispatcher.edit(processing_msg, content="❌ None of those songs could be found!")
+            return
+        
+        summary = f"✅ Added **{added}** songs to the queue!"
+        if failed:
+            summary += f"\n⚠️ Skipped (not found, too long or queue full): {', '.join(failed)[:1500]}"
+        dispatcher.edit(processing_msg, content=summary)
+        
+    except Exception as e:
+        logger.error(f"Error in playmany command: {e}")
+        dispatcher.edit(processing_msg, content="❌ An error occurred while searching for the songs!")
 
 @bot.command(name='skip', aliases=['s'])
 async def skip(ctx):
@@ -368,7 +521,7 @@ async def stop(ctx):
     await ctx.send("⏹️ Stopped playback and cleared the queue!")
 
 @bot.command(name='queue', aliases=['q'])
-async def queue(ctx):
+async def queue(ctx, page: int = 1):
     """Show the current music queue"""
     queue_info = music_player.get_queue_info(ctx.guild.id)
     
@@ -376,33 +529,15 @@ async def queue(ctx):
         await ctx.send("📭 The queue is empty!")
         return
     
-    embed = discord.Embed(title="🎵 Music Queue", color=0x00ff00)
-    
-    # Current song
-    if queue_info['current_song']:
-        current = queue_info['current_song']
-        embed.add_field(
-            name="🎶 Now Playing",
-            value=f"**{current.title}** ({current.formatted_duration})\nRequested by: {current.requester.display_name}",
-            inline=False
-        )
-    
-    # Queue
-    if queue_info['queue']:
-        queue_text = ""
-        for i, song in enumerate(queue_info['queue'][:10], 1):  # Show first 10 songs
-            queue_text += f"**{i}.** {song.title} ({song.formatted_duration}) - {song.requester.display_name}\n"
-        
-        if len(queue_info['queue']) > 10:
-            queue_text += f"\n... and {len(queue_info['queue']) - 10} more songs"
-        
-        embed.add_field(name="📋 Up Next", value=queue_text, inline=False)
-    
-    # Volume
-    embed.add_field(name="🔊 Volume", value=f"{int(queue_info['volume'] * 100)}%", inline=True)
-    embed.add_field(name="📊 Queue Length", value=str(queue_info['queue_length']), inline=True)
+    view = QueueView(queue_paginator, ctx.guild.id, page - 1)
+    embed = queue_paginator.get_page(ctx.guild.id, view.page)
     
-    await ctx.send(embed=embed)
+    # Only show navigation buttons when there is more than one page
+    if queue_paginator.page_count(ctx.guild.id) > 1:
+        view.message = await ctx.send(embed=embed, view=view)
+    else:
+        view.stop()
+        await ctx.send(embed=embed)
 
 @bot.command(name='volume', aliases=['vol', 'v'])
 async def volume(ctx, volume: float):
@@ -421,6 +556,45 @@ async def volume(ctx, volume: float):
     music_player.set_volume(ctx.guild.id, volume)
     await ctx.send(f"🔊 Volume set to {int(volume * 100)}%!")
 
+def parse_timestamp(value: str) -> float:
+    """Parse '90', '1:30' or '1:02:03' into seconds"""
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+@bot.command(name='seek')
+async def seek(ctx, position: str):
+    """Jump to a position in the current song (e.g. 1:30, +15, -10)"""
+    if not ctx.guild.voice_client:
+        await ctx.send("❌ I'm not playing anything!")
+        return
+    
+    current_song = music_player.now_playing.get(ctx.guild.id)
+    voice_client = ctx.guild.voice_client
+    # A song that has ended stays in now_playing until the queue moves on
+    if not current_song or not (voice_client.is_playing() or voice_client.is_paused()):
+        await ctx.send("❌ Nothing is currently playing!")
+        return
+    
+    try:
+        if position.startswith(('+', '-')):
+            # Relative seek from the current position
+            offset = parse_timestamp(position[1:])
+            current = music_player.get_position(ctx.guild.id) or 0.0
+            target = current + offset if position.startswith('+') else current - offset
+        else:
+            target = parse_timestamp(position)
+    except ValueError:
+        await ctx.send("❌ Invalid position! Use seconds or `m:ss`, e.g. `!seek 1:30` or `!seek +15`")
+        return
+    
+    if await music_player.seek(ctx.guild.id, target):
+        position_str = format_duration(max(0, target))
+        await ctx.send(f"⏩ Jumped to **{position_str}** in **{current_song.title}**")
+    else:
+        await ctx.send("❌ Could not seek in the current song!")
+
 @bot.command(name='pause')
 async def pause(ctx):
     """Pause the current song"""
@@ -456,6 +630,8 @@ async def leave(ctx):
     
     await music_player.stop(ctx.guild.id)
     await ctx.guild.voice_client.disconnect()
+    music_player.voice_clients.pop(ctx.guild.id, None)
+    music_player.voice_health.stop(ctx.guild.id)
     await ctx.send("👋 Left the voice channel!")
 
 @bot.command(name='nowplaying', aliases=['np'])
@@ -476,8 +652,13 @@ async def nowplaying(ctx):
         color=0x00ff00
     )
     
-    embed.add_field(name="Duration", value=current_song.formatted_duration, inline=True)
-    embed.add_field(name="Requested by", value=current_song.requester.display_name, inline=True)
+    position = music_player.get_position(ctx.guild.id)
+    if position is not None:
+        position_str = format_duration(position)
+        embed.add_field(name="Position", value=f"{position_str} / {current_song.formatted_duration}", inline=True)
+    else:
+        embed.add_field(name="Duration", value=current_song.formatted_duration, inline=True)
+    embed.add_field(name="Requested by", value=current_song.requester_name, inline=True)
     embed.add_field(name="Volume", value=f"{int(music_player.get_volume(ctx.guild.id) * 100)}%", inline=True)
     
     if current_song.thumbnail:
@@ -497,8 +678,7 @@ async def shuffle(ctx):
         await ctx.send("❌ Need at least 2 songs in queue to shuffle!")
         return
     
-    import random
-    random.shuffle(queue)
+    music_player.shuffle_queue(ctx.guild.id)
     await ctx.send("🔀 Shuffled the music queue!")
 
 @bot.command(name='clear')
@@ -513,23 +693,147 @@ async def clear(ctx):
         await ctx.send("❌ The queue is already empty!")
         return
     
-    queue.clear()
+    music_player.clear_queue(ctx.guild.id)
     await ctx.send("🗑️ Cleared the music queue!")
 
+def parse_range(value: str):
+    """Parse '3' or '3-7' into a (start, end) pair of queue positions"""
+    start, _, end = value.partition('-')
+    return int(start), int(end or start)
+
 @bot.command(name='remove', aliases=['rm'])
-async def remove(ctx, index: int):
-    """Remove a song from the queue by its position"""
+async def remove(ctx, *, target: str):
+    """Remove songs from the queue by position, range (3-7) or requester (@user)"""
     if not ctx.guild.voice_client:
         await ctx.send("❌ I'm not in a voice channel!")
         return
     
-    removed_song = await music_player.remove_from_queue(ctx.guild.id, index)
+    if ctx.message.mentions:
+        member = ctx.message.mentions[0]
+        removed = music_player.remove_by_requester(ctx.guild.id, member.id)
+        if removed:
+            await ctx.send(f"🗑️ Removed **{len(removed)}** songs requested by {member.display_name}!")
+        else:
+            await ctx.send(f"❌ There are no songs from {member.display_name} in the queue!")
+        return
+    
+    try:
+        start, end = parse_range(target)
+    except ValueError:
+        await ctx.send(f"❌ Use a position, a range like `3-7` or a mention, e.g. `{Config.BOT_PREFIX}remove 3-7`")
+        return
+    
+    if start == end:
+        removed_song = await music_player.remove_from_queue(ctx.guild.id, start)
+        removed = [removed_song] if removed_song else []
+    else:
+        removed = music_player.remove_range(ctx.guild.id, start, end)
     
-    if removed_song:
-        await ctx.send(f"🗑️ Removed **{removed_song.title}** from the queue!")
+    if len(removed) == 1:
+        await ctx.send(f"🗑️ Removed **{removed[0].title}** from the queue!")
+    elif removed:
+        await ctx.send(f"🗑️ Removed **{len(removed)}** songs from the queue!")
     else:
         await ctx.send("❌ Invalid song position! Use `!queue` to see song positions.")
 
+@bot.command(name='move', aliases=['mv'])
+async def move(ctx, source: str, destination: int):
+    """Move a song or a range of songs (3-7) to another position in the queue"""
+    if not ctx.guild.voice_client:
+        await ctx.send("❌ I'm not in a voice channel!")
+        return
+    
+    try:
+        start, end = parse_range(source)
+    except ValueError:
+        await ctx.send(f"❌ Use a position or a range, e.g. `{Config.BOT_PREFIX}move 5 1` or `{Config.BOT_PREFIX}move 3-7 1`")
+        return
+    
+    moved = music_player.move_songs(ctx.guild.id, start, end, destination)
+    if moved:
+        await ctx.send(f"↕️ Moved **{moved}** song{'s' if moved != 1 else ''} to position {destination}!")
+    else:
+        await ctx.send("❌ Invalid song position! Use `!queue` to see song positions.")
+
+@bot.command(name='dedupe')
+async def dedupe(ctx):
+    """Remove duplicate songs from the queue"""
+    if not ctx.guild.voice_client:
+        await ctx.send("❌ I'm not in a voice channel!")
+        return
+    
+    removed = music_player.dedupe_queue(ctx.guild.id)
+    if removed:
+        await ctx.send(f"🧹 Removed **{len(removed)}** duplicate songs from the queue!")
+    else:
+        await ctx.send("✅ There are no duplicates in the queue!")
+
+@bot.command(name='import')
+async def import_queue(ctx):
+    """Queue every YouTube URL or video id listed in an attached text file"""
+    if not ctx.author.voice:
+        await ctx.send("❌ You need to be in a voice channel first!")
+        return
+    
+    if not ctx.message.attachments:
+        await ctx.send("❌ Attach a text file with one YouTube URL or video id per line!")
+        return
+    
+    attachment = ctx.message.attachments[0]
+    if attachment.size > 1024 * 1024:
+        await ctx.send("❌ That file is too large to import!")
+        return
+    
+    try:
+        text = (await attachment.read()).decode('utf-8', errors='replace')
+    except Exception as e:
+        logger.error(f"Error reading import attachment: {e}")
+        await ctx.send("❌ Could not read the attached file!")
+        return
+    
+    # One entry per line; blank lines and # comments are ignored
+    queries = [video_url(line.strip()) for line in text.splitlines()
+               if line.strip() and not line.strip().startswith('#')]
+    if not queries:
+        await ctx.send("❌ The attached file doesn't list any songs!")
+        return
+    queries = queries[:Config.MAX_PLAYLIST_SIZE]
+    
+    if not ctx.guild.voice_client:
+        await ctx.invoke(bot.get_command('join'))
+    
+    processing_msg = await ctx.send(f"📥 Importing **{len(queries)}** songs...")
+    
+    try:
+        songs = []
+        skipped = 0
+        async for query, song in music_player.resolve_many(queries):
+            if not song or song.duration > Config.MAX_SONG_LENGTH:
+                skipped += 1
+                continue
+            song.requester = ctx.author
+            songs.append(song)
+        
+        added = music_player.add_songs(ctx.guild.id, songs)
+        skipped += len(songs) - added
+        
+        if not added:
+            dispatcher.edit(processing_msg, content="❌ None of the songs could be added!")
+            return
+        
+        summary = f"✅ Imported **{added}** songs to the queue!"
+        if skipped:
+            summary += f" ({skipped} skipped: not found, too long or queue full)"
+        dispatcher.edit(processing_msg, content=summary)
+        
+        # Start playing if nothing is currently playing
+        if not music_player.now_playing.get(ctx.guild.id):
+            await music_player.play_next(ctx.guild.id)
+        
+    except Exception as e:
+        logger.error(f"Error in import command: {e}")
+        dispatcher.edit(processing_msg, content="❌ An error occurred while importing songs!")
+
 @bot.command(name='playlist', aliases=['pl'])
 async def playlist(ctx, playlist_url: str):
     """Add a YouTube playlist to the queue"""
@@ -553,11 +857,11 @@ async def playlist(ctx, playlist_url: str):
         added_count = await music_player.add_playlist(ctx.guild.id, playlist_url, ctx.author)
         
         if added_count == 0:
-            await processing_msg.edit(content="❌ Failed to add playlist or playlist is empty!")
+            dispatcher.edit(processing_msg, content="❌ Failed to add playlist or playlist is empty!")
             return
         
         # Update message
-        await processing_msg.edit(content=f"✅ Added **{added_count}** songs from playlist to queue!")
+        dispatcher.edit(processing_msg, content=f"✅ Added **{added_count}** songs from playlist to queue!")
         
         # Start playing if nothing is currently playing
         if not music_player.now_playing.get(ctx.guild.id):
@@ -565,7 +869,259 @@ async def playlist(ctx, playlist_url: str):
         
     except Exception as e:
         logger.error(f"Error in playlist command: {e}")
-        await processing_msg.edit(content="❌ An error occurred while processing the playlist!")
+        dispatcher.edit(processing_msg, content="❌ An error occurred while processing the playlist!")
+
+@bot.command(name='voicehealth', aliases=['vh'])
+@commands.is_owner()
+async def voicehealth(ctx):
+    """Show voice connection health for this server (owner only)"""
+    stats = music_player.voice_health.get_stats(ctx.guild.id)
+    recovery_times = list(music_player.voice_health.recovery_times)
+    
+    embed = discord.Embed(title="🩺 Voice Health", color=0x00ff00 if stats['connected'] else 0xff0000)
+    embed.add_field(name="Connected", value="Yes" if stats['connected'] else "No", inline=True)
+    if stats['latency'] is not None and stats['latency'] != float('inf'):
+        embed.add_field(name="Latency", value=f"{stats['latency'] * 1000:.0f} ms", inline=True)
+    embed.add_field(name="Recoveries", value=f"{stats['recoveries']} ok / {stats['failures']} failed", inline=True)
+    if 'packets_sent' in stats:
+        embed.add_field(name="Packets", value=f"{stats['packets_sent']} sent / {stats['packet_errors']} errors", inline=True)
+        embed.add_field(name="Gaps", value=f"{stats['gaps']} (longest {stats['longest_gap'] * 1000:.0f} ms)", inline=True)
+    if recovery_times:
+        embed.add_field(
+            name="Time to Recover (all servers)",
+            value=f"avg {sum(recovery_times) / len(recovery_times):.2f}s, max {max(recovery_times):.2f}s",
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+@bot.command(name='audiostats', aliases=['as'])
+@commands.is_owner()
+async def audiostats(ctx, setting: str = None):
+    """Show the servers with the worst audio send-path stats (owner only)"""
+    if setting == 'reset':
+        music_player.audio_stats.reset()
+        await ctx.send("🗑️ Cleared audio statistics!")
+        return
+    
+    worst = music_player.audio_stats.worst(limit=5)
+    if not worst:
+        await ctx.send("📭 No audio statistics recorded yet!")
+        return
+    
+    embed = discord.Embed(title="📈 Audio Send Path (worst servers)", color=0x00ff00)
+    for guild_id, stats in worst:
+        guild = bot.get_guild(guild_id)
+        underrun_pct = 100 * stats.underruns / stats.frames if stats.frames else 0.0
+        buffer_text = f"{stats.buffer.mean / 1024:.1f} KiB avg" if stats.buffer.count else "n/a"
+        embed.add_field(
+            name=guild.name if guild else str(guild_id),
+            value=(f"Frames: {stats.frames} | Underruns: {stats.underruns} ({underrun_pct:.2f}%)\n"
+                   f"Read latency p50/p99: {stats.read_latency.percentile(50):g}/{stats.read_latency.percentile(99):g} ms\n"
+                   f"Jitter p50/p99/max: {stats.jitter.percentile(50):g}/{stats.jitter.percentile(99):g}/{stats.jitter.max:.1f} ms\n"
+                   f"FFmpeg buffer: {buffer_text}"),
+            inline=False
+        )
+    embed.set_footer(text=f"Use {Config.BOT_PREFIX}audiostats reset to clear")
+    await ctx.send(embed=embed)
+
+@bot.command(name='ffmpegstats', aliases=['ff'])
+@commands.is_owner()
+async def ffmpegstats(ctx):
+    """Show live FFmpeg processes with CPU and memory usage (owner only)"""
+    processes = music_player.ffmpeg.get_stats()
+    limit = Config.FFMPEG_MAX_PROCESSES or "unlimited"
+    shared = music_player.broker.get_stats()
+    cached = music_player.opus_cache.get_stats()
+    
+    embed = discord.Embed(
+        title="⚙️ FFmpeg Processes",
+        description=f"**{len(processes)}** live (limit {limit}) | "
+                    f"{music_player.ffmpeg.spawned} started | {music_player.ffmpeg.reaped} reaped\n"
+                    f"Shared streams: {shared['active']} active ({shared['listeners']} listening) | "
+                    f"{shared['joined']} decodes saved | {shared['fallbacks']} fell back\n"
+                    f"Opus cache: {cached['tracks']} tracks ({cached['bytes'] / (1024 * 1024):.0f} MiB) | "
+                    f"{cached['hits']} plays without FFmpeg | {cached['fallbacks']} decoded for volume | "
+                    f"{cached['encoded']} encoded, {cached['failed']} failed",
+        color=0x00ff00
+    )
+    
+    for info in sorted(processes, key=lambda p: p['rss_mb'] or 0, reverse=True)[:10]:
+        guild = bot.get_guild(info['guild_id']) if info['guild_id'] is not None else None
+        owner = guild.name if guild else (info['guild_id'] or "shared stream")
+        cpu = f"{info['cpu_seconds']:.1f}s" if info['cpu_seconds'] is not None else "n/a"
+        if info['cpu_percent'] is not None:
+            cpu += f" ({info['cpu_percent']:.0f}%)"
+        rss = f"{info['rss_mb']:.1f} MiB" if info['rss_mb'] is not None else "n/a"
+        embed.add_field(
+            name=f"PID {info['pid']} - {owner}",
+            value=f"Age: {format_duration(info['age'])} | CPU: {cpu} | RSS: {rss}",
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+@bot.command(name='formatstats', aliases=['fs'])
+@commands.is_owner()
+async def formatstats(ctx):
+    """Show stream format choices and estimated bandwidth saved (owner only)"""
+    stats = music_player.format_policy.get_stats()
+    if not stats['selections']:
+        await ctx.send("📭 No stream formats selected yet!")
+        return
+    
+    saved_pct = 100 * stats['bytes_saved'] / stats['bytes_legacy'] if stats['bytes_legacy'] else 0.0
+    embed = discord.Embed(
+        title="📡 Stream Formats",
+        description=f"Policy: **{stats['policy']}** | {stats['selections']} selections | "
+                    f"{stats['cache_hits']} cached ({stats['cached_tracks']} tracks)",
+        color=0x00ff00
+    )
+    embed.add_field(
+        name="Bandwidth (estimated)",
+        value=(f"Streamed: {stats['bytes_selected'] / (1024 * 1024):.1f} MiB\n"
+               f"Legacy selection: {stats['bytes_legacy'] / (1024 * 1024):.1f} MiB\n"
+               f"Saved: {stats['bytes_saved'] / (1024 * 1024):.1f} MiB ({saved_pct:.0f}%)"),
+        inline=False
+    )
+    codecs = ", ".join(f"{codec}: {count}" for codec, count in sorted(stats['codecs'].items(), key=lambda c: -c[1]))
+    embed.add_field(name="Codecs", value=codecs or "n/a", inline=False)
+    if stats['stages']:
+        stages = ", ".join(f"{stage}: {count}" for stage, count in sorted(stats['stages'].items()))
+        embed.add_field(name="Fallback stages used", value=stages, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name='memory', aliases=['mem'])
+@commands.is_owner()
+async def memory_command(ctx, action: str = None):
+    """Show where memory goes; types, snapshot, diff or stop for deeper checks (owner only)"""
+    if action == 'types':
+        embed = discord.Embed(title="🧠 Live Objects by Type", color=0x00ff00)
+        lines = []
+        for name, count, delta in memory.type_counts():
+            change = f" ({delta:+d})" if delta is not None else ""
+            lines.append(f"`{name}`: {count}{change}")
+        embed.description = "\n".join(lines)
+        embed.set_footer(text="Changes are since the last time this was run")
+        await ctx.send(embed=embed)
+        return
+    
+    if action == 'snapshot':
+        traced_kib = memory.take_snapshot()
+        await ctx.send(f"📸 Baseline snapshot taken ({traced_kib} KiB traced). "
+                       f"Use `{Config.BOT_PREFIX}memory diff` later to see what grew.")
+        return
+    
+    if action == 'diff':
+        stats = memory.snapshot_diff()
+        if stats is None:
+            await ctx.send(f"❌ No baseline! Use `{Config.BOT_PREFIX}memory snapshot` first.")
+            return
+        embed = discord.Embed(title="📈 Allocation Growth Since Snapshot", color=0x00ff00)
+        lines = [f"`{stat.traceback[0].filename.rsplit('/', 1)[-1]}:{stat.traceback[0].lineno}` "
+                 f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks)" for stat in stats]
+        embed.description = "\n".join(lines) or "No growth."
+        await ctx.send(embed=embed)
+        return
+    
+    if action == 'stop':
+        memory.stop_tracing()
+        await ctx.send("⏹️ Stopped allocation tracing.")
+        return
+    
+    rss = rss_mb()
+    growth = memory.rss_growth()
+    description = f"RSS: **{rss:.1f} MiB**" if rss is not None else "RSS: n/a"
+    if growth is not None:
+        description += f" | Trend: {growth:+.1f} MiB/h over {len(memory.rss_history)} samples"
+    description += f"\nAllocation tracing: {'on' if memory.tracing else 'off'}"
+    embed = discord.Embed(title="🧠 Memory", description=description, color=0x00ff00)
+    
+    for name, value in memory.component_sizes().items():
+        embed.add_field(name=name, value=value, inline=True)
+    
+    footprints = memory.guild_footprints()[:5]
+    if footprints:
+        lines = []
+        for guild_id, songs, size in footprints:
+            guild = bot.get_guild(guild_id)
+            lines.append(f"{guild.name if guild else guild_id}: {songs} songs, {size / 1024:.1f} KiB")
+        embed.add_field(name="Largest servers", value="\n".join(lines), inline=False)
+    
+    embed.set_footer(text=f"{Config.BOT_PREFIX}memory types | snapshot | diff | stop")
+    await ctx.send(embed=embed)
+
+@bot.command(name='library', aliases=['lib'])
+@commands.is_owner()
+async def library(ctx, action: str = None):
+    """Show the local music library index; rescan to pick up changes now (owner only)"""
+    if not music_player.library.enabled:
+        await ctx.send("❌ No local library configured! Set `LOCAL_LIBRARY_PATH` to enable it.")
+        return
+    
+    if action == 'rescan':
+        status_msg = await ctx.send("🔄 Scanning the local library...")
+        try:
+            await bot.loop.run_in_executor(None, music_player.library.scan)
+        except Exception as e:
+            logger.error(f"Local library scan failed: {e}")
+            dispatcher.edit(status_msg, content="❌ Scanning the local library failed!")
+            return
+        dispatcher.edit(status_msg, content="✅ Local library scan finished!")
+    
+    scan = music_player.library.last_scan
+    embed = discord.Embed(title="📁 Local Library", description=f"`{music_player.library.root}`", color=0x00ff00)
+    embed.add_field(name="Indexed tracks", value=str(len(music_player.library)), inline=True)
+    if scan:
+        embed.add_field(name="Last scan", value=(f"{scan['files']} files, {scan['probed']} probed, "
+                                                 f"{scan['removed']} removed, {scan['failed']} unplayable "
+                                                 f"in {scan['seconds']:.1f}s"), inline=False)
+    else:
+        embed.add_field(name="Last scan", value="Not finished yet", inline=False)
+    embed.set_footer(text=f"{Config.BOT_PREFIX}library rescan")
+    await ctx.send(embed=embed)
+
+@bot.command(name='profile', aliases=['prof'])
+@commands.is_owner()
+async def profile(ctx, command_name: str = None, count: int = 1, guild_id: int = None):
+    """Profile the next invocations of a command, optionally only in one server; stop to cancel (owner only)"""
+    if command_name is None:
+        if profiler.armed:
+            scope = f" in server {profiler.guild_id}" if profiler.guild_id else ""
+            await ctx.send(f"🔬 Profiling `{profiler.command.qualified_name}`{scope}: "
+                           f"{profiler.remaining} invocations left, {len(profiler.captures)} saved")
+        else:
+            await ctx.send(f"🔬 Not profiling. Use `{Config.BOT_PREFIX}profile <command> [count] [server id]`.")
+        return
+    
+    if command_name == 'stop':
+        profiler.disarm()
+        await ctx.send("⏹️ Stopped profiling.")
+        return
+    
+    async def report(captures):
+        embed = discord.Embed(title=f"🔬 Profile of {captures[0][1].command}", color=0x00ff00)
+        for path, capture in captures[:5]:
+            own, leaves = capture.hottest()
+            lines = [f"`{label}` {share:.0%}" for label, share in own]
+            lines += ["**Self time**"] + [f"`{label}` {share:.0%}" for label, share in leaves]
+            embed.add_field(
+                name=f"{capture.duration * 1000:.0f} ms, {sum(capture.samples.values())} samples",
+                value=("\n".join(lines) or "No samples")[:1024],
+                inline=False
+            )
+        embed.set_footer(text=f"Folded stacks saved to {Config.PROFILE_DIR}/ (flamegraph.pl, speedscope)")
+        await ctx.send(embed=embed)
+    
+    command = bot.get_command(command_name)
+    if command is None:
+        await ctx.send(f"❌ No command called `{command_name}`!")
+        return
+    if command is ctx.command:
+        await ctx.send("❌ The profiler can't profile itself!")
+        return
+    profiler.arm(command.qualified_name, count, guild_id, on_done=report)
+    scope = f" in server {guild_id}" if guild_id else ""
+    await ctx.send(f"🔬 Profiling the next {profiler.remaining} `{command.qualified_name}` invocations{scope}. "
+                   f"Results are posted here when they're done.")
 
 @bot.command(name='help')
 async def help_command(ctx):
@@ -581,21 +1137,27 @@ async def help_command(ctx):
         ("search/sr <query>", "Search for songs and choose from results"),
         ("quicksearch/qs <query>", "Quick search showing results without reactions"),
         ("play/p <query>", "Play a song from YouTube directly"),
+        ("playmany/pm <songs>", "Queue several songs at once, one per line or separated by ;"),
         ("playlist/pl <url>", "Add a YouTube playlist to queue"),
         ("skip/s", "Skip the current song"),
         ("stop/st", "Stop playback and clear queue"),
+        ("seek <time>", "Jump to a position, e.g. 1:30, +15 or -10"),
         ("pause", "Pause the current song"),
         ("resume", "Resume the paused song"),
-        ("queue/q", "Show the current queue"),
+        ("queue/q [page]", "Show the current queue (use the buttons to browse pages)"),
         ("volume/vol/v <0-100>", "Set the bot's volume"),
         ("leave/dc", "Leave the voice channel"),
         ("nowplaying/np", "Show current song info"),
         ("shuffle", "Shuffle the current queue"),
         ("clear", "Clear the music queue"),
-        ("remove/rm <position>", "Remove a song from queue"),
+        ("remove/rm <position/range/@user>", "Remove songs by position, range (3-7) or requester"),
+        ("move/mv <position/range> <to>", "Move songs to another position in the queue"),
+        ("dedupe", "Remove duplicate songs from the queue"),
+        ("import", "Queue the YouTube URLs or ids in an attached text file"),
         ("playresult <number>", "Play a specific search result (use after !search)"),
         ("clearsearch", "Clear stored search results"),
         ("autodisconnect <on/off>", "Enable/disable auto-disconnect when alone"),
+        ("autoplay/ap <on/off>", "Keep playing songs from this server's history when the queue ends"),
         ("help", "Show this help message")
     ]
     
@@ -608,6 +1170,15 @@ async def help_command(ctx):
 @bot.event
 async def on_voice_state_update(member, before, after):
     """Handle voice state updates (auto-disconnect when alone)"""
+    voice_listeners.observe(member)
+    
+    # The bot itself was disconnected (kicked or left) outside of a recovery
+    if bot.user and member.id == bot.user.id and after.channel is None:
+        if not music_player.voice_health.is_recovering(member.guild.id):
+            music_player.voice_health.stop(member.guild.id)
+            music_player.release_guild(member.guild.id)
+        return
+    
     # Only care about the bot's guild
     if member.guild.id not in music_player.voice_clients:
         return
@@ -619,10 +1190,9 @@ async def on_voice_state_update(member, before, after):
         return
     
     channel = voice_client.channel
-    members = [m for m in channel.members if not m.bot]
     
     # If bot is alone in the channel, start disconnect process
-    if len(members) == 0:
+    if voice_listeners.count(channel) == 0:
         # Check if auto-disconnect is enabled for this guild
         if hasattr(music_player, 'auto_disconnect_enabled'):
             if not music_player.auto_disconnect_enabled.get(member.guild.id, True):
@@ -647,8 +1217,7 @@ async def on_voice_state_update(member, before, after):
             
             # Check if anyone joined during the wait
             if voice_client.is_connected() and voice_client.channel:
-                current_members = [m for m in voice_client.channel.members if not m.bot]
-                if len(current_members) > 0:
+                if voice_listeners.count(voice_client.channel) > 0:
                     logger.info(f"Users joined {channel.name}, cancelling auto-disconnect")
                     try:
                         await channel.send("✅ **Welcome back!** I'll keep playing music for you!")
@@ -658,8 +1227,7 @@ async def on_voice_state_update(member, before, after):
         
         # Final check - if still alone, disconnect
         if voice_client.is_connected() and voice_client.channel:
-            final_members = [m for m in voice_client.channel.members if not m.bot]
-            if len(final_members) == 0:
+            if voice_listeners.count(voice_client.channel) == 0:
                 logger.info(f"Bot is still alone in {channel.name}, disconnecting now")
                 
                 # Stop music and clear queue
@@ -682,11 +1250,26 @@ async def on_voice_state_update(member, before, after):
                 if member.guild.id in music_player.voice_clients:
                     del music_player.voice_clients[member.guild.id]
 
+async def probe_endpoint(session, endpoint: str):
+    """Check a single Discord endpoint"""
+    import aiohttp
+    
+    try:
+        timeout = aiohttp.ClientTimeout(total=Config.STARTUP_PROBE_TIMEOUT)
+        async with session.get(endpoint, timeout=timeout) as response:
+            if response.status == 200:
+                logger.info(f"✅ {endpoint} - OK")
+            else:
+                logger.warning(f"⚠️  {endpoint} - Status: {response.status}")
+    except Exception as e:
+        logger.warning(f"❌ {endpoint} - Error: {e}")
+
 async def test_discord_connectivity():
     """Test connectivity to Discord servers"""
     import aiohttp
     
-    print("🔍 Testing Discord connectivity...")
+    logger.info("🔍 Testing Discord connectivity...")
+    started = time.perf_counter()
     
     # Test basic Discord endpoints
     endpoints = [
@@ -695,79 +1278,38 @@ async def test_discord_connectivity():
         "https://status.discord.com/api/v2/status.json"
     ]
     
-    async with aiohttp.ClientSession() as session:
-        for endpoint in endpoints:
-            try:
-                async with session.get(endpoint, timeout=10) as response:
-                    if response.status == 200:
-                        print(f"✅ {endpoint} - OK")
-                    else:
-                        print(f"⚠️  {endpoint} - Status: {response.status}")
-            except Exception as e:
-                print(f"❌ {endpoint} - Error: {e}")
+    # Probe all endpoints at once so the check takes as long as the slowest one
+    try:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(probe_endpoint(session, endpoint) for endpoint in endpoints))
+    except Exception as e:
+        logger.warning(f"Connectivity test failed: {e}")
     
-    print("🔍 Connectivity test completed.")
+    logger.info(f"🔍 Connectivity test completed in {time.perf_counter() - started:.2f}s.")
+
+async def run_bot():
+    """Run the bot, then save shared guild state and release leases on the way out"""
+    try:
+        await supervisor.run()
+    finally:
+        await music_player.state.close()
+        command_trace.close()
 
 def main():
     """Main function to run the bot"""
     try:
         # Validate configuration
         Config.validate()
+        mark_startup('config')
         
-        # Test connectivity first
-        import asyncio
-        try:
-            asyncio.run(test_discord_connectivity())
-        except Exception as e:
-            logger.warning(f"Connectivity test failed: {e}")
-        
-        # Run the bot
+        # Run the bot (the connectivity test runs in the background once logged in)
         logger.info("Starting Discord Music Bot...")
         
-        # Add retry logic for connection issues
-        max_retries = 3
-        retry_delay = 5  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Connection attempt {attempt + 1}/{max_retries}")
-                bot.run(Config.DISCORD_TOKEN)
-                break  # If successful, break out of retry loop
-                
-            except discord.errors.HTTPException as e:
-                if e.status == 503:
-                    logger.error(f"Discord service unavailable (attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        print(f"Discord is experiencing issues. Retrying in {retry_delay} seconds...")
-                        import time
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                    else:
-                        print("Max retry attempts reached. Discord may be experiencing issues.")
-                        print("Please check https://status.discord.com/ for service status.")
-                else:
-                    raise  # Re-raise non-503 HTTP errors
-                    
-            except discord.errors.ConnectionClosed as e:
-                logger.error(f"Connection closed (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    print(f"Connection failed. Retrying in {retry_delay} seconds...")
-                    import time
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    print("Max retry attempts reached. Please check your internet connection.")
-                    
-            except Exception as e:
-                logger.error(f"Unexpected error during connection attempt {attempt + 1}: {e}")
-                if attempt < max_retries - 1:
-                    print(f"Connection error. Retrying in {retry_delay} seconds...")
-                    import time
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise  # Re-raise on final attempt
+        # One event loop for the whole process: reconnects keep queues and voice sessions
+        asyncio.run(run_bot())
         
+    except KeyboardInterrupt:
+        logger.info("Shutting down Discord Music Bot...")
     except ValueError as e:
         logger.error(f"Configuration error: {e}")
         print(f"Error: {e}")
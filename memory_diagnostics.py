@@ -0,0 +1,148 @@
+import asyncio
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Bytes of PCM audio in one 20 ms frame (48 kHz, stereo, 16-bit)
+PCM_FRAME_BYTES = 3840
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of the process in MiB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS, but better than nothing (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except (ImportError, AttributeError):
+        return None
+
+def song_size(song) -> int:
+    """Approximate bytes held by a Song (the requester is shared with discord.py's cache)"""
+    size = sys.getsizeof(song) + sys.getsizeof(song.__dict__)
+    for name, value in song.__dict__.items():
+        if name != 'requester' and value is not None:
+            size += sys.getsizeof(value)
+    return size
+
+class MemoryDiagnostics:
+    """Attributes the bot's memory to guilds and components
+
+    The cheap parts (RSS, per-guild queue sizes, cache counts) can be sampled
+    all the time. Object counts walk the whole heap and tracemalloc slows down
+    every allocation, so both only run when an owner asks for them.
+    """
+
+    def __init__(self, music_player, bot):
+        self.music_player = music_player
+        self.bot = bot
+        self.rss_history: Deque[Tuple[float, float]] = deque(maxlen=Config.MEMORY_HISTORY_SIZE)  # (time, MiB)
+        self._previous_types: Optional[Counter] = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._sampler: Optional[asyncio.Task] = None
+
+    def start_sampling(self):
+        """Record RSS periodically so growth over time is visible"""
+        if Config.MEMORY_SAMPLE_INTERVAL > 0 and (self._sampler is None or self._sampler.done()):
+            self._sampler = asyncio.get_running_loop().create_task(self._sample_periodically())
+
+    async def _sample_periodically(self):
+        while True:
+            rss = rss_mb()
+            if rss is not None:
+                self.rss_history.append((time.time(), rss))
+            await asyncio.sleep(Config.MEMORY_SAMPLE_INTERVAL)
+
+    def rss_growth(self) -> Optional[float]:
+        """MiB gained per hour across the sampled history"""
+        if len(self.rss_history) < 2:
+            return None
+        (first_at, first), (last_at, last) = self.rss_history[0], self.rss_history[-1]
+        if last_at <= first_at:
+            return None
+        return (last - first) * 3600 / (last_at - first_at)
+
+    def guild_footprints(self) -> List[Tuple[int, int, int]]:
+        """(guild_id, songs, approximate bytes) for every guild with player state, largest first"""
+        player = self.music_player
+        guild_ids = set(player.queues) | set(player.now_playing) | set(player.voice_clients)
+        footprints = []
+        for guild_id in guild_ids:
+            queue = player.queues.get(guild_id, [])
+            # A spilled queue only holds its first songs as objects; the rest is counted by its own size
+            songs = list(getattr(queue, 'window', queue))
+            if guild_id in player.now_playing:
+                songs.append(player.now_playing[guild_id])
+            size = sum(song_size(song) for song in songs)
+            size += sys.getsizeof(queue)
+            url = player.stream_urls.get(guild_id)
+            size += sys.getsizeof(url) if url else 0
+            footprints.append((guild_id, len(queue) + (guild_id in player.now_playing), size))
+        footprints.sort(key=lambda entry: entry[2], reverse=True)
+        return footprints
+
+    def component_sizes(self) -> Dict[str, str]:
+        """Entry counts (and sizes where cheap to estimate) of the bot's caches"""
+        player = self.music_player
+        metadata_bytes = sum(sys.getsizeof(value) for entry in player.metadata_cache._entries.values()
+                             for value in entry if value is not None)
+        broker = player.broker.get_stats()
+        members = sum(len(guild.members) for guild in self.bot.guilds)
+        return {
+            'Queues': f"{sum(len(queue) for queue in player.queues.values())} songs",
+            'Search results': f"{len(player.search_results)} users",
+            'Metadata cache': f"{len(player.metadata_cache)} tracks (~{metadata_bytes / 1024:.0f} KiB)",
+            'History index': f"{len(player.history)} tracks, {len(player.history._grams)} trigrams",
+            'Format cache': f"{len(player.format_policy._cache)} tracks",
+            'Prefetched streams': f"{len(player.prefetcher._urls)} URLs",
+            'Shared stream buffers': f"{broker['buffered_frames'] * PCM_FRAME_BYTES / (1024 * 1024):.1f} MiB",
+            'discord.py cache': (f"{len(self.bot.guilds)} guilds, {len(self.bot.users)} users, "
+                                 f"{members} cached members, {len(self.bot.cached_messages)} messages"),
+        }
+
+    def type_counts(self, limit: int = 15) -> List[Tuple[str, int, Optional[int]]]:
+        """Most common live object types with the change since the last call (walks the heap)"""
+        counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+        previous, self._previous_types = self._previous_types, counts
+        return [(name, count, count - previous.get(name, 0) if previous is not None else None)
+                for name, count in counts.most_common(limit)]
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def take_snapshot(self) -> int:
+        """Start tracemalloc if needed and take the baseline snapshot; returns traced KiB"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(Config.MEMORY_TRACE_FRAMES)
+        self._baseline = tracemalloc.take_snapshot()
+        return tracemalloc.get_traced_memory()[0] // 1024
+
+    def snapshot_diff(self, limit: int = 10) -> Optional[List[tracemalloc.StatisticDiff]]:
+        """Allocation sites that grew most since the baseline, or None without a baseline"""
+        if self._baseline is None or not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        return snapshot.compare_to(self._baseline, 'lineno')[:limit]
+
+    def stop_tracing(self):
+        """Stop tracemalloc and drop the baseline"""
+        self._baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional
+import discord
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_REPLY = 0      # Command replies the user is waiting for
+PRIORITY_COSMETIC = 1   # Reactions, timeouts and other decoration
+
+class RateLimitBucket:
+    """Token bucket that mirrors a Discord rate limit bucket locally"""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = max(1, rate)
+        self.per = per
+        self.tokens = float(self.rate)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token if available, otherwise return how long to wait"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        delay = self.try_acquire()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.try_acquire()
+
+class _Operation:
+    """A pending outbound API call"""
+
+    def __init__(self, kind: str, target, kwargs: Dict, future: asyncio.Future, priority: int):
+        self.kind = kind          # 'send', 'edit' or 'reactions'
+        self.target = target      # channel or message
+        self.kwargs = kwargs
+        self.future = future
+        self.priority = priority
+
+class _ChannelLane:
+    """Per-channel queue with its own rate limit buckets"""
+
+    def __init__(self):
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.message_bucket = RateLimitBucket(Config.DISPATCH_MESSAGE_RATE, Config.DISPATCH_MESSAGE_PER)
+        self.reaction_bucket = RateLimitBucket(1, Config.DISPATCH_REACTION_INTERVAL)
+        self.task: Optional[asyncio.Task] = None
+
+class MessageDispatcher:
+    """Coalescing, rate-limit-aware layer for outbound message traffic
+
+    Edits to the same message are coalesced so only the latest content is
+    sent, reactions are added in the background one at a time, and each
+    channel has its own priority queue so replies overtake cosmetic work.
+    """
+
+    def __init__(self):
+        self._lanes: Dict[int, _ChannelLane] = {}
+        self._pending_edits: Dict[int, _Operation] = {}  # message_id -> pending edit
+        self._global_bucket = RateLimitBucket(Config.DISPATCH_GLOBAL_RATE, 1.0)
+        self._sequence = itertools.count()
+        self.coalesced_edits = 0
+
+    def send(self, channel: discord.abc.Messageable, priority: int = PRIORITY_REPLY, **kwargs) -> asyncio.Future:
+        """Queue a new message; the future resolves to the sent message"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(self._channel_id(channel), _Operation('send', channel, kwargs, future, priority))
+        return future
+
+    def edit(self, message: discord.Message, priority: int = PRIORITY_REPLY, **kwargs) -> asyncio.Future:
+        """Queue an edit, merging it into any edit still waiting for the same message"""
+        pending = self._pending_edits.get(message.id)
+        if pending:
+            # Latest wins: newer fields replace older ones in the pending edit
+            pending.kwargs.update(kwargs)
+            self.coalesced_edits += 1
+            if priority < pending.priority:
+                # Re-queue at the higher priority; the stale entry is skipped later
+                pending.priority = priority
+                self._enqueue(message.channel.id, pending)
+            return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        operation = _Operation('edit', message, dict(kwargs), future, priority)
+        self._pending_edits[message.id] = operation
+        self._enqueue(message.channel.id, operation)
+        return future
+
+    def add_reactions(self, message: discord.Message, emojis: List[str], priority: int = PRIORITY_COSMETIC) -> asyncio.Future:
+        """Queue a batch of reactions; they are added without blocking the caller"""
+        future = asyncio.get_running_loop().create_future()
+        operation = _Operation('reactions', message, {'emojis': list(emojis)}, future, priority)
+        self._enqueue(message.channel.id, operation)
+        return future
+
+    def _channel_id(self, channel) -> int:
+        # Context objects are messageable but keep the real channel elsewhere
+        return getattr(getattr(channel, 'channel', None), 'id', None) or getattr(channel, 'id', 0)
+
+    def _enqueue(self, channel_id: int, operation: _Operation):
+        lane = self._lanes.get(channel_id)
+        if lane is None:
+            lane = _ChannelLane()
+            self._lanes[channel_id] = lane
+        lane.queue.put_nowait((operation.priority, next(self._sequence), operation))
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._run_lane(channel_id, lane))
+
+    async def _run_lane(self, channel_id: int, lane: _ChannelLane):
+        """Drain a channel's queue, then exit once it has been idle for a while"""
+        while True:
+            try:
+                priority, _, operation = await asyncio.wait_for(lane.queue.get(), timeout=Config.DISPATCH_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if lane.queue.empty():
+                    self._lanes.pop(channel_id, None)
+                    return
+                continue
+
+            if operation.future.done() or priority != operation.priority:
+                # Already handled through a re-queued, higher priority entry
+                continue
+
+            try:
+                await self._execute(lane, operation)
+            except Exception as e:
+                logger.error(f"Error in message dispatcher ({operation.kind}) for channel {channel_id}: {e}")
+
+    async def _execute(self, lane: _ChannelLane, operation: _Operation):
+        if operation.kind == 'reactions':
+            await self._add_next_reaction(lane, operation)
+            return
+
+        await lane.message_bucket.acquire()
+        await self._global_bucket.acquire()
+
+        if operation.kind == 'edit':
+            # Stop coalescing into this edit once it is on the wire
+            self._pending_edits.pop(operation.target.id, None)
+
+        result = None
+        try:
+            if operation.kind == 'send':
+                result = await operation.target.send(**operation.kwargs)
+            else:
+                result = await operation.target.edit(**operation.kwargs)
+        except Exception as e:
+            logger.warning(f"Could not {operation.kind} message: {e}")
+        finally:
+            if not operation.future.done():
+                operation.future.set_result(result)
+
+    async def _add_next_reaction(self, lane: _ChannelLane, operation: _Operation):
+        """Add one reaction, then re-queue the rest so replies can cut in"""
+        emojis = operation.kwargs['emojis']
+        if emojis:
+            await lane.reaction_bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                await operation.target.add_reaction(emojis.pop(0))
+            except Exception as e:
+                logger.warning(f"Could not add reaction: {e}")
+                emojis.clear()
+
+        if emojis:
+            lane.queue.put_nowait((operation.priority, next(self._sequence), operation))
+        elif not operation.future.done():
+            operation.future.set_result(None)
@@ -0,0 +1,36 @@
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# (title, url, duration, thumbnail)
+TrackMetadata = Tuple[str, str, int, Optional[str]]
+
+class TrackMetadataCache:
+    """Bounded LRU cache of track metadata keyed by video id"""
+    
+    def __init__(self, max_entries: int = Config.METADATA_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, TrackMetadata]" = OrderedDict()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key: str):
+        return key in self._entries
+    
+    def put(self, key: str, title: str, url: str, duration: int, thumbnail: str = None):
+        """Store metadata for a track, evicting the least recently used entry if full"""
+        self._entries[key] = (title, url, duration or 0, thumbnail)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get(self, key: str) -> Optional[TrackMetadata]:
+        """Get metadata for a track and mark it as recently used"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
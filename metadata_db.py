@@ -0,0 +1,256 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def sqlite_path(database_url: str) -> str:
+    """Turn a sqlite:/// URL into a file path for sqlite3"""
+    if database_url.startswith('sqlite:///'):
+        return database_url[len('sqlite:///'):] or ':memory:'
+    logger.warning(f"Unsupported DATABASE_URL '{database_url}', using an in-memory database")
+    return ':memory:'
+
+class MetadataDB:
+    """Persistent per-track metadata (titles, durations, loudness analysis, play history)
+    
+    Backed by SQLite at Config.DATABASE_URL. Calls are serialized with a lock
+    so worker threads (e.g. loudness analysis) can write safely.
+    """
+    
+    def __init__(self, database_url: str = Config.DATABASE_URL):
+        self.path = sqlite_path(database_url)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS tracks (
+                    video_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    url TEXT,
+                    duration INTEGER,
+                    thumbnail TEXT,
+                    loudness_lufs REAL,
+                    gain_db REAL,
+                    analyzed_at REAL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS guild_plays (
+                    guild_id INTEGER,
+                    video_id TEXT,
+                    play_count INTEGER DEFAULT 0,
+                    last_played REAL,
+                    PRIMARY KEY (guild_id, video_id)
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS transitions (
+                    guild_id INTEGER,
+                    prev_video_id TEXT,
+                    next_video_id TEXT,
+                    count INTEGER DEFAULT 0,
+                    PRIMARY KEY (guild_id, prev_video_id, next_video_id)
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS library_files (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL,
+                    size INTEGER,
+                    title TEXT,
+                    artist TEXT,
+                    album TEXT,
+                    duration INTEGER
+                )
+            ''')
+        logger.info(f"Opened metadata database at {self.path}")
+    
+    def upsert_track(self, video_id: str, title: str, url: str, duration: int, thumbnail: str = None):
+        """Insert or update a track's basic metadata, keeping any analysis results"""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO tracks (video_id, title, url, duration, thumbnail)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    title = excluded.title,
+                    url = excluded.url,
+                    duration = excluded.duration,
+                    thumbnail = excluded.thumbnail
+            ''', (video_id, title, url, duration or 0, thumbnail))
+    
+    def upsert_tracks(self, rows: List[Tuple]):
+        """Store many tracks as (video_id, title, url, duration, thumbnail) rows, keeping any analysis results"""
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO tracks (video_id, title, url, duration, thumbnail)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    title = excluded.title,
+                    url = excluded.url,
+                    duration = excluded.duration,
+                    thumbnail = excluded.thumbnail
+            ''', rows)
+    
+    def get_gain_db(self, video_id: str) -> Optional[float]:
+        """Get the stored normalization gain for a track, if it was analyzed"""
+        with self._lock:
+            row = self._conn.execute('SELECT gain_db FROM tracks WHERE video_id = ?', (video_id,)).fetchone()
+        return row[0] if row else None
+    
+    def set_loudness(self, video_id: str, loudness_lufs: float, gain_db: float):
+        """Store the loudness analysis result for a track"""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO tracks (video_id, loudness_lufs, gain_db, analyzed_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    loudness_lufs = excluded.loudness_lufs,
+                    gain_db = excluded.gain_db,
+                    analyzed_at = excluded.analyzed_at
+            ''', (video_id, loudness_lufs, gain_db, time.time()))
+    
+    def mark_loudness_failed(self, video_id: str):
+        """Record a failed analysis: analyzed_at is set while gain_db stays empty"""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO tracks (video_id, analyzed_at) VALUES (?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET analyzed_at = excluded.analyzed_at
+            ''', (video_id, time.time()))
+    
+    def get_loudness_state(self, video_id: str) -> Tuple[Optional[float], Optional[float]]:
+        """Get (gain_db, analyzed_at) for a track; a time without a gain means the last analysis failed"""
+        with self._lock:
+            row = self._conn.execute('SELECT gain_db, analyzed_at FROM tracks WHERE video_id = ?', (video_id,)).fetchone()
+        return row if row else (None, None)
+    
+    def get_track(self, video_id: str) -> Optional[Tuple[str, str, int, Optional[str]]]:
+        """Get (title, url, duration, thumbnail) for a track"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT title, url, duration, thumbnail FROM tracks WHERE video_id = ? AND title IS NOT NULL',
+                (video_id,)
+            ).fetchone()
+    
+    def get_tracks(self, video_ids: List[str]) -> Dict[str, Tuple[str, str, int, Optional[str]]]:
+        """Get (title, url, duration, thumbnail) for many tracks, by video id; unknown ones are left out"""
+        tracks = {}
+        unique = list(dict.fromkeys(video_ids))
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f'SELECT video_id, title, url, duration, thumbnail FROM tracks '
+                    f'WHERE video_id IN ({",".join("?" * len(chunk))}) AND title IS NOT NULL',
+                    chunk
+                ).fetchall()
+                tracks.update((row[0], row[1:]) for row in rows)
+        return tracks
+    
+    def get_played_tracks(self, limit: int) -> List[Tuple[str, str]]:
+        """Get (video_id, title) for the most recently played tracks across all guilds"""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT t.video_id, t.title FROM tracks t
+                JOIN (SELECT video_id, MAX(last_played) AS last_played FROM guild_plays GROUP BY video_id) p
+                    ON p.video_id = t.video_id
+                WHERE t.title IS NOT NULL
+                ORDER BY p.last_played DESC LIMIT ?
+            ''', (limit,)).fetchall()
+    
+    def record_play(self, guild_id: int, video_id: str, prev_video_id: str = None):
+        """Count a play for a guild, and the transition from the previous track"""
+        with self._lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO guild_plays (guild_id, video_id, play_count, last_played) VALUES (?, ?, 1, ?)
+                ON CONFLICT(guild_id, video_id) DO UPDATE SET
+                    play_count = play_count + 1,
+                    last_played = excluded.last_played
+            ''', (guild_id, video_id, time.time()))
+            if prev_video_id and prev_video_id != video_id:
+                self._conn.execute('''
+                    INSERT INTO transitions (guild_id, prev_video_id, next_video_id, count) VALUES (?, ?, ?, 1)
+                    ON CONFLICT(guild_id, prev_video_id, next_video_id) DO UPDATE SET count = count + 1
+                ''', (guild_id, prev_video_id, video_id))
+    
+    def get_guild_plays(self, guild_id: int, video_ids: List[str]) -> dict:
+        """Get {video_id: (play_count, last_played)} for a guild"""
+        if not video_ids:
+            return {}
+        placeholders = ','.join('?' * len(video_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT video_id, play_count, last_played FROM guild_plays WHERE guild_id = ? AND video_id IN ({placeholders})',
+                (guild_id, *video_ids)
+            ).fetchall()
+        return {video_id: (count, last_played) for video_id, count, last_played in rows}
+    
+    def get_play_count(self, video_id: str) -> int:
+        """Get how often a track has been played across all guilds"""
+        with self._lock:
+            row = self._conn.execute('SELECT SUM(play_count) FROM guild_plays WHERE video_id = ?', (video_id,)).fetchone()
+        return row[0] or 0
+    
+    def get_next_candidates(self, guild_id: int, prev_video_id: str, limit: int = 20) -> List[Tuple[str, int]]:
+        """Get (video_id, count) of tracks that followed a track in a guild, most common first"""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT next_video_id, count FROM transitions
+                WHERE guild_id = ? AND prev_video_id = ?
+                ORDER BY count DESC LIMIT ?
+            ''', (guild_id, prev_video_id, limit)).fetchall()
+    
+    def get_top_tracks(self, guild_id: int, limit: int = 20) -> List[Tuple[str, int]]:
+        """Get (video_id, play_count) of a guild's most played tracks"""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT video_id, play_count FROM guild_plays
+                WHERE guild_id = ? ORDER BY play_count DESC, last_played DESC LIMIT ?
+            ''', (guild_id, limit)).fetchall()
+    
+    def get_library_files(self, root: str) -> Dict[str, Tuple[float, int]]:
+        """Get {path: (mtime, size)} of every scanned file under a directory"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, mtime, size FROM library_files WHERE substr(path, 1, ?) = ?',
+                (len(root), root)
+            ).fetchall()
+        return {path: (mtime, size) for path, mtime, size in rows}
+    
+    def get_library_tracks(self, root: str) -> List[Tuple[str, str, str, str, int]]:
+        """Get (path, title, artist, album, duration) of the playable files under a directory"""
+        with self._lock:
+            return self._conn.execute('''
+                SELECT path, title, artist, album, duration FROM library_files
+                WHERE substr(path, 1, ?) = ? AND duration IS NOT NULL
+            ''', (len(root), root)).fetchall()
+    
+    def upsert_library_files(self, rows: List[Tuple]):
+        """Store scanned files as (path, mtime, size, title, artist, album, duration) rows"""
+        with self._lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO library_files (path, mtime, size, title, artist, album, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    mtime = excluded.mtime,
+                    size = excluded.size,
+                    title = excluded.title,
+                    artist = excluded.artist,
+                    album = excluded.album,
+                    duration = excluded.duration
+            ''', rows)
+    
+    def delete_library_files(self, paths: List[str]):
+        """Forget files that were removed from the library"""
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM library_files WHERE path = ?', [(path,) for path in paths])
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
@@ -1,33 +1,91 @@
 import asyncio
 import discord
 from discord.ext import commands
-import yt_dlp
+import os
+import random
 import re
-from typing import Optional, List, Dict
+import weakref
+from typing import AsyncIterator, Optional, List, Dict, Tuple
 import logging
 from config import Config
+from metadata_cache import TrackMetadataCache
+from search_store import SearchResultStore
+from audio_source import TrackedAudioSource
+from metadata_db import MetadataDB
+from loudness import LoudnessAnalyzer
+from voice_health import MonitoredVoiceClient, VoiceHealthMonitor
+from audio_stats import AudioStatsRegistry
+from ffmpeg_supervisor import FFmpegSupervisor, SupervisedFFmpegPCMAudio
+from history_index import HistoryIndex
+from format_policy import FormatPolicy
+from stream_broker import StreamBroker
+from prefetch import StreamPrefetcher
+from state_backend import GuildStateSync, create_backend
+from local_library import LocalLibrary, is_local_id, is_remote
+from opus_cache import OpusCache
+from spilled_queue import SpilledQueue
 
 logger = logging.getLogger(__name__)
 
+_yt_dlp = None
+
+def get_yt_dlp():
+    """Import yt_dlp on first use; it is slow to import and not needed to log in"""
+    global _yt_dlp
+    if _yt_dlp is None:
+        import yt_dlp
+        _yt_dlp = yt_dlp
+    return _yt_dlp
+
+_VIDEO_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_VIDEO_URL_ID = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([A-Za-z0-9_-]{11})')
+
+def extract_video_id(query: str) -> Optional[str]:
+    """Get the video id from a YouTube URL, if it is one"""
+    match = _VIDEO_URL_ID.search(query)
+    return match.group(1) if match else None
+
+def video_url(query: str) -> str:
+    """Turn a bare YouTube video id into a watch URL; leave anything else as is"""
+    if _VIDEO_ID.match(query):
+        return f"https://www.youtube.com/watch?v={query}"
+    return query
+
+def format_duration(seconds: int) -> str:
+    """Format a number of seconds as m:ss"""
+    minutes = int(seconds) // 60
+    seconds = int(seconds) % 60
+    return f"{minutes}:{seconds:02d}"
+
 class Song:
     """Represents a song in the queue"""
     
-    def __init__(self, title: str, url: str, duration: int, requester: discord.Member, thumbnail: str = None):
+    def __init__(self, title: str, url: str, duration: int, requester: discord.Member, thumbnail: str = None,
+                 video_id: str = None):
         self.title = title
         self.url = url
         self.duration = duration
         self.requester = requester
         self.thumbnail = thumbnail
+        self.video_id = video_id
         
     def __str__(self):
-        return f"**{self.title}** - Requested by {self.requester.display_name}"
+        return f"**{self.title}** - Requested by {self.requester_name}"
+    
+    @property
+    def cache_key(self) -> str:
+        """Key used for metadata caches (video id, or URL if unknown)"""
+        return self.video_id or self.url
+    
+    @property
+    def requester_name(self) -> str:
+        """Return the requester's display name, if known"""
+        return self.requester.display_name if self.requester else "Unknown"
     
     @property
     def formatted_duration(self):
         """Return formatted duration string"""
-        minutes = self.duration // 60
-        seconds = self.duration % 60
-        return f"{minutes}:{seconds:02d}"
+        return format_duration(self.duration)
 
 class MusicPlayer:
     """Handles music playback and queue management"""
@@ -38,13 +96,139 @@ class MusicPlayer:
         self.now_playing: Dict[int, Song] = {}   # guild_id -> current song
         self.voice_clients: Dict[int, discord.VoiceClient] = {}  # guild_id -> voice client
         self.volume: Dict[int, float] = {}       # guild_id -> volume
+        self.queue_versions: Dict[int, int] = {}   # guild_id -> change counter
+        self.queue_durations: Dict[int, int] = {}  # guild_id -> total queued seconds
+        self.stream_urls: Dict[int, str] = {}   # guild_id -> resolved stream URL of current song
+        self.track_gains: Dict[int, float] = {}  # guild_id -> loudness gain of current song
+        self.current_sources: Dict[int, TrackedAudioSource] = {}  # guild_id -> playing source
+        self.playing_sources: Dict[int, TrackedAudioSource] = {}  # guild_id -> source started by play(), owner of the pending 'after'
+        self.suppressed_advances = weakref.WeakSet()  # sources whose 'after' callback is ignored
+        self.autoplay_enabled: Dict[int, bool] = {}  # guild_id -> autoplay when the queue runs dry
+        self.last_played: Dict[int, str] = {}        # guild_id -> video id of the last started song
+        self.resume_positions: Dict[int, Tuple[str, float]] = {}  # guild_id -> (song URL, seconds) handed over by another node
+        self.metadata_cache = TrackMetadataCache()
+        self.search_results = SearchResultStore(self.metadata_cache)  # user_id -> last search
+        self.metadata_db = MetadataDB()
+        self.loudness = LoudnessAnalyzer(self.metadata_db)
+        self.voice_health = VoiceHealthMonitor(self)
+        self.audio_stats = AudioStatsRegistry()
+        self.ffmpeg = FFmpegSupervisor()
+        self.history = HistoryIndex(self.metadata_db)
+        self.library = LocalLibrary(self.metadata_db)
+        self.opus_cache = OpusCache(self.metadata_db, self.ffmpeg)
+        self.format_policy = FormatPolicy()
+        self.broker = StreamBroker(self.ffmpeg)
+        self.prefetcher = StreamPrefetcher(self._extract_stream_url)
+        self.state = GuildStateSync(create_backend(Config.STATE_BACKEND), Config.STATE_NODE_ID,
+                                    self._snapshot_state, self._lease_lost, self._snapshot_parts)
         
     def get_queue(self, guild_id: int) -> List[Song]:
         """Get the music queue for a guild"""
         if guild_id not in self.queues:
-            self.queues[guild_id] = []
+            if Config.LARGE_QUEUES:
+                self.queues[guild_id] = SpilledQueue(self.metadata_db, Song, lambda user_id: self._get_member(guild_id, user_id))
+            else:
+                self.queues[guild_id] = []
         return self.queues[guild_id]
     
+    def _get_member(self, guild_id: int, user_id: int) -> Optional[discord.Member]:
+        """Look up a cached member, e.g. the requester of a song read back from a spilled queue"""
+        guild = self.bot.get_guild(guild_id)
+        return guild.get_member(user_id) if guild else None
+    
+    def get_queue_version(self, guild_id: int) -> int:
+        """Get a counter that changes whenever the guild's queue changes"""
+        return self.queue_versions.get(guild_id, 0)
+    
+    def get_queue_duration(self, guild_id: int) -> int:
+        """Get the total duration of the queued songs in seconds"""
+        return self.queue_durations.get(guild_id, 0)
+    
+    def get_queue_slice(self, guild_id: int, start: int, end: int) -> List[Song]:
+        """Get a slice of the queue without copying the whole list"""
+        return self.get_queue(guild_id)[start:end]
+    
+    def _queue_changed(self, guild_id: int, duration_delta: int = 0):
+        """Record a queue mutation so cached views can be invalidated"""
+        self.queue_versions[guild_id] = self.queue_versions.get(guild_id, 0) + 1
+        if duration_delta:
+            self.queue_durations[guild_id] = max(0, self.queue_durations.get(guild_id, 0) + duration_delta)
+        self.state.mark_dirty(guild_id)
+    
+    def clear_queue(self, guild_id: int):
+        """Remove every song from the guild's queue"""
+        self.get_queue(guild_id).clear()
+        self.queue_durations[guild_id] = 0
+        self._queue_changed(guild_id)
+    
+    def shuffle_queue(self, guild_id: int):
+        """Shuffle the guild's queue in place"""
+        queue = self.get_queue(guild_id)
+        if isinstance(queue, SpilledQueue):
+            queue.shuffle()
+        else:
+            random.shuffle(queue)
+        self._queue_changed(guild_id)
+    
+    def move_songs(self, guild_id: int, start: int, end: int, destination: int) -> int:
+        """Move songs start..end (1-based, inclusive) so the first lands at destination
+        
+        Returns the number of songs moved, or 0 if the positions are invalid.
+        """
+        queue = self.get_queue(guild_id)
+        if not 1 <= start <= end <= len(queue) or not 1 <= destination <= len(queue):
+            return 0
+        
+        block = queue[start - 1:end]
+        del queue[start - 1:end]
+        destination = min(destination, len(queue) + 1)
+        queue[destination - 1:destination - 1] = block
+        self._queue_changed(guild_id)
+        return len(block)
+    
+    def remove_range(self, guild_id: int, start: int, end: int) -> List[Song]:
+        """Remove songs start..end (1-based, inclusive) from the queue"""
+        queue = self.get_queue(guild_id)
+        if not 1 <= start <= end <= len(queue):
+            return []
+        
+        removed = queue[start - 1:end]
+        del queue[start - 1:end]
+        self._queue_changed(guild_id, -sum(song.duration or 0 for song in removed))
+        return removed
+    
+    def remove_by_requester(self, guild_id: int, user_id: int) -> List[Song]:
+        """Remove every queued song requested by a user"""
+        return self._filter_queue(guild_id, lambda song: not (song.requester and song.requester.id == user_id))
+    
+    def dedupe_queue(self, guild_id: int) -> List[Song]:
+        """Remove repeated songs from the queue, keeping the first occurrence"""
+        seen = set()
+        
+        def first_occurrence(song: Song) -> bool:
+            if song.cache_key in seen:
+                return False
+            seen.add(song.cache_key)
+            return True
+        
+        return self._filter_queue(guild_id, first_occurrence)
+    
+    def _filter_queue(self, guild_id: int, keep) -> List[Song]:
+        """Keep only the songs for which keep(song) is true, in one pass; returns the removed songs"""
+        queue = self.get_queue(guild_id)
+        if isinstance(queue, SpilledQueue):
+            removed = queue.filter(keep)
+        else:
+            kept, removed = [], []
+            for song in queue:
+                (kept if keep(song) else removed).append(song)
+            if removed:
+                queue[:] = kept
+        
+        if removed:
+            self._queue_changed(guild_id, -sum(song.duration or 0 for song in removed))
+        return removed
+    
     def get_volume(self, guild_id: int) -> float:
         """Get the volume for a guild"""
         if guild_id not in self.volume:
@@ -68,20 +252,102 @@ class MusicPlayer:
         except (ValueError, TypeError):
             # Fallback to default volume if invalid
             self.volume[guild_id] = Config.DEFAULT_VOLUME
+        self.state.mark_dirty(guild_id)
         
         # Update current audio source volume if playing
-        if guild_id in self.voice_clients and self.voice_clients[guild_id].source:
+        voice_client = self.voice_clients.get(guild_id)
+        active = voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+        if self.opus_cache.baked_factor(self.stream_urls.get(guild_id, '')) is not None:
+            # Cached Opus frames can't be scaled: restart the track where it is with the matching source.
+            # After the track has ended the next source picks the volume up; seeking would replay its end.
+            if not active:
+                return
+            position = self.get_position(guild_id)
+            if position is not None:
+                self.bot.loop.create_task(self.seek(guild_id, position))
+        elif guild_id in self.voice_clients and self.voice_clients[guild_id].source:
             try:
-                self.voice_clients[guild_id].source.volume = self.volume[guild_id]
+                self.voice_clients[guild_id].source.volume = self.volume[guild_id] * self.track_gains.get(guild_id, 1.0)
             except Exception as e:
                 logger.warning(f"Could not update volume for guild {guild_id}: {e}")
     
+    def set_autoplay(self, guild_id: int, enabled: bool):
+        """Enable or disable autoplay for a guild"""
+        self.autoplay_enabled[guild_id] = enabled
+        self.state.mark_dirty(guild_id)
+    
+    def _song_from_db(self, video_id: str, requester: discord.Member = None) -> Optional[Song]:
+        """Build a Song from the metadata database"""
+        track = self.metadata_db.get_track(video_id)
+        if not track:
+            return None
+        title, url, duration, thumbnail = track
+        return Song(title=title, url=url, duration=duration or 0, requester=requester,
+                    thumbnail=thumbnail, video_id=video_id)
+    
+    def find_local(self, query: str) -> Optional[Song]:
+        """Look up a match in the local music library"""
+        if not self.library.enabled or query.startswith(('http://', 'https://')):
+            return None
+        try:
+            match = self.library.find(query)
+        except Exception as e:
+            logger.warning(f"Local library lookup failed for '{query}': {e}")
+            return None
+        if not match:
+            return None
+        video_id, path, title, duration = match
+        logger.info(f"Found song in local library: {title}")
+        return Song(title=title, url=path, duration=duration, requester=None, video_id=video_id)
+    
+    def find_known(self, query: str, guild_id: int) -> Optional[Song]:
+        """Answer a search without YouTube: local library first, then play history"""
+        return self.find_local(query) or self.find_in_history(query, guild_id)
+    
+    def find_in_history(self, query: str, guild_id: int) -> Optional[Song]:
+        """Look up a near-exact match among previously played songs"""
+        if not Config.HISTORY_LOOKUP_ENABLED or query.startswith(('http://', 'https://')):
+            return None
+        try:
+            video_id = self.history.find_match(query, guild_id)
+            song = self._song_from_db(video_id) if video_id else None
+        except Exception as e:
+            logger.warning(f"History lookup failed for '{query}': {e}")
+            return None
+        if song:
+            logger.info(f"Found song in play history: {song.title}")
+        return song
+    
+    async def _queue_autoplay(self, guild_id: int) -> bool:
+        """Queue a song picked from play history; returns whether one was added"""
+        try:
+            video_id = self.history.pick_next(guild_id, self.last_played.get(guild_id))
+            voice_client = self.voice_clients.get(guild_id)
+            requester = voice_client.guild.me if voice_client else None
+            song = self._song_from_db(video_id, requester) if video_id else None
+        except Exception as e:
+            logger.warning(f"Autoplay failed for guild {guild_id}: {e}")
+            return False
+        
+        if not song:
+            logger.info(f"Autoplay found nothing to play for guild {guild_id}")
+            return False
+        
+        logger.info(f"Autoplay queued: {song.title} for guild {guild_id}")
+        return await self.add_to_queue(guild_id, song)
+    
     async def search_youtube(self, query: str) -> Optional[Song]:
         """Search YouTube for a song"""
+        # yt-dlp blocks for the whole network round trip, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._extract_song, query)
+    
+    def _extract_song(self, query: str) -> Optional[Song]:
+        """Look up a single song with yt-dlp (blocking)"""
         try:
             ydl_opts = Config.YOUTUBE_DL_OPTIONS.copy()
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with get_yt_dlp().YoutubeDL(ydl_opts) as ydl:
                 # Try to extract info directly if it's a URL
                 if query.startswith(('http://', 'https://')):
                     info = ydl.extract_info(query, download=False)
@@ -105,7 +371,8 @@ class MusicPlayer:
                     url=info.get('webpage_url', query),
                     duration=info.get('duration', 0),
                     requester=None,  # Will be set by caller
-                    thumbnail=info.get('thumbnail')
+                    thumbnail=info.get('thumbnail'),
+                    video_id=info.get('id')
                 )
                 
                 logger.info(f"Found song: {song.title} ({song.formatted_duration})")
@@ -115,12 +382,49 @@ class MusicPlayer:
             logger.error(f"Error searching YouTube: {e}")
             return None
 
+    async def resolve_many(self, queries: List[str], concurrency: int = None,
+                           guild_id: int = None) -> AsyncIterator[Tuple[str, Optional[Song]]]:
+        """Resolve many queries concurrently, yielding (query, song) in the original order
+        
+        At most ``concurrency`` lookups run at once. URLs of tracks already in the
+        metadata database are answered from it without contacting YouTube, as are
+        searches matching the local library, or the guild's play history when
+        ``guild_id`` is given.
+        """
+        semaphore = asyncio.Semaphore(concurrency or Config.RESOLVE_CONCURRENCY)
+        
+        async def resolve(query: str) -> Optional[Song]:
+            video_id = extract_video_id(query)
+            song = self._song_from_db(video_id) if video_id else None
+            if not song:
+                song = self.find_local(query)
+            if not song and guild_id is not None:
+                song = self.find_in_history(query, guild_id)
+            if song:
+                return song
+            async with semaphore:
+                return await self.search_youtube(query)
+        
+        tasks = [asyncio.ensure_future(resolve(query)) for query in queries]
+        try:
+            for query, task in zip(queries, tasks):
+                try:
+                    song = await task
+                except Exception as e:
+                    logger.error(f"Error resolving '{query}': {e}")
+                    song = None
+                yield query, song
+        finally:
+            # The consumer stopped early: don't keep looking up songs nobody will queue
+            for task in tasks:
+                task.cancel()
+    
     async def search_youtube_multiple(self, query: str, max_results: int = 5) -> List[Song]:
         """Search YouTube for multiple songs"""
         try:
             ydl_opts = Config.YOUTUBE_DL_OPTIONS.copy()
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with get_yt_dlp().YoutubeDL(ydl_opts) as ydl:
                 # Try to extract info directly if it's a URL
                 if query.startswith(('http://', 'https://')):
                     info = ydl.extract_info(query, download=False)
@@ -131,7 +435,8 @@ class MusicPlayer:
                             url=info.get('webpage_url', query),
                             duration=info.get('duration', 0),
                             requester=None,
-                            thumbnail=info.get('thumbnail')
+                            thumbnail=info.get('thumbnail'),
+                            video_id=info.get('id')
                         )
                         return [song]
                     return []
@@ -151,7 +456,8 @@ class MusicPlayer:
                                 url=entry.get('webpage_url', ''),
                                 duration=entry.get('duration', 0),
                                 requester=None,  # Will be set by caller
-                                thumbnail=entry.get('thumbnail')
+                                thumbnail=entry.get('thumbnail'),
+                                video_id=entry.get('id')
                             )
                             songs.append(song)
                             
@@ -173,12 +479,138 @@ class MusicPlayer:
             return False
         
         queue.append(song)
+        self._queue_changed(guild_id, song.duration or 0)
         return True
     
+    def add_songs(self, guild_id: int, songs: List[Song]) -> int:
+        """Add several songs to the queue at once; returns how many fit"""
+        queue = self.get_queue(guild_id)
+        songs = songs[:max(0, Config.MAX_QUEUE_SIZE - len(queue))]
+        if songs:
+            queue.extend(songs)
+            self._queue_changed(guild_id, sum(song.duration or 0 for song in songs))
+        return len(songs)
+    
+    async def connect(self, channel: discord.VoiceChannel) -> discord.VoiceClient:
+        """Join a voice channel and start watching the connection
+        
+        Takes the guild's playback lease first and raises GuildOwnedElsewhere if
+        another node is playing there. State saved by a previous owner is restored
+        unless this node already has songs queued.
+        """
+        guild_id = channel.guild.id
+        saved = await self.state.acquire(guild_id)
+        try:
+            voice_client = await channel.connect(cls=MonitoredVoiceClient)
+        except Exception:
+            await self.state.release(guild_id)
+            raise
+        self.voice_clients[guild_id] = voice_client
+        self.voice_health.start(guild_id)
+        # Started here on the event loop: sources can also be created on the audio thread
+        self.ffmpeg.ensure_reaper(self._current_ffmpeg_source)
+        
+        # Ensure volume is properly initialized
+        self.set_volume(guild_id, Config.DEFAULT_VOLUME)
+        if saved and not self.get_queue(guild_id) and guild_id not in self.now_playing:
+            self._restore_state(channel.guild, saved)
+        logger.info(f"Bot joined voice channel {channel.name} in guild {guild_id}")
+        return voice_client
+    
+    def _snapshot_state(self, guild_id: int) -> Dict:
+        """Serializable copy of a guild's queue and settings for the shared store"""
+        def song_state(song: Song) -> Dict:
+            return {
+                'title': song.title,
+                'url': song.url,
+                'duration': song.duration,
+                'thumbnail': song.thumbnail,
+                'video_id': song.video_id,
+                'requester_id': song.requester.id if song.requester else None,
+            }
+        
+        queue = self.queues.get(guild_id, [])
+        # A spilled queue's packed tail is saved separately, only when it changes (see _snapshot_parts)
+        songs = queue.window if isinstance(queue, SpilledQueue) else queue
+        
+        current = self.now_playing.get(guild_id)
+        return {
+            'queue': [song_state(song) for song in songs],
+            'now_playing': song_state(current) if current else None,
+            'position': self.get_position(guild_id) if current else None,
+            'volume': self.volume.get(guild_id, Config.DEFAULT_VOLUME),
+            'autoplay': self.autoplay_enabled.get(guild_id, False),
+            'node': self.state.node_id,
+        }
+    
+    def _snapshot_parts(self, guild_id: int) -> Dict:
+        """Large parts of a guild's state, saved under their own keys as (version, dump)"""
+        queue = self.queues.get(guild_id)
+        if isinstance(queue, SpilledQueue) and queue.spilled_count:
+            return {'queue_tail': (queue.tail_version, queue.dump_tail)}
+        return {}
+    
+    def _restore_state(self, guild: discord.Guild, saved: Dict):
+        """Load the queue and settings another node saved for this guild
+        
+        The song that was playing goes back to the front of the queue and
+        resumes where the previous node stopped.
+        """
+        def song_from_state(entry: Dict) -> Song:
+            requester = guild.get_member(entry['requester_id']) if entry.get('requester_id') else None
+            return Song(entry['title'], entry['url'], entry.get('duration') or 0, requester,
+                        entry.get('thumbnail'), entry.get('video_id'))
+        
+        entries = ([saved['now_playing']] if saved.get('now_playing') else []) + saved.get('queue', [])
+        songs = [song_from_state(entry) for entry in entries]
+        if saved.get('now_playing') and saved.get('position'):
+            self.resume_positions[guild.id] = (saved['now_playing']['url'], saved['position'])
+        self.add_songs(guild.id, songs)
+        
+        # The rest of a spilled queue: packed records whose titles are in the metadata database
+        tail = saved.get('part_values', {}).get('queue_tail')
+        if tail:
+            queue = self.get_queue(guild.id)
+            room = max(0, Config.MAX_QUEUE_SIZE - len(queue))
+            if isinstance(queue, SpilledQueue):
+                self._queue_changed(guild.id, queue.load_tail(tail, room))
+            else:
+                spilled = SpilledQueue(self.metadata_db, Song, guild.get_member)
+                spilled.load_tail(tail, room)
+                self.add_songs(guild.id, list(spilled))
+            songs = self.get_queue(guild.id)
+        self.set_volume(guild.id, saved.get('volume', Config.DEFAULT_VOLUME))
+        self.autoplay_enabled[guild.id] = saved.get('autoplay', False)
+        logger.info(f"Restored {len(songs)} songs for guild {guild.id} saved by node {saved.get('node')}")
+    
+    def release_guild(self, guild_id: int):
+        """Save the guild's state and give up its lease after the bot left voice"""
+        asyncio.get_running_loop().create_task(self.state.release(guild_id))
+    
+    def _lease_lost(self, guild_id: int):
+        """Stop playing in a guild whose lease another node has taken over"""
+        voice_client = self.voice_clients.pop(guild_id, None)
+        # Drop local state without saving it; the new owner's copy is authoritative
+        self.queues.pop(guild_id, None)
+        self.queue_durations.pop(guild_id, None)
+        self.resume_positions.pop(guild_id, None)
+        self.now_playing.pop(guild_id, None)
+        self.stream_urls.pop(guild_id, None)
+        self.track_gains.pop(guild_id, None)
+        self.current_sources.pop(guild_id, None)
+        self.voice_health.stop(guild_id)
+        if voice_client:
+            self.suppress_advance(guild_id)
+            asyncio.get_running_loop().create_task(voice_client.disconnect(force=True))
+    
     async def play_next(self, guild_id: int):
         """Play the next song in the queue"""
         queue = self.get_queue(guild_id)
         
+        if not queue and self.autoplay_enabled.get(guild_id) and guild_id in self.voice_clients:
+            # Keep the music going with something this server usually plays next
+            await self._queue_autoplay(guild_id)
+        
         if not queue:
             # No more songs, disconnect after a delay
             await asyncio.sleep(10)
@@ -190,6 +622,7 @@ class MusicPlayer:
         # Get next song
         song = queue.pop(0)
         self.now_playing[guild_id] = song
+        self._queue_changed(guild_id, -(song.duration or 0))
         
         # Play the song
         try:
@@ -199,109 +632,76 @@ class MusicPlayer:
                 return
             
             if not voice_client.is_connected():
-                logger.error(f"Voice client not connected for guild {guild_id}")
+                logger.error(f"Voice client not connected for guild {guild_id}, attempting recovery")
+                # Put the song back so it plays once the connection is re-established
+                queue.insert(0, song)
+                del self.now_playing[guild_id]
+                self._queue_changed(guild_id, song.duration or 0)
+                asyncio.create_task(self.voice_health.recover(guild_id, "not connected at track start"))
                 return
             
             logger.info(f"Starting playback for: {song.title} in guild {guild_id}")
             
-            # Create audio source
-            ydl_opts = Config.YOUTUBE_DL_OPTIONS.copy()
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(song.url, download=False)
-                
-                # Validate info structure
-                if not info or 'formats' not in info:
-                    logger.error(f"Invalid video info structure for song: {song.title}")
-                    raise ValueError("Invalid video info structure")
-                
-                logger.info(f"Found {len(info['formats'])} audio formats for song: {song.title}")
-                
-                # Find the best audio format
-                audio_formats = [f for f in info['formats'] if f.get('acodec') != 'none']
-                if not audio_formats:
-                    # Fallback to any format
-                    audio_formats = info['formats']
-                    logger.info(f"Using fallback formats for song: {song.title}")
-                
-                if not audio_formats:
-                    logger.error(f"No audio formats found for song: {song.title}")
-                    raise ValueError("No audio formats available")
-                
-                # Filter out formats without URLs
-                audio_formats = [f for f in audio_formats if f.get('url')]
-                if not audio_formats:
-                    logger.error(f"No formats with URLs found for song: {song.title}")
-                    raise ValueError("No audio formats with URLs available")
-                
-                # Sort by quality (prefer audio-only formats)
-                # Handle None values safely in sorting
-                def safe_sort_key(x):
-                    acodec = x.get('acodec', '')
-                    abr = x.get('abr', 0) or 0  # Convert None to 0
-                    filesize = x.get('filesize', 0) or 0  # Convert None to 0
-                    
-                    # Ensure numeric values are valid
-                    try:
-                        abr = float(abr) if abr is not None else 0.0
-                        filesize = float(filesize) if filesize is not None else 0.0
-                    except (ValueError, TypeError):
-                        abr = 0.0
-                        filesize = 0.0
-                    
-                    return (
-                        acodec == 'none',  # Prefer audio-only
-                        abr,               # Higher bitrate
-                        filesize           # Larger file size
-                    )
-                
-                try:
-                    audio_formats.sort(key=safe_sort_key)
-                    logger.info(f"Successfully sorted {len(audio_formats)} audio formats")
-                except Exception as e:
-                    logger.warning(f"Error sorting audio formats, using first available: {e}")
-                    # If sorting fails, just use the first format
-                
-                # Get the best format
-                best_format = audio_formats[0]
-                url = best_format.get('url')
-                
-                if not url:
-                    logger.error(f"No URL found in audio format for song: {song.title}")
-                    raise ValueError("No audio URL available")
-                
-                logger.info(f"Selected format: acodec={best_format.get('acodec', 'unknown')}, "
-                          f"abr={best_format.get('abr', 'unknown')}, "
-                          f"filesize={best_format.get('filesize', 'unknown')}")
-                logger.info(f"Using audio URL: {url[:100]}...")
-                
-                # Create FFmpeg audio source
-                source = discord.FFmpegPCMAudio(
-                    url,
-                    **Config.FFMPEG_OPTIONS
-                )
-                
-                # Apply volume with safety check
-                volume = self.ensure_volume_initialized(guild_id)
-                if volume is None or not isinstance(volume, (int, float)):
-                    volume = Config.DEFAULT_VOLUME
-                    self.volume[guild_id] = volume
-                    logger.info(f"Reset volume to default for guild {guild_id}: {volume}")
-                
-                logger.info(f"Setting volume to {volume} for guild {guild_id}")
-                source = discord.PCMVolumeTransformer(source, volume=float(volume))
-                
-                # Play the audio
-                voice_client.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(
-                    self.play_next(guild_id), self.bot.loop
-                ))
-                
-                logger.info(f"Now playing: {song.title} in guild {guild_id}")
-                
-                # Reset retry counter on successful playback
-                if hasattr(self, '_play_retry_count'):
-                    self._play_retry_count = 0
+            if is_local_id(song.video_id):
+                # Local files play straight from disk: no extraction, no network
+                if not os.path.isfile(song.url):
+                    raise FileNotFoundError(f"Local file is gone: {song.url}")
+                url = song.url
+                logger.info(f"Playing local file: {url}")
+            elif self.opus_cache.path_for(song.video_id):
+                # Popular tracks are stored as Opus frames: no extraction and usually no FFmpeg
+                url = self.opus_cache.path_for(song.video_id)
+                logger.info(f"Playing cached Opus for: {song.title}")
+            else:
+                # Another guild already streaming this track shares its decode: no extraction needed
+                url = self.broker.joinable_url(song.video_id)
+                if url:
+                    logger.info(f"Joining shared stream for: {song.title}")
+                else:
+                    # Picked from search results that were resolved while the user was choosing
+                    url = await self.prefetcher.take(song.video_id)
+                    if url:
+                        logger.info(f"Using prefetched stream for: {song.title}")
+                    else:
+                        # yt-dlp blocks for seconds: keep the event loop (and every other guild) responsive
+                        url = await asyncio.get_running_loop().run_in_executor(
+                            None, self._extract_stream_url, song, getattr(voice_client.channel, 'bitrate', None))
                 
+                if self.now_playing.get(guild_id) is not song or self.voice_clients.get(guild_id) is not voice_client:
+                    # Stopped, skipped or disconnected while the stream was being resolved
+                    logger.info(f"Dropped resolved stream for {song.title}: guild {guild_id} moved on")
+                    return
+            
+            # Remember the resolved stream so seeks don't need a new extraction
+            self.stream_urls[guild_id] = url
+            
+            # Record the track and measure its loudness in the background for next time
+            if song.video_id:
+                self.metadata_db.upsert_track(song.video_id, song.title, song.url, song.duration, song.thumbnail)
+                if is_remote(url) or is_local_id(song.video_id):
+                    self.loudness.schedule(song.video_id, url)
+            self.track_gains[guild_id] = self.loudness.get_gain(song.video_id)
+            
+            # Create the audio source and play it
+            resume = self.resume_positions.pop(guild_id, None)
+            offset = resume[1] if resume and resume[0] == song.url else 0.0
+            source = self._create_source(guild_id, url, offset, video_id=song.video_id)
+            self._play_source(guild_id, voice_client, source)
+            
+            logger.info(f"Now playing: {song.title} in guild {guild_id}")
+            
+            # Store the track as Opus once it has been played often enough
+            self.opus_cache.consider(song.video_id, url, Config.DEFAULT_VOLUME * self.track_gains[guild_id])
+            
+            # Update play counts and co-occurrence statistics
+            if song.video_id:
+                self.history.record_play(guild_id, song.video_id, song.title, self.last_played.get(guild_id))
+                self.last_played[guild_id] = song.video_id
+            
+            # Reset retry counter on successful playback
+            if hasattr(self, '_play_retry_count'):
+                self._play_retry_count = 0
+            
         except Exception as e:
             logger.error(f"Error playing song '{song.title}' in guild {guild_id}: {e}")
             logger.error(f"Full error details: {type(e).__name__}: {str(e)}")
@@ -323,27 +723,211 @@ class MusicPlayer:
                 logger.error(f"Max retry attempts reached for guild {guild_id}, stopping playback")
                 self._play_retry_count = 0
                 # Clear the queue to prevent further issues
-                queue.clear()
+                self.clear_queue(guild_id)
                 if guild_id in self.now_playing:
                     del self.now_playing[guild_id]
     
+    def _extract_stream_url(self, song: Song, channel_bitrate: Optional[int] = None) -> str:
+        """Resolve a song to a direct audio stream URL with yt-dlp (blocking)"""
+        ydl_opts = Config.YOUTUBE_DL_OPTIONS.copy()
+        
+        with get_yt_dlp().YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(song.url, download=False)
+            
+            # Validate info structure
+            if not info or 'formats' not in info:
+                logger.error(f"Invalid video info structure for song: {song.title}")
+                raise ValueError("Invalid video info structure")
+            
+            logger.info(f"Found {len(info['formats'])} audio formats for song: {song.title}")
+            
+            # Pick a format sized for the voice channel (see format_policy.py)
+            best_format = self.format_policy.select(info['formats'], video_id=song.video_id,
+                                                    channel_bitrate=channel_bitrate,
+                                                    duration=song.duration)
+            if not best_format:
+                logger.error(f"No audio formats found for song: {song.title}")
+                raise ValueError("No audio formats available")
+            
+            url = best_format.get('url')
+            
+            if not url:
+                logger.error(f"No URL found in audio format for song: {song.title}")
+                raise ValueError("No audio URL available")
+            
+            logger.info(f"Selected format: id={best_format.get('format_id', 'unknown')}, "
+                      f"acodec={best_format.get('acodec', 'unknown')}, "
+                      f"abr={best_format.get('abr', 'unknown')}, "
+                      f"filesize={best_format.get('filesize', 'unknown')}")
+            logger.info(f"Using audio URL: {url[:100]}...")
+        
+            return url
+    
+    def _ffmpeg_source(self, guild_id: int, url: str, offset: float = 0.0) -> SupervisedFFmpegPCMAudio:
+        """Start a guild's own FFmpeg decode, optionally at an offset"""
+        # The reconnect options only apply to network streams
+        ffmpeg_options = (Config.FFMPEG_OPTIONS if is_remote(url) else Config.LOCAL_FFMPEG_OPTIONS).copy()
+        if offset > 0:
+            # Input seeking: FFmpeg jumps straight to the offset instead of decoding up to it
+            ffmpeg_options['before_options'] = f"-ss {offset:.2f} {ffmpeg_options.get('before_options', '')}".strip()
+        
+        return self.ffmpeg.create_source(guild_id, url, **ffmpeg_options)
+    
+    def _create_source(self, guild_id: int, url: str, offset: float = 0.0, video_id: str = None) -> TrackedAudioSource:
+        """Create a volume-controlled source, optionally starting at an offset
+        
+        Streamed tracks started from the beginning go through the stream broker, so
+        guilds playing the same track at the same time share one decode. Cached
+        Opus tracks are sent as stored when the guild's volume matches the one
+        baked into the file, and decoded with a correcting volume otherwise.
+        """
+        # Apply volume with safety check
+        volume = self.ensure_volume_initialized(guild_id)
+        if volume is None or not isinstance(volume, (int, float)):
+            volume = Config.DEFAULT_VOLUME
+            self.volume[guild_id] = volume
+            logger.info(f"Reset volume to default for guild {guild_id}: {volume}")
+        
+        # Loudness normalization is folded into the volume factor, so it costs nothing extra
+        gain = self.track_gains.get(guild_id, 1.0)
+        factor = float(volume) * gain
+        
+        baked = self.opus_cache.baked_factor(url)
+        if baked is not None:
+            cached = self.opus_cache.open(url, factor, offset)
+            if cached:
+                return TrackedAudioSource(cached, start_offset=offset, stats=self.audio_stats.get(guild_id))
+            factor = factor / baked if baked > 0 else factor
+        
+        if offset <= 0 and video_id and Config.BROKER_ENABLED and is_remote(url):
+            source = self.broker.open(video_id, url, lambda position: self._ffmpeg_source(guild_id, url, position))
+        else:
+            source = self._ffmpeg_source(guild_id, url, offset)
+        
+        logger.info(f"Setting volume to {volume} (normalization gain {gain:.2f}) for guild {guild_id}")
+        source = discord.PCMVolumeTransformer(source, volume=factor)
+        return TrackedAudioSource(source, start_offset=offset, stats=self.audio_stats.get(guild_id))
+    
+    def _play_source(self, guild_id: int, voice_client: discord.VoiceClient, source: TrackedAudioSource):
+        """Start a source on the voice client and continue with the queue afterwards"""
+        self.current_sources[guild_id] = source
+        self.playing_sources[guild_id] = source
+        try:
+            voice_client.play(source, after=lambda e: self._after_playback(guild_id, e, source))
+        except Exception:
+            # Don't leave an FFmpeg process behind if playback never started
+            self.current_sources.pop(guild_id, None)
+            self.playing_sources.pop(guild_id, None)
+            source.cleanup()
+            raise
+    
+    def _current_ffmpeg_source(self, guild_id: int) -> Optional[SupervisedFFmpegPCMAudio]:
+        """Get the FFmpeg source behind the guild's current song, if any"""
+        source = self.current_sources.get(guild_id) if guild_id in self.now_playing else None
+        while source is not None and not isinstance(source, SupervisedFFmpegPCMAudio):
+            source = getattr(source, 'original', None)
+        return source
+    
+    def _after_playback(self, guild_id: int, error: Optional[Exception], source: TrackedAudioSource):
+        """Called from the audio thread when a source stops"""
+        if source in self.suppressed_advances:
+            # Only the source that was stopped on purpose is ignored, however late its callback fires
+            self.suppressed_advances.discard(source)
+            return
+        if self.playing_sources.get(guild_id) is source:
+            self.playing_sources.pop(guild_id, None)
+        
+        voice_client = self.voice_clients.get(guild_id)
+        if (voice_client and not voice_client.is_connected() and self.now_playing.get(guild_id)
+                and not getattr(voice_client, 'intentional_disconnect', False)):
+            # Playback was cut off by a dropped connection, not by the song ending
+            asyncio.run_coroutine_threadsafe(
+                self.voice_health.recover(guild_id, "playback interrupted"), self.bot.loop
+            )
+            return
+        
+        asyncio.run_coroutine_threadsafe(self.play_next(guild_id), self.bot.loop)
+    
+    def suppress_advance(self, guild_id: int):
+        """Keep the queue from advancing when the current source is stopped on purpose"""
+        source = self.playing_sources.pop(guild_id, None)
+        if source is not None:
+            self.suppressed_advances.add(source)
+    
+    def get_position(self, guild_id: int) -> Optional[float]:
+        """Get the playback position of the current song in seconds"""
+        source = self.current_sources.get(guild_id)
+        if source is not None and guild_id in self.now_playing:
+            return source.position
+        return None
+    
+    async def seek(self, guild_id: int, position: float, restart: bool = False) -> bool:
+        """Seek the current song to a position in seconds
+        
+        Only works while the song is playing or paused: after it has ended,
+        now_playing stays set until the queue moves on, and starting it again
+        would replay it with a second queue-advancing callback. ``restart``
+        starts the song afresh on an idle voice client instead, for resuming
+        after a reconnect.
+        """
+        song = self.now_playing.get(guild_id)
+        voice_client = self.voice_clients.get(guild_id)
+        url = self.stream_urls.get(guild_id)
+        
+        if not song or not voice_client or not voice_client.is_connected() or not url:
+            return False
+        active = voice_client.is_playing() or voice_client.is_paused()
+        if not active and not restart:
+            return False
+        
+        position = max(0.0, float(position))
+        if song.duration:
+            position = min(position, max(0.0, song.duration - 1))
+        
+        try:
+            source = self._create_source(guild_id, url, offset=position)
+        except Exception as e:
+            logger.error(f"Error creating seek source for guild {guild_id}: {e}")
+            return False
+        
+        if active:
+            # Swap the source in place so the 'after' callback doesn't advance the queue;
+            # the player keeps its paused state
+            old_source = voice_client.source
+            voice_client.source = source
+            self.current_sources[guild_id] = source
+            if old_source:
+                old_source.cleanup()
+        else:
+            self._play_source(guild_id, voice_client, source)
+        
+        logger.info(f"Seeked to {position:.1f}s in '{song.title}' for guild {guild_id}")
+        return True
+    
     async def skip(self, guild_id: int):
         """Skip the current song"""
         if guild_id in self.voice_clients:
             self.voice_clients[guild_id].stop()
+            # Make sure the skipped song's FFmpeg process doesn't linger
+            self.ffmpeg.reap_later(guild_id, self._current_ffmpeg_source)
     
     async def stop(self, guild_id: int):
         """Stop playback and clear queue"""
         if guild_id in self.voice_clients:
             self.voice_clients[guild_id].stop()
+            self.ffmpeg.reap_later(guild_id, self._current_ffmpeg_source)
         
         # Clear queue
         if guild_id in self.queues:
-            self.queues[guild_id].clear()
+            self.clear_queue(guild_id)
         
         # Clear now playing
+        self.stream_urls.pop(guild_id, None)
+        self.track_gains.pop(guild_id, None)
+        self.current_sources.pop(guild_id, None)
         if guild_id in self.now_playing:
             del self.now_playing[guild_id]
+            self._queue_changed(guild_id)
     
     def get_queue_info(self, guild_id: int) -> Dict:
         """Get information about the current queue and playback"""
@@ -354,6 +938,7 @@ class MusicPlayer:
             'current_song': current_song,
             'queue': queue,
             'queue_length': len(queue),
+            'queue_duration': self.get_queue_duration(guild_id),
             'volume': self.get_volume(guild_id)
         }
     
@@ -366,6 +951,7 @@ class MusicPlayer:
         
         # Convert to 0-based index
         removed_song = queue.pop(index - 1)
+        self._queue_changed(guild_id, -(removed_song.duration or 0))
         return removed_song
     
     def get_queue_position(self, guild_id: int, song_title: str) -> Optional[int]:
@@ -385,7 +971,7 @@ class MusicPlayer:
             ydl_opts['extract_flat'] = True
             ydl_opts['playlist_items'] = f'1-{Config.MAX_PLAYLIST_SIZE}'
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with get_yt_dlp().YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(playlist_url, download=False)
                 
                 if 'entries' not in info:
@@ -402,7 +988,8 @@ class MusicPlayer:
                             url=entry.get('url', ''),
                             duration=entry.get('duration', 0),
                             requester=requester,
-                            thumbnail=entry.get('thumbnail')
+                            thumbnail=entry.get('thumbnail'),
+                            video_id=entry.get('id')
                         )
                         
                         if await self.add_to_queue(guild_id, song):
@@ -0,0 +1,323 @@
+import discord
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Optional, Set, Tuple
+from config import Config
+from ffmpeg_supervisor import FFmpegSupervisor
+from local_library import is_remote
+from metadata_db import MetadataDB
+
+logger = logging.getLogger(__name__)
+
+# Opus timestamps (Ogg granule positions) are always in 48 kHz samples
+SAMPLE_RATE = 48000
+# One Discord voice frame: 20 ms
+FRAME_SAMPLES = 960
+
+OGG_CAPTURE = b'OggS'
+OGG_CONTINUED = 0x01
+
+# Baked volume factors are stored in file names in thousandths
+FACTOR_SCALE = 1000
+
+class OggOpusSource(discord.AudioSource):
+    """Plays an Ogg Opus file by handing its packets to the voice client as they are
+
+    The file is memory-mapped, so guilds playing the same cached track share
+    its pages in the OS page cache. Nothing is decoded or encoded: each read
+    is one 20 ms Opus packet sliced out of the map.
+    """
+
+    def __init__(self, path: str, offset: float = 0.0):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._pos = 0                          # byte offset of the next page
+        self._packets: Deque[bytes] = deque()  # packets completed on pages read so far
+        self._partial = b''                    # start of a packet continued on the next page
+        self._granule = 0                      # granule position of the last page read
+        self.pre_skip = 0
+
+        head = self._next_packet()
+        if not head or not head.startswith(b'OpusHead'):
+            self.cleanup()
+            raise ValueError(f"{path} is not an Ogg Opus file")
+        self.pre_skip = int.from_bytes(head[10:12], 'little')
+        self._next_packet()  # OpusTags
+        if offset > 0:
+            self._seek(offset)
+
+    def _read_page(self) -> bool:
+        """Parse the next page's packets into the queue; False at the end of the file"""
+        data = self._map
+        pos = self._pos
+        if pos + 27 > len(data) or data[pos:pos + 4] != OGG_CAPTURE:
+            return False
+        header_type = data[pos + 5]
+        granule = int.from_bytes(data[pos + 6:pos + 14], 'little', signed=True)
+        segments = data[pos + 26]
+        table = data[pos + 27:pos + 27 + segments]
+        start = pos + 27 + segments
+        if not header_type & OGG_CONTINUED:
+            self._partial = b''
+
+        length = 0
+        for lace in table:
+            length += lace
+            if lace < 255:
+                # A lacing value under 255 ends a packet
+                self._packets.append(self._partial + data[start:start + length])
+                self._partial = b''
+                start += length
+                length = 0
+        if length:
+            self._partial += data[start:start + length]
+            start += length
+
+        self._pos = start
+        if granule != -1:
+            self._granule = granule
+        return True
+
+    def _next_packet(self) -> Optional[bytes]:
+        while not self._packets:
+            if not self._read_page():
+                return None
+        return self._packets.popleft()
+
+    def _seek(self, offset: float):
+        """Skip to the packet playing at ``offset`` seconds"""
+        target = self.pre_skip + int(offset * SAMPLE_RATE)
+        while True:
+            before = self._granule
+            self._packets.clear()
+            if not self._read_page():
+                return
+            if self._granule >= target:
+                # The packets completed on this page cover (before, granule]
+                skip = (target - before) // FRAME_SAMPLES
+                for _ in range(min(skip, len(self._packets))):
+                    self._packets.popleft()
+                return
+
+    def read(self) -> bytes:
+        if self._map is None:
+            return b''
+        return self._next_packet() or b''
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+class OpusCache:
+    """Frequently played tracks stored as Ogg Opus at Discord's frame size
+
+    A track is encoded once, in the background, after it has been played
+    OPUS_CACHE_MIN_PLAYS times. Later plays read its packets straight from
+    the file: no yt-dlp lookup and no FFmpeg process. Opus packets can't be
+    scaled without decoding, so the default volume and the track's loudness
+    gain are baked into the file. Guilds at another volume decode the cached
+    file with FFmpeg, with a volume that corrects for the baked factor.
+    """
+
+    def __init__(self, db: MetadataDB, ffmpeg: FFmpegSupervisor, directory: str = Config.OPUS_CACHE_DIR):
+        self.db = db
+        self.ffmpeg = ffmpeg
+        self.directory = directory
+        self.enabled = Config.OPUS_CACHE_ENABLED
+        self._entries: Dict[str, Tuple[str, float, int]] = {}  # video id -> (path, baked factor, bytes)
+        self._last_used: Dict[str, float] = {}
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, Config.OPUS_CACHE_WORKERS), thread_name_prefix='opus-cache')
+        self.hits = 0
+        self.fallbacks = 0
+        self.encoded = 0
+        self.failed = 0
+        self.evicted = 0
+        if self.enabled:
+            self._load()
+
+    def _load(self):
+        """Index the files already in the cache directory"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for name in os.listdir(self.directory):
+                parts = name.split('.')
+                if len(parts) != 3 or parts[2] != 'opus' or not parts[1].isdigit():
+                    continue
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                self._entries[parts[0]] = (path, int(parts[1]) / FACTOR_SCALE, stat.st_size)
+                self._last_used[parts[0]] = stat.st_mtime
+        except OSError as e:
+            logger.error(f"Could not load Opus cache from {self.directory}: {e}")
+            self.enabled = False
+            return
+        logger.info(f"Opus cache has {len(self._entries)} tracks ({self.size_bytes() / (1024 * 1024):.0f} MiB)")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return sum(size for _, _, size in self._entries.values())
+
+    def path_for(self, video_id: Optional[str]) -> Optional[str]:
+        """Path of a track's cached file, if it has one"""
+        if not self.enabled or not video_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(video_id)
+        return entry[0] if entry else None
+
+    def baked_factor(self, path: str) -> Optional[float]:
+        """Volume factor baked into a cached file, or None if the path isn't one"""
+        with self._lock:
+            for entry_path, factor, _ in self._entries.values():
+                if entry_path == path:
+                    return factor
+        return None
+
+    def open(self, path: str, factor: float, offset: float = 0.0) -> Optional[OggOpusSource]:
+        """Open a cached file for direct playback if it was baked at ``factor``"""
+        baked = self.baked_factor(path)
+        if baked is None:
+            return None
+        if abs(baked - factor) > 0.5 / FACTOR_SCALE:
+            self.fallbacks += 1
+            return None
+        try:
+            source = OggOpusSource(path, offset)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not open cached track {path}: {e}")
+            return None
+        self.hits += 1
+        self._touch(path)
+        return source
+
+    def _touch(self, path: str):
+        with self._lock:
+            for video_id, entry in self._entries.items():
+                if entry[0] == path:
+                    self._last_used[video_id] = time.time()
+                    return
+
+    def consider(self, video_id: Optional[str], url: str, factor: float):
+        """Encode a track in the background once it is played often enough"""
+        if not self.enabled or not video_id or not is_remote(url) or factor <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if video_id in self._pending or (entry and abs(entry[1] - factor) <= 0.5 / FACTOR_SCALE):
+                return
+            self._pending.add(video_id)
+        try:
+            ready = self.db.get_play_count(video_id) >= Config.OPUS_CACHE_MIN_PLAYS
+            # Wait for the loudness analysis, or the file would be baked at the wrong gain
+            if ready and Config.LOUDNESS_NORMALIZATION and self.db.get_gain_db(video_id) is None:
+                ready = False
+        except Exception as e:
+            logger.warning(f"Could not check cache eligibility for {video_id}: {e}")
+            ready = False
+        if not ready:
+            with self._lock:
+                self._pending.discard(video_id)
+            return
+        self._executor.submit(self._encode, video_id, url, factor)
+
+    def _encode(self, video_id: str, url: str, factor: float):
+        """Transcode a track to Ogg Opus with 20 ms frames and the volume baked in"""
+        path = os.path.join(self.directory, f"{video_id}.{round(factor * FACTOR_SCALE)}.opus")
+        temp_path = path + '.part'
+        args = [
+            'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+            *Config.FFMPEG_OPTIONS['before_options'].split(),
+            '-i', url, '-vn', '-map', '0:a:0',
+            '-af', f'volume={factor:.3f}', '-ac', '2', '-ar', str(SAMPLE_RATE),
+            '-c:a', 'libopus', '-b:a', f'{Config.OPUS_CACHE_BITRATE}k',
+            '-frame_duration', '20', '-application', 'audio',
+            '-f', 'ogg', temp_path
+        ]
+        try:
+            # Same nice level, rlimits and process limit as playback, so encodes never starve voice threads
+            result = self.ffmpeg.run(args, timeout=Config.OPUS_CACHE_TIMEOUT)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip()[-300:] or f"exit code {result.returncode}")
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                previous = self._entries.get(video_id)
+                self._entries[video_id] = (path, round(factor * FACTOR_SCALE) / FACTOR_SCALE, size)
+                self._last_used[video_id] = time.time()
+            if previous and previous[0] != path:
+                # Baked at an old volume or gain; guilds still playing it keep their mapping
+                self._remove_file(previous[0])
+            self.encoded += 1
+            logger.info(f"Cached {video_id} as Opus ({size / 1024:.0f} KiB)")
+            self._evict()
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Could not cache {video_id} as Opus: {e}")
+            self._remove_file(temp_path)
+        finally:
+            with self._lock:
+                self._pending.discard(video_id)
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+
+    def _evict(self):
+        """Delete the least recently played tracks until the cache fits OPUS_CACHE_MAX_MB"""
+        limit = Config.OPUS_CACHE_MAX_MB * 1024 * 1024
+        if limit <= 0:
+            return
+        with self._lock:
+            total = sum(size for _, _, size in self._entries.values())
+            victims = []
+            for video_id in sorted(self._entries, key=lambda key: self._last_used.get(key, 0.0)):
+                if total <= limit:
+                    break
+                path, _, size = self._entries.pop(video_id)
+                self._last_used.pop(video_id, None)
+                total -= size
+                victims.append(path)
+        for path in victims:
+            # Sources already playing keep their mapping until they finish
+            self._remove_file(path)
+            self.evicted += 1
+
+    def get_stats(self) -> Dict:
+        return {
+            'tracks': len(self._entries),
+            'bytes': self.size_bytes(),
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+            'encoded': self.encoded,
+            'failed': self.failed,
+            'evicted': self.evicted,
+        }
+
+    def shutdown(self):
+        """Stop accepting work and let running encodes finish"""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class PrefetchBatch:
+    """Background resolutions started for one set of displayed search results"""
+
+    def __init__(self, tasks: Dict[str, asyncio.Task]):
+        self._tasks = tasks  # video id -> task
+
+    def cancel(self, keep: Optional[str] = None):
+        """Stop resolving the results, except ``keep`` (the one that was picked)"""
+        for video_id, task in self._tasks.items():
+            if video_id != keep and not task.done():
+                task.cancel()
+
+class StreamPrefetcher:
+    """Resolves stream URLs for search results while the user is still choosing
+
+    ``resolve`` is the blocking resolver (song, channel bitrate) -> stream URL;
+    it runs in the default executor. Results are kept for PREFETCH_TTL seconds
+    and handed to play_next through ``take``.
+    """
+
+    def __init__(self, resolve: Callable, max_entries: int = 256):
+        self._resolve = resolve
+        self.max_entries = max_entries
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # video id -> (url, expires at)
+        self._pending: Dict[str, asyncio.Future] = {}                     # video id -> running resolution
+        self.started = 0
+        self.hits = 0
+        self.cancelled = 0
+
+    def start(self, songs: List, channel_bitrate: Optional[int] = None) -> PrefetchBatch:
+        """Start resolving the first PREFETCH_RESULTS songs, most likely picks first"""
+        tasks = {}
+        if Config.PREFETCH_ENABLED:
+            semaphore = asyncio.Semaphore(max(1, Config.PREFETCH_CONCURRENCY))
+            # Results are in rank order, so the top ones get the first slots
+            for song in songs[:Config.PREFETCH_RESULTS]:
+                if song.video_id and song.video_id not in tasks:
+                    tasks[song.video_id] = asyncio.create_task(self._prefetch(song, channel_bitrate, semaphore))
+        return PrefetchBatch(tasks)
+
+    async def _prefetch(self, song, channel_bitrate: Optional[int], semaphore: asyncio.Semaphore):
+        try:
+            async with semaphore:
+                if self._fresh(song.video_id) or song.video_id in self._pending:
+                    return
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(None, self._resolve, song, channel_bitrate)
+                self._pending[song.video_id] = future
+                future.add_done_callback(lambda f: self._store(song.video_id, f))
+                self.started += 1
+                # Shielded: a pick may already be waiting on this resolution through take()
+                await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception as e:
+            logger.debug(f"Prefetch failed for {song.title}: {e}")
+
+    def _store(self, video_id: str, future: asyncio.Future):
+        self._pending.pop(video_id, None)
+        if future.cancelled() or future.exception() is not None or not future.result():
+            return
+        self._urls[video_id] = (future.result(), time.monotonic() + Config.PREFETCH_TTL)
+        self._urls.move_to_end(video_id)
+        while len(self._urls) > self.max_entries:
+            self._urls.popitem(last=False)
+
+    def _fresh(self, video_id: str) -> bool:
+        entry = self._urls.get(video_id)
+        if entry and entry[1] < time.monotonic():
+            del self._urls[video_id]
+            return False
+        return entry is not None
+
+    async def take(self, video_id: Optional[str]) -> Optional[str]:
+        """Get a prefetched stream URL, waiting for one that is still resolving"""
+        if not video_id:
+            return None
+        pending = self._pending.get(video_id)
+        if pending is not None:
+            try:
+                await asyncio.shield(pending)
+            except Exception:
+                return None
+        if not self._fresh(video_id):
+            return None
+        self.hits += 1
+        return self._urls.pop(video_id)[0]
@@ -0,0 +1,137 @@
+import discord
+import logging
+from typing import Dict, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def format_total_duration(seconds: int) -> str:
+    """Format a total number of seconds as h:mm:ss or m:ss"""
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+class QueuePaginator:
+    """Renders queue pages and caches them per guild until the queue changes"""
+
+    def __init__(self, music_player, page_size: int = Config.QUEUE_PAGE_SIZE):
+        self.music_player = music_player
+        self.page_size = max(1, page_size)
+        # guild_id -> ((queue version, volume), {page index -> embed})
+        self._cache: Dict[int, Tuple[Tuple[int, float], Dict[int, discord.Embed]]] = {}
+
+    def page_count(self, guild_id: int) -> int:
+        """Get the number of pages needed to show the guild's queue"""
+        queue_length = len(self.music_player.get_queue(guild_id))
+        return max(1, (queue_length + self.page_size - 1) // self.page_size)
+
+    def invalidate(self, guild_id: int):
+        """Drop all cached pages for a guild"""
+        self._cache.pop(guild_id, None)
+
+    def get_page(self, guild_id: int, page: int) -> discord.Embed:
+        """Get the embed for a page (0-based), rendering it only if needed"""
+        page = max(0, min(page, self.page_count(guild_id) - 1))
+        key = (self.music_player.get_queue_version(guild_id), self.music_player.get_volume(guild_id))
+
+        cached = self._cache.get(guild_id)
+        if not cached or cached[0] != key:
+            cached = (key, {})
+            self._cache[guild_id] = cached
+
+        pages = cached[1]
+        if page not in pages:
+            pages[page] = self._render_page(guild_id, page)
+        return pages[page]
+
+    def _render_page(self, guild_id: int, page: int) -> discord.Embed:
+        """Build the embed for a single page from a slice of the queue"""
+        current = self.music_player.now_playing.get(guild_id)
+        queue_length = len(self.music_player.get_queue(guild_id))
+        total_pages = self.page_count(guild_id)
+
+        embed = discord.Embed(title="🎵 Music Queue", color=0x00ff00)
+
+        # Current song
+        if current:
+            embed.add_field(
+                name="🎶 Now Playing",
+                value=f"**{current.title}** ({current.formatted_duration})\nRequested by: {current.requester_name}",
+                inline=False
+            )
+
+        # Only the songs on this page are touched
+        start = page * self.page_size
+        songs = self.music_player.get_queue_slice(guild_id, start, start + self.page_size)
+        if songs:
+            queue_text = ""
+            for i, song in enumerate(songs, start + 1):
+                queue_text += f"**{i}.** {song.title} ({song.formatted_duration}) - {song.requester_name}\n"
+            embed.add_field(name="📋 Up Next", value=queue_text[:1024], inline=False)
+
+        # Volume
+        embed.add_field(name="🔊 Volume", value=f"{int(self.music_player.get_volume(guild_id) * 100)}%", inline=True)
+        embed.add_field(name="📊 Queue Length", value=str(queue_length), inline=True)
+        embed.add_field(
+            name="⏱️ Remaining",
+            value=format_total_duration(self.music_player.get_queue_duration(guild_id)),
+            inline=True
+        )
+
+        embed.set_footer(text=f"Page {page + 1}/{total_pages}")
+        return embed
+
+class QueueView(discord.ui.View):
+    """Button navigation for a paginated queue message"""
+
+    def __init__(self, paginator: QueuePaginator, guild_id: int, page: int = 0):
+        super().__init__(timeout=Config.QUEUE_VIEW_TIMEOUT)
+        self.paginator = paginator
+        self.guild_id = guild_id
+        self.page = page
+        self.message = None
+        self._update_buttons()
+
+    def _update_buttons(self):
+        """Enable or disable navigation buttons for the current page"""
+        last_page = self.paginator.page_count(self.guild_id) - 1
+        self.page = max(0, min(self.page, last_page))
+        self.first_page.disabled = self.page == 0
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= last_page
+        self.last_page.disabled = self.page >= last_page
+
+    async def _show_page(self, interaction: discord.Interaction, page: int):
+        """Switch the message to another page"""
+        self.page = page
+        self._update_buttons()
+        await interaction.response.edit_message(
+            embed=self.paginator.get_page(self.guild_id, self.page),
+            view=self
+        )
+
+    @discord.ui.button(emoji="⏮️", style=discord.ButtonStyle.secondary)
+    async def first_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show_page(interaction, 0)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show_page(interaction, self.page - 1)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show_page(interaction, self.page + 1)
+
+    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.secondary)
+    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show_page(interaction, self.paginator.page_count(self.guild_id) - 1)
+
+    async def on_timeout(self):
+        """Remove the buttons once the view expires"""
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except Exception as e:
+                logger.warning(f"Could not remove queue buttons: {e}")
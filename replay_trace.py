@@ -0,0 +1,483 @@
+"""Replay recorded command traces against the music player
+
+Drives the bot's real command handlers and player with the timing of a trace
+recorded through COMMAND_TRACE_FILE, sped up 1x to 50x. Discord (gateway,
+messages, voice) and yt-dlp are replaced by in-process stand-ins, so no
+network access or token is needed. Extraction latency is simulated and
+playback lasts each song's duration divided by the speed.
+
+    python replay_trace.py commands.trace --speed 10
+"""
+import argparse
+import os
+import sys
+
+# The bot reads its settings at import time: replay against a throwaway setup
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///:memory:',
+    'LOG_FILE': os.devnull,
+    'LOG_LEVEL': os.environ.get('REPLAY_LOG_LEVEL', 'CRITICAL'),
+    'COMMAND_TRACE_FILE': '',
+    'STATE_BACKEND': 'memory',
+    'LOCAL_LIBRARY_PATH': '',
+    'LOUDNESS_NORMALIZATION': 'false',  # would run FFmpeg on the fake stream URLs
+    'BROKER_ENABLED': 'false',          # nothing to share: there is no decode
+    'SLASH_COMMANDS_ENABLED': 'false',
+    'MEMORY_SAMPLE_INTERVAL': '0',
+})
+
+import asyncio
+import hashlib
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+import discord
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+import main as bot_main
+import music_player as music_player_module
+from command_trace import TraceRecord, read_trace
+from memory_diagnostics import rss_mb
+
+_ids = itertools.count(1_000_000)
+
+def fake_video_id(seed: str) -> str:
+    """Deterministic 11-character video id for a query"""
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+    digest = hashlib.sha1(seed.encode()).digest()
+    return ''.join(alphabet[byte % 64] for byte in digest[:11])
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL, blocking for a simulated network round trip"""
+
+    extract_latency = 0.5
+    search_latency = 0.8
+    playlist_size = 25
+
+    def __init__(self, options: Dict):
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @staticmethod
+    def _video(seed: str, title: Optional[str] = None) -> Dict:
+        video_id = music_player_module.extract_video_id(seed) or fake_video_id(seed)
+        duration = 120 + int(hashlib.sha1(video_id.encode()).hexdigest(), 16) % 300
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        return {
+            'id': video_id,
+            'title': title or f"Track {video_id}",
+            'webpage_url': url,
+            'url': url,
+            'duration': duration,
+            'thumbnail': None,
+            'formats': [
+                {'format_id': '251', 'ext': 'webm', 'acodec': 'opus', 'vcodec': 'none', 'abr': 130.0,
+                 'url': f"https://replay.invalid/{video_id}/251"},
+                {'format_id': '140', 'ext': 'm4a', 'acodec': 'mp4a.40.2', 'vcodec': 'none', 'abr': 129.0,
+                 'url': f"https://replay.invalid/{video_id}/140"},
+            ],
+        }
+
+    def extract_info(self, query: str, download: bool = False, **kwargs) -> Dict:
+        if query.startswith('ytsearch'):
+            count, text = query[len('ytsearch'):].split(':', 1)
+            time.sleep(self.search_latency)
+            # The first result is titled like the query, so repeating a search hits the play history
+            return {'entries': [self._video(f"{text}#{i}", text if i == 0 else f"{text} ({i})")
+                                for i in range(int(count or 1))]}
+        time.sleep(self.extract_latency)
+        if 'list=' in query:
+            return {'entries': [self._video(f"{query}#{i}") for i in range(self.playlist_size)]}
+        return self._video(query)
+
+class FakeYtDlp:
+    YoutubeDL = FakeYoutubeDL
+
+class SilentSource(discord.AudioSource):
+    """Replaces the FFmpeg decode; the fake voice client never reads it"""
+
+    def read(self) -> bytes:
+        return b''
+
+    def is_opus(self) -> bool:
+        return False
+
+class FakeVoiceClient:
+    """Voice connection that 'plays' a song by waiting out its duration"""
+
+    def __init__(self, channel: 'FakeVoiceChannel', replay: 'Replay'):
+        self.channel = channel
+        self.guild = channel.guild
+        self.replay = replay
+        self.source = None
+        self.latency = 0.0
+        self.intentional_disconnect = False
+        self._connected = True
+        self._paused = False
+        self._after = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._paused
+
+    def is_paused(self) -> bool:
+        return self._paused
+
+    def play(self, source, *, after=None, **kwargs):
+        self.source = source
+        self._after = after
+        song = self.replay.player.now_playing.get(self.guild.id)
+        seconds = ((song.duration if song else 0) or 180) / self.replay.speed
+        self._task = asyncio.get_running_loop().create_task(self._play(seconds))
+        self.replay.songs_played += 1
+
+    async def _play(self, seconds: float):
+        remaining = seconds
+        while remaining > 0:
+            step = min(remaining, 0.25)
+            await asyncio.sleep(step)
+            if not self._paused:
+                remaining -= step
+        self._finish()
+
+    def _finish(self):
+        after, self._after = self._after, None
+        self.source = None
+        if after:
+            after(None)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._paused = False
+        self._finish()
+
+    async def disconnect(self, *, force: bool = False):
+        self.intentional_disconnect = True
+        self._connected = False
+        self.stop()
+
+class FakeVoiceChannel:
+    def __init__(self, guild: 'FakeGuild', replay: 'Replay'):
+        self.id = next(_ids)
+        self.name = 'replay-voice'
+        self.guild = guild
+        self.bitrate = 64000
+        self.members: List['FakeMember'] = []
+        self.replay = replay
+
+    async def connect(self, **kwargs) -> FakeVoiceClient:
+        return FakeVoiceClient(self, self.replay)
+
+class FakeTextChannel:
+    def __init__(self, guild: 'FakeGuild'):
+        self.id = next(_ids)
+        self.name = 'replay-text'
+        self.guild = guild
+
+    async def send(self, content: str = None, **kwargs) -> 'FakeMessage':
+        return self.guild.replay.sent(FakeMessage(self, content))
+
+class FakeGuild:
+    def __init__(self, key: str, replay: 'Replay'):
+        self.id = int(key, 16) if key != '-' else next(_ids)
+        self.name = f"guild-{key}"
+        self.replay = replay
+        self.members: Dict[int, 'FakeMember'] = {}
+        self.voice_channel = FakeVoiceChannel(self, replay)
+        self.text_channel = FakeTextChannel(self)
+
+    @property
+    def voice_client(self) -> Optional[FakeVoiceClient]:
+        voice_client = self.replay.player.voice_clients.get(self.id)
+        return voice_client if voice_client and voice_client.is_connected() else None
+
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    def get_member(self, user_id: int) -> Optional['FakeMember']:
+        return self.members.get(user_id)
+
+class FakeVoiceState:
+    def __init__(self, channel: FakeVoiceChannel):
+        self.channel = channel
+
+class FakeMember:
+    def __init__(self, key: str, guild: FakeGuild):
+        self.id = int(key, 16)
+        self.name = self.display_name = f"user-{key}"
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+        self.guild = guild
+        self.voice = FakeVoiceState(guild.voice_channel)
+        guild.voice_channel.members.append(self)
+
+class FakeMessage:
+    def __init__(self, channel: FakeTextChannel, content: Optional[str], author: FakeMember = None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content or ''
+        self.attachments = []
+        self.mentions = []
+        self._state = None  # read by commands.Context, unused without a gateway
+
+    async def edit(self, **kwargs):
+        return self
+
+    async def delete(self, **kwargs):
+        pass
+
+    async def add_reaction(self, emoji):
+        pass
+
+class FakeReaction:
+    def __init__(self, emoji: str, message: FakeMessage):
+        self.emoji = emoji
+        self.message = message
+
+class ReplayContext(commands.Context):
+    """Command context whose replies go nowhere"""
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        return self.channel.guild.replay.sent(FakeMessage(self.channel, content))
+
+    async def reply(self, content: str = None, **kwargs) -> FakeMessage:
+        return await self.send(content, **kwargs)
+
+def synthetic_args(args: str) -> str:
+    """Turn a recorded argument field back into something the command can parse"""
+    if args == '-':
+        return ''
+    if not args.startswith('#'):
+        return args
+    digest, shape = args[1:].split('/', 1)
+    kind, count = shape[0], int(shape[1:] or 1)
+    if kind == 'l':
+        return f"https://www.youtube.com/playlist?list=PL{digest}"
+    if kind == 'u':
+        queries = [f"https://www.youtube.com/watch?v={fake_video_id(f'{digest}{i}')}" for i in range(count)]
+    else:
+        queries = [f"replay {digest} {i}" if count > 1 else f"replay {digest}" for i in range(count)]
+    return '\n'.join(queries)
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))]
+
+class Replay:
+    """Schedules the trace's commands and measures how the player copes"""
+
+    def __init__(self, records: List[TraceRecord], speed: float):
+        self.records = records
+        self.speed = speed
+        self.bot = bot_main.bot
+        self.player = bot_main.music_player
+        self.guilds: Dict[str, FakeGuild] = {}
+        self.members: Dict[str, FakeMember] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.recorded: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.skipped: Dict[str, int] = {}
+        self.loop_lag: List[float] = []
+        self.rss: List[float] = []
+        self.peak_threads = 0
+        self.peak_in_flight = 0
+        self.in_flight = 0
+        self.songs_played = 0
+        self.pick_delay = 3.0
+        self._recent_messages: List[FakeMessage] = []
+        self._finished = False
+
+    def sent(self, message: FakeMessage) -> FakeMessage:
+        """Remember a bot message so simulated users can react to it"""
+        self._recent_messages.append(message)
+        del self._recent_messages[:-50]
+        return message
+
+    async def _wait_for(self, event: str, *, check=None, timeout: float = None):
+        """The requester picks the first search result after thinking for pick_delay seconds"""
+        if event == 'reaction_add':
+            for message in reversed(self._recent_messages):
+                for member in message.guild.members.values():
+                    reaction = FakeReaction('1️⃣', message)
+                    if check is None or check(reaction, member):
+                        await asyncio.sleep(self.pick_delay / self.speed)
+                        return reaction, member
+        raise asyncio.TimeoutError()
+
+    def _patch(self):
+        music_player_module.get_yt_dlp = lambda: FakeYtDlp
+        bot_main.get_yt_dlp = lambda: FakeYtDlp
+        self.player.ffmpeg.create_source = lambda guild_id, url, **options: SilentSource()
+
+        async def is_owner(user) -> bool:
+            return True
+        # Owner-only commands in the trace were run by the owner
+        self.bot.is_owner = is_owner
+        self.bot.wait_for = self._wait_for
+
+    def _member(self, guild_key: str, user_key: str) -> FakeMember:
+        guild = self.guilds.get(guild_key)
+        if guild is None:
+            guild = self.guilds[guild_key] = FakeGuild(guild_key, self)
+        member = self.members.get(f"{guild_key}:{user_key}")
+        if member is None:
+            member = self.members[f"{guild_key}:{user_key}"] = FakeMember(user_key, guild)
+            guild.members[member.id] = member
+        return member
+
+    async def _invoke(self, record: TraceRecord):
+        command = self.bot.get_command(record.command)
+        if command is None:
+            self.skipped[record.command] = self.skipped.get(record.command, 0) + 1
+            return
+        member = self._member(record.guild, record.user)
+        args = synthetic_args(record.args)
+        message = FakeMessage(member.guild.text_channel, f"{bot_main.Config.BOT_PREFIX}{command.name} {args}", member)
+        ctx = ReplayContext(message=message, bot=self.bot, view=StringView(args),
+                            prefix=bot_main.Config.BOT_PREFIX, command=command, invoked_with=command.name)
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            await command.invoke(ctx)
+        except Exception:
+            self.errors[record.command] = self.errors.get(record.command, 0) + 1
+        finally:
+            self.in_flight -= 1
+        self.latencies.setdefault(record.command, []).append(time.perf_counter() - started)
+        self.recorded.setdefault(record.command, []).append(record.duration)
+
+    async def _monitor(self):
+        """Sample event loop lag every 100 ms and RSS every second"""
+        loop = asyncio.get_running_loop()
+        ticks = 0
+        while not self._finished:
+            expected = loop.time() + 0.1
+            await asyncio.sleep(0.1)
+            self.loop_lag.append(max(0.0, loop.time() - expected))
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            ticks += 1
+            if ticks % 10 == 0:
+                rss = rss_mb()
+                if rss is not None:
+                    self.rss.append(rss)
+
+    async def run(self) -> Dict:
+        self._patch()
+        async with self.bot:
+            monitor = asyncio.create_task(self._monitor())
+            rss_before = rss_mb()
+            cpu_before = time.process_time()
+            started = time.perf_counter()
+
+            tasks = []
+            for record in self.records:
+                delay = started + record.offset / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self._invoke(record)))
+            await asyncio.gather(*tasks)
+
+            wall = time.perf_counter() - started
+            cpu = time.process_time() - cpu_before
+            self._finished = True
+            await monitor
+            for guild in self.guilds.values():
+                voice_client = guild.voice_client
+                if voice_client:
+                    await voice_client.disconnect()
+            return {'wall': wall, 'cpu': cpu, 'rss_before': rss_before, 'rss_after': rss_mb()}
+
+    def report(self, totals: Dict):
+        span = self.records[-1].offset if self.records else 0.0
+        print(f"Replayed {len(self.records)} commands from {len(self.guilds)} guilds "
+              f"({span:.0f}s of traffic at {self.speed:g}x) in {totals['wall']:.1f}s")
+        print()
+        print(f"{'command':<16}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'rec p50':>9}")
+        for name in sorted(self.latencies, key=lambda name: -len(self.latencies[name])):
+            values = [value * 1000 for value in self.latencies[name]]
+            recorded = [value * 1000 for value in self.recorded[name]]
+            print(f"{name:<16}{len(values):>7}{self.errors.get(name, 0):>8}{percentile(values, 50):>9.1f}"
+                  f"{percentile(values, 95):>9.1f}{percentile(values, 99):>9.1f}{max(values):>9.1f}"
+                  f"{percentile(recorded, 50):>9.1f}")
+        if self.skipped:
+            print(f"Skipped unknown commands: {', '.join(f'{name} ({count})' for name, count in self.skipped.items())}")
+        print()
+        lag = [value * 1000 for value in self.loop_lag]
+        print(f"CPU: {totals['cpu']:.1f}s ({100 * totals['cpu'] / totals['wall']:.0f}% of one core)")
+        if totals['rss_before'] is not None and self.rss:
+            print(f"RSS: {totals['rss_before']:.1f} MiB before, {max(self.rss):.1f} MiB peak, "
+                  f"{totals['rss_after']:.1f} MiB after")
+        print(f"Event loop lag: p50 {percentile(lag, 50):.1f} ms, p99 {percentile(lag, 99):.1f} ms, "
+              f"max {max(lag, default=0.0):.1f} ms")
+        print(f"Peak threads: {self.peak_threads} | Peak concurrent commands: {self.peak_in_flight} | "
+              f"Songs started: {self.songs_played}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded command trace against the music player")
+    parser.add_argument('trace', help="trace file written through COMMAND_TRACE_FILE")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed, 1 to 50 (default: 1)")
+    parser.add_argument('--session', type=int, help="replay only this recording session (1 = first)")
+    parser.add_argument('--limit', type=int, help="replay at most this many commands")
+    parser.add_argument('--pick-delay', type=float, default=3.0,
+                        help="seconds a user takes to pick a search result (default: %(default)s)")
+    parser.add_argument('--extract-latency', type=float, default=FakeYoutubeDL.extract_latency,
+                        help="simulated seconds per yt-dlp lookup (default: %(default)s)")
+    parser.add_argument('--search-latency', type=float, default=FakeYoutubeDL.search_latency,
+                        help="simulated seconds per yt-dlp search (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not 1 <= args.speed <= 50:
+        parser.error("--speed must be between 1 and 50")
+    FakeYoutubeDL.extract_latency = args.extract_latency
+    FakeYoutubeDL.search_latency = args.search_latency
+
+    sessions = list(read_trace(args.trace))
+    if args.session:
+        sessions = sessions[args.session - 1:args.session]
+    # Sessions are played back to back
+    records = []
+    offset = 0.0
+    for session in sessions:
+        # Lines are written as commands finish, so they aren't quite in start order
+        for record in sorted(session, key=lambda record: record.offset):
+            record.offset += offset
+            records.append(record)
+        if session:
+            offset = records[-1].offset + 1.0
+    records = records[:args.limit] if args.limit else records
+    if not records:
+        print("No commands in trace")
+        sys.exit(1)
+
+    replay = Replay(records, args.speed)
+    replay.pick_delay = args.pick_delay
+    totals = asyncio.run(replay.run())
+    replay.report(totals)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""A small in-process stand-in for a Redis server, for testing the shared state store
+
+Speaks enough of RESP for RedisStateBackend: GET, SET (NX, PX), MSET, DEL,
+PEXPIRE, PING, AUTH, SELECT and EVAL of the backend's two lease scripts
+(compare-and-set renew and release, run natively instead of in Lua). Every
+command is logged and commands can be made to fail, so tests can check what
+the backend sends and how it recovers. It can also be run on its own, to try
+several bot processes sharing state without installing Redis:
+
+    python resp_standin.py --port 6380
+    STATE_BACKEND=redis://localhost:6380 python main.py
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import state_backend
+
+def _simple(text: str) -> bytes:
+    return b'+%s\r\n' % text.encode()
+
+def _error(text: str) -> bytes:
+    return b'-%s\r\n' % text.encode()
+
+def _integer(value: int) -> bytes:
+    return b':%d\r\n' % value
+
+def _bulk(value: Optional[str]) -> bytes:
+    if value is None:
+        return b'$-1\r\n'
+    data = value.encode()
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+class RespStandIn:
+    """In-memory key-value server answering RESP commands over TCP"""
+
+    def __init__(self, password: Optional[str] = None):
+        self.password = password
+        self.values: Dict[str, Tuple[str, Optional[float]]] = {}  # key -> (value, expires at)
+        self.commands: List[List[str]] = []  # every command received, in order
+        self.fail: Dict[str, str] = {}       # command name -> error returned instead of running it
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """Start listening; returns the port (a free one if 0)"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        auth = f":{self.password}@" if self.password else ''
+        return f"redis://{auth}{host}:{port}/0"
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def names(self) -> List[str]:
+        """Names of the commands received, in order"""
+        return [command[0] for command in self.commands]
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.values.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0] if entry else None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        authenticated = self.password is None
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands.append(command)
+                name = command[0].upper()
+                if name == 'AUTH':
+                    authenticated = command[-1] == self.password
+                    reply = _simple('OK') if authenticated else _error('WRONGPASS invalid password')
+                elif not authenticated:
+                    reply = _error('NOAUTH Authentication required.')
+                elif name in self.fail:
+                    reply = _error(self.fail[name])
+                else:
+                    reply = self._execute(name, command[1:])
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> Optional[List[str]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, as typed into telnet
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    def _execute(self, name: str, args: List[str]) -> bytes:
+        if name == 'PING':
+            return _simple('PONG')
+        if name == 'SELECT':
+            return _simple('OK')
+        if name == 'GET':
+            return _bulk(self.get(args[0]))
+        if name == 'SET':
+            key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+            if 'NX' in options and self.get(key) is not None:
+                return _bulk(None)
+            expires = None
+            if 'PX' in options:
+                expires = time.monotonic() + int(args[2 + options.index('PX') + 1]) / 1000
+            self.values[key] = (value, expires)
+            return _simple('OK')
+        if name == 'MSET':
+            if not args or len(args) % 2:
+                return _error("ERR wrong number of arguments for 'mset' command")
+            for key, value in zip(args[::2], args[1::2]):
+                self.values[key] = (value, None)
+            return _simple('OK')
+        if name == 'DEL':
+            return _integer(sum(self.values.pop(key, None) is not None for key in args))
+        if name == 'PEXPIRE':
+            value = self.get(args[0])
+            if value is None:
+                return _integer(0)
+            self.values[args[0]] = (value, time.monotonic() + int(args[1]) / 1000)
+            return _integer(1)
+        if name == 'EVAL':
+            script, key, owner = args[0], args[2], args[3]
+            if script not in (state_backend._RENEW_SCRIPT, state_backend._RELEASE_SCRIPT):
+                return _error('ERR the stand-in only runs the lease scripts')
+            if self.get(key) != owner:
+                return _integer(0)
+            if script == state_backend._RENEW_SCRIPT:
+                return self._execute('PEXPIRE', [key, args[4]])
+            return self._execute('DEL', [key])
+        return _error(f"ERR unknown command '{name}'")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6380)
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    server = RespStandIn(args.password)
+    await server.start(args.host, args.port)
+    print(f"Listening on {server.url}")
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
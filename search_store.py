@@ -0,0 +1,81 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+from config import Config
+from metadata_cache import TrackMetadataCache
+
+logger = logging.getLogger(__name__)
+
+class SearchResultStore:
+    """Per-user search results with a size limit, expiry and LRU eviction
+    
+    Only track keys are stored per user; titles, URLs and durations live in
+    the shared metadata cache so repeated results are kept once.
+    """
+    
+    def __init__(self, metadata_cache: TrackMetadataCache,
+                 max_entries: int = Config.SEARCH_RESULTS_MAX_USERS,
+                 ttl: float = Config.SEARCH_RESULTS_TTL):
+        self.metadata_cache = metadata_cache
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        # user_id -> (expires_at, track keys)
+        self._entries: "OrderedDict[int, Tuple[float, Tuple[str, ...]]]" = OrderedDict()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def put(self, user_id: int, songs: List) -> None:
+        """Store a user's search results, replacing any previous ones"""
+        keys = []
+        for song in songs:
+            key = song.cache_key
+            self.metadata_cache.put(key, song.title, song.url, song.duration, song.thumbnail)
+            keys.append(key)
+        
+        self._entries[user_id] = (time.monotonic() + self.ttl, tuple(keys))
+        self._entries.move_to_end(user_id)
+        self._evict()
+    
+    def get(self, user_id: int) -> List:
+        """Get a user's stored results as fresh Song objects (empty if expired)"""
+        from music_player import Song
+        
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return []
+        
+        expires_at, keys = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return []
+        
+        songs = []
+        for key in keys:
+            metadata = self.metadata_cache.get(key)
+            if metadata is None:
+                # Metadata was evicted, so the result set can no longer be rebuilt
+                logger.info(f"Search results for user {user_id} dropped after metadata eviction")
+                del self._entries[user_id]
+                return []
+            title, url, duration, thumbnail = metadata
+            songs.append(Song(title=title, url=url, duration=duration, requester=None,
+                              thumbnail=thumbnail, video_id=key if key != url else None))
+        
+        self._entries.move_to_end(user_id)
+        return songs
+    
+    def remove(self, user_id: int) -> bool:
+        """Remove a user's stored results; returns whether any were stored"""
+        entry = self._entries.pop(user_id, None)
+        return entry is not None and entry[0] > time.monotonic()
+    
+    def _evict(self):
+        """Drop expired entries from the old end, then enforce the size limit"""
+        now = time.monotonic()
+        while self._entries:
+            user_id, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[user_id]
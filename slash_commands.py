@@ -0,0 +1,192 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import logging
+from typing import List
+from config import Config
+from music_player import MusicPlayer, Song
+from queue_view import QueuePaginator, QueueView
+from state_backend import GuildOwnedElsewhere
+
+logger = logging.getLogger(__name__)
+
+class SearchResultsView(discord.ui.View):
+    """Buttons for picking one of the results of /search"""
+
+    def __init__(self, music_player: MusicPlayer, requester: discord.Member, songs: List[Song]):
+        super().__init__(timeout=60)
+        self.music_player = music_player
+        self.requester = requester
+        self.songs = songs
+        self.message = None
+        # Resolve the top results while the user decides, so the pick starts playing right away
+        self.prefetch = music_player.prefetcher.start(songs, requester.voice.channel.bitrate if requester.voice else None)
+        for index in range(len(songs)):
+            button = discord.ui.Button(label=str(index + 1), style=discord.ButtonStyle.primary)
+            button.callback = self._make_callback(index)
+            self.add_item(button)
+
+    def _make_callback(self, index: int):
+        async def callback(interaction: discord.Interaction):
+            if interaction.user.id != self.requester.id:
+                await interaction.response.send_message("❌ Only the person who searched can pick a result!", ephemeral=True)
+                return
+            self.stop()
+            song = self.songs[index]
+            self.prefetch.cancel(keep=song.video_id)
+            song.requester = interaction.user
+            await interaction.response.edit_message(content=f"⏳ Adding **{song.title}**...", embed=None, view=None)
+            await queue_song(self.music_player, interaction, song)
+        return callback
+
+    async def on_timeout(self):
+        """Remove the buttons once the view expires"""
+        self.prefetch.cancel()
+        if self.message:
+            try:
+                await self.message.edit(content="⏰ Search timed out.", view=None)
+            except Exception as e:
+                logger.warning(f"Could not remove search buttons: {e}")
+
+async def ensure_connected(music_player: MusicPlayer, interaction: discord.Interaction) -> bool:
+    """Join the user's voice channel if the bot isn't in one yet"""
+    if interaction.guild.voice_client:
+        return True
+    try:
+        await music_player.connect(interaction.user.voice.channel)
+        return True
+    except GuildOwnedElsewhere:
+        await interaction.edit_original_response(content="❌ Another instance of the bot is already playing in this server!")
+        return False
+    except Exception as e:
+        logger.error(f"Error joining voice channel: {e}")
+        await interaction.edit_original_response(content="❌ Failed to join the voice channel!")
+        return False
+
+async def queue_song(music_player: MusicPlayer, interaction: discord.Interaction, song: Song):
+    """Queue a song, report the result on the interaction and start playback if idle"""
+    if song.duration > Config.MAX_SONG_LENGTH:
+        await interaction.edit_original_response(
+            content=f"❌ **{song.title}** is too long! Maximum allowed: {Config.MAX_SONG_LENGTH // 60} minutes")
+        return
+
+    if not await ensure_connected(music_player, interaction):
+        return
+
+    if not await music_player.add_to_queue(interaction.guild.id, song):
+        await interaction.edit_original_response(content="❌ Queue is full!")
+        return
+
+    await interaction.edit_original_response(
+        content=f"✅ Added to queue: **{song.title}** ({song.formatted_duration})")
+
+    # Start playing if nothing is currently playing
+    if not music_player.now_playing.get(interaction.guild.id):
+        await music_player.play_next(interaction.guild.id)
+
+def setup_slash_commands(bot: commands.Bot, music_player: MusicPlayer, queue_paginator: QueuePaginator):
+    """Register the application (slash) command versions of the main music commands
+
+    Slash commands don't need the message content intent. Commands that have to
+    look something up defer first, so Discord shows the bot as thinking right
+    away, and then edit that response as the lookup progresses.
+    """
+
+    @bot.tree.command(name='play', description="Play a song from a YouTube URL or search")
+    @app_commands.describe(query="Song name or YouTube URL")
+    @app_commands.guild_only()
+    async def play(interaction: discord.Interaction, query: str):
+        if not interaction.user.voice:
+            await interaction.response.send_message("❌ You need to be in a voice channel first!", ephemeral=True)
+            return
+
+        await interaction.response.defer(thinking=True)
+        try:
+            song = music_player.find_known(query, interaction.guild.id)
+            if not song:
+                await interaction.edit_original_response(content=f"🔍 Searching for: **{query}**")
+                song = await music_player.search_youtube(query)
+
+            if not song:
+                await interaction.edit_original_response(content="❌ No songs found for that query!")
+                return
+
+            song.requester = interaction.user
+            await queue_song(music_player, interaction, song)
+
+        except Exception as e:
+            logger.error(f"Error in /play: {e}")
+            await interaction.edit_original_response(content="❌ An error occurred while searching for the song!")
+
+    @bot.tree.command(name='search', description="Search YouTube and pick from the results")
+    @app_commands.describe(query="What to search for")
+    @app_commands.guild_only()
+    async def search(interaction: discord.Interaction, query: str):
+        if not interaction.user.voice:
+            await interaction.response.send_message("❌ You need to be in a voice channel first!", ephemeral=True)
+            return
+
+        await interaction.response.defer(thinking=True)
+        try:
+            songs = await music_player.search_youtube_multiple(query, max_results=5)
+            if not songs:
+                await interaction.edit_original_response(content="❌ No songs found for that query!")
+                return
+
+            # Also available to !playresult
+            music_player.search_results.put(interaction.user.id, songs)
+
+            embed = discord.Embed(title=f"🔍 Search Results for: {query}", color=0x00ff00)
+            for i, song in enumerate(songs, 1):
+                duration_str = song.formatted_duration if song.duration > 0 else "Unknown duration"
+                embed.add_field(
+                    name=f"{i}. {song.title}",
+                    value=f"⏱️ {duration_str} | 📺 [View on YouTube]({song.url})",
+                    inline=False
+                )
+            embed.set_footer(text="Pick a number to play, or wait 60 seconds")
+
+            view = SearchResultsView(music_player, interaction.user, songs)
+            view.message = await interaction.edit_original_response(content=None, embed=embed, view=view)
+
+        except Exception as e:
+            logger.error(f"Error in /search: {e}")
+            await interaction.edit_original_response(content="❌ An error occurred while searching!")
+
+    @bot.tree.command(name='queue', description="Show the music queue")
+    @app_commands.describe(page="Page to show")
+    @app_commands.guild_only()
+    async def queue(interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+        queue_info = music_player.get_queue_info(interaction.guild.id)
+        if not queue_info['current_song'] and not queue_info['queue']:
+            await interaction.response.send_message("📭 The queue is empty!")
+            return
+
+        view = QueueView(queue_paginator, interaction.guild.id, page - 1)
+        embed = queue_paginator.get_page(interaction.guild.id, view.page)
+
+        # Only show navigation buttons when there is more than one page
+        if queue_paginator.page_count(interaction.guild.id) > 1:
+            await interaction.response.send_message(embed=embed, view=view)
+            view.message = await interaction.original_response()
+        else:
+            view.stop()
+            await interaction.response.send_message(embed=embed)
+
+    @bot.tree.command(name='skip', description="Skip the current song")
+    @app_commands.guild_only()
+    async def skip(interaction: discord.Interaction):
+        if not interaction.guild.voice_client:
+            await interaction.response.send_message("❌ I'm not playing anything!", ephemeral=True)
+            return
+
+        await music_player.skip(interaction.guild.id)
+        await interaction.response.send_message("⏭️ Skipped the current song!")
+
+async def sync_slash_commands(bot: commands.Bot):
+    """Publish the slash commands to Discord (rate limited, so only when configured)"""
+    try:
+        synced = await bot.tree.sync()
+        logger.info(f"Synced {len(synced)} slash commands")
+    except Exception as e:
+        logger.error(f"Could not sync slash commands: {e}")
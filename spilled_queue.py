@@ -0,0 +1,363 @@
+import base64
+import itertools
+import json
+import logging
+import random
+import sys
+from array import array
+from collections.abc import MutableSequence
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from config import Config
+from metadata_db import MetadataDB
+
+logger = logging.getLogger(__name__)
+
+# Bytes per spilled entry key: a tag byte and the key, zero-padded
+KEY_SLOT = 24
+# Tags: video id, URL (songs without a video id), and keys too long for a slot
+TAG_VIDEO = ord('v')
+TAG_URL = ord('u')
+TAG_LONG = ord('L')
+
+# Fallback URL for a video id whose metadata row went missing
+WATCH_URL = 'https://www.youtube.com/watch?v='
+
+# Spilled entries are read back from the database this many at a time when iterating
+PAGE_SIZE = 200
+
+# Tail versions are unique across queues, so a new queue never looks already saved
+_tail_versions = itertools.count(1)
+
+def _to_le(typecode: str, values: array) -> str:
+    """Base64 of values as little-endian 8-byte integers, the same on every node"""
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+def _from_le(typecode: str, data: str) -> array:
+    values = array(typecode, base64.b64decode(data))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+class SpilledQueue(MutableSequence):
+    """A guild queue that keeps only its first songs as Song objects
+
+    The first QUEUE_WINDOW_SIZE songs (the ones shown first, played next and
+    touched by most commands) are kept as they are. Everything after them is
+    stored as packed records of key, duration and requester id, about 36
+    bytes per song, with titles and URLs written to the metadata database.
+    Songs are read back in batches as the window drains, so memory stays
+    flat no matter how long the queue gets.
+
+    Supports every list operation the player uses. Slicing, iterating and
+    filtering the spilled part read from the database in pages.
+    """
+
+    def __init__(self, db: MetadataDB, song_type: type, member_lookup: Callable[[int], Optional[object]] = None,
+                 window_size: int = Config.QUEUE_WINDOW_SIZE):
+        self.db = db
+        self.song_type = song_type
+        self.member_lookup = member_lookup
+        self.window_size = max(1, window_size)
+        self.window: List = []                 # the first songs, as Song objects
+        self._keys = bytearray()               # KEY_SLOT bytes per spilled song
+        self._durations = array('l')
+        self._requesters = array('Q')          # requester user id, 0 if unknown
+        self._long_keys: List[str] = []        # keys that don't fit in a slot, by index
+        self._long_live = 0                    # records that refer to a long key
+        self._members: Dict[int, object] = {}  # requester id -> member, for songs spilled by this node
+        self.spilled = 0                       # songs written out over the queue's lifetime
+        self.paged_in = 0                      # songs read back
+        self.tail_version = next(_tail_versions)  # changes whenever the packed records do
+
+    # Packing
+
+    def _pack_key(self, song) -> bytes:
+        tag, key = (TAG_VIDEO, song.video_id) if song.video_id else (TAG_URL, song.url)
+        data = key.encode('utf-8')
+        if len(data) >= KEY_SLOT:
+            self._long_keys.append(key)
+            self._long_live += 1
+            data = (len(self._long_keys) - 1).to_bytes(8, 'little')
+            tag = TAG_LONG | (0x80 if song.video_id else 0)
+        return bytes([tag]) + data.ljust(KEY_SLOT - 1, b'\0')
+
+    def _unpack_key(self, index: int) -> Tuple[str, bool]:
+        """(key, whether it is a video id) of spilled entry ``index``"""
+        slot = self._keys[index * KEY_SLOT:(index + 1) * KEY_SLOT]
+        tag = slot[0]
+        if tag & 0x7f == TAG_LONG:
+            return self._long_keys[int.from_bytes(slot[1:9], 'little')], bool(tag & 0x80)
+        return slot[1:].rstrip(b'\0').decode('utf-8'), tag == TAG_VIDEO
+
+    def _count_long(self, start: int, end: int) -> int:
+        """Number of records in start..end (exclusive) that refer to a long key"""
+        return sum(self._keys[i * KEY_SLOT] & 0x7f == TAG_LONG for i in range(start, end))
+
+    def _compact_long_keys(self):
+        """Drop long keys of removed records once they outnumber the live ones, renumbering the rest"""
+        if len(self._long_keys) <= 2 * self._long_live + 16:
+            return
+        keys = []
+        for slot in range(0, len(self._keys), KEY_SLOT):
+            if self._keys[slot] & 0x7f == TAG_LONG:
+                keys.append(self._long_keys[int.from_bytes(self._keys[slot + 1:slot + 9], 'little')])
+                self._keys[slot + 1:slot + 9] = (len(keys) - 1).to_bytes(8, 'little')
+        self._long_keys = keys
+        self._long_live = len(keys)
+
+    def _pack(self, songs: List) -> Tuple[bytearray, array, array]:
+        """Pack songs into records, storing their metadata so they can be read back"""
+        keys = bytearray()
+        durations = array('l')
+        requesters = array('Q')
+        rows = []
+        for song in songs:
+            keys += self._pack_key(song)
+            durations.append(song.duration or 0)
+            requester = getattr(song, 'requester', None)
+            if requester is not None:
+                self._members[requester.id] = requester
+                requesters.append(requester.id)
+            else:
+                requesters.append(0)
+            rows.append((song.video_id or song.url, song.title, song.url, song.duration or 0, song.thumbnail))
+        if rows:
+            self.db.upsert_tracks(rows)
+            self.spilled += len(rows)
+        return keys, durations, requesters
+
+    def _insert_records(self, index: int, records: Tuple[bytearray, array, array]):
+        keys, durations, requesters = records
+        self._keys[index * KEY_SLOT:index * KEY_SLOT] = keys
+        self._durations[index:index] = durations
+        self._requesters[index:index] = requesters
+        self.tail_version = next(_tail_versions)
+
+    def _delete_records(self, start: int, end: int):
+        if self._long_keys:
+            self._long_live -= self._count_long(start, min(end, len(self._durations)))
+        del self._keys[start * KEY_SLOT:end * KEY_SLOT]
+        del self._durations[start:end]
+        del self._requesters[start:end]
+        if not self._durations:
+            self._long_keys.clear()
+            self._long_live = 0
+        self._compact_long_keys()
+        self.tail_version = next(_tail_versions)
+
+    def _materialize(self, start: int, end: int) -> List:
+        """Songs for spilled entries start..end (exclusive)"""
+        entries = [self._unpack_key(i) for i in range(start, end)]
+        try:
+            known = self.db.get_tracks([key for key, _ in entries])
+        except Exception as e:
+            logger.warning(f"Could not read spilled queue entries: {e}")
+            known = {}
+        songs = []
+        for i, (key, is_video) in zip(range(start, end), entries):
+            title, url, _, thumbnail = known.get(key) or (key, WATCH_URL + key if is_video else key, 0, None)
+            requester_id = self._requesters[i]
+            requester = self._members.get(requester_id)
+            if requester is None and requester_id and self.member_lookup:
+                requester = self.member_lookup(requester_id)
+            songs.append(self.song_type(title, url, self._durations[i], requester, thumbnail,
+                                        key if is_video else None))
+        self.paged_in += len(songs)
+        return songs
+
+    def _refill(self):
+        """Read spilled songs back once the window is half empty"""
+        if len(self.window) > self.window_size // 2 or not self._durations:
+            return
+        count = min(self.window_size - len(self.window), len(self._durations))
+        self.window.extend(self._materialize(0, count))
+        self._delete_records(0, count)
+
+    def _insert_many(self, index: int, songs: List):
+        index = max(0, min(index, len(self)))
+        if index <= len(self.window):
+            self.window[index:index] = songs
+            overflow = self.window[self.window_size:]
+            if overflow:
+                del self.window[self.window_size:]
+                self._insert_records(0, self._pack(overflow))
+        else:
+            self._insert_records(index - len(self.window), self._pack(songs))
+
+    # MutableSequence
+
+    def __len__(self) -> int:
+        return len(self.window) + len(self._durations)
+
+    def _index(self, index: int) -> int:
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('queue index out of range')
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            if stop <= start:
+                return []
+            songs = self.window[start:stop]
+            spilled_start = max(0, start - len(self.window))
+            spilled_stop = stop - len(self.window)
+            if spilled_stop > spilled_start:
+                songs += self._materialize(spilled_start, spilled_stop)
+            return songs
+        index = self._index(index)
+        if index < len(self.window):
+            return self.window[index]
+        return self._materialize(index - len(self.window), index - len(self.window) + 1)[0]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('extended slice assignment is not supported')
+            songs = list(value)
+            del self[start:max(start, stop)]
+            self._insert_many(start, songs)
+            return
+        index = self._index(index)
+        if index < len(self.window):
+            self.window[index] = value
+        else:
+            spilled = index - len(self.window)
+            self._delete_records(spilled, spilled + 1)
+            self._insert_records(spilled, self._pack([value]))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                for i in sorted(range(start, stop, step), reverse=True):
+                    del self[i]
+                return
+            if stop <= start:
+                return
+            window_length = len(self.window)
+            self._delete_records(max(0, start - window_length), max(0, stop - window_length))
+            del self.window[start:stop]
+        else:
+            index = self._index(index)
+            if index < len(self.window):
+                del self.window[index]
+            else:
+                spilled = index - len(self.window)
+                self._delete_records(spilled, spilled + 1)
+        self._refill()
+
+    def insert(self, index: int, value):
+        if index < 0:
+            index += len(self)
+        self._insert_many(index, [value])
+
+    def append(self, value):
+        self._insert_many(len(self), [value])
+
+    def extend(self, values: Iterable):
+        self._insert_many(len(self), list(values))
+
+    def clear(self):
+        self.window.clear()
+        self._delete_records(0, len(self._durations))
+        self._members.clear()
+
+    def __iter__(self) -> Iterator:
+        yield from list(self.window)
+        for start in range(0, len(self._durations), PAGE_SIZE):
+            yield from self._materialize(start, min(start + PAGE_SIZE, len(self._durations)))
+
+    def __sizeof__(self) -> int:
+        return (object.__sizeof__(self) + sys.getsizeof(self.window) + sys.getsizeof(self._keys)
+                + sys.getsizeof(self._durations) + sys.getsizeof(self._requesters)
+                + sum(sys.getsizeof(key) for key in self._long_keys))
+
+    # Whole-queue operations that never materialize the spilled part
+
+    def shuffle(self):
+        """Shuffle every song by permuting the packed records"""
+        if self.window:
+            self._insert_records(0, self._pack(self.window))
+            self.window = []
+        order = list(range(len(self._durations)))
+        random.shuffle(order)
+        keys = self._keys
+        self._keys = bytearray().join(keys[i * KEY_SLOT:(i + 1) * KEY_SLOT] for i in order)
+        self._durations = array('l', (self._durations[i] for i in order))
+        self._requesters = array('Q', (self._requesters[i] for i in order))
+        self.tail_version = next(_tail_versions)
+        self._refill()
+
+    def filter(self, keep: Callable[[object], bool]) -> List:
+        """Keep only the songs for which keep(song) is true; returns the removed songs
+
+        Spilled songs are checked a page at a time and kept records are copied
+        as they are, so nothing is written back to the database.
+        """
+        removed = [song for song in self.window if not keep(song)]
+        if removed:
+            self.window = [song for song in self.window if keep(song)]
+        kept: List[int] = []
+        for start in range(0, len(self._durations), PAGE_SIZE):
+            for i, song in enumerate(self._materialize(start, min(start + PAGE_SIZE, len(self._durations))), start):
+                if keep(song):
+                    kept.append(i)
+                else:
+                    removed.append(song)
+        if len(kept) < len(self._durations):
+            keys = self._keys
+            self._keys = bytearray().join(keys[i * KEY_SLOT:(i + 1) * KEY_SLOT] for i in kept)
+            self._durations = array('l', (self._durations[i] for i in kept))
+            self._requesters = array('Q', (self._requesters[i] for i in kept))
+            if self._long_keys:
+                self._long_live = self._count_long(0, len(self._durations))
+                self._compact_long_keys()
+            self.tail_version = next(_tail_versions)
+        self._refill()
+        return removed
+
+    # Saved state
+
+    @property
+    def spilled_count(self) -> int:
+        return len(self._durations)
+
+    def dump_tail(self) -> str:
+        """The packed records as a string for the shared state store (titles stay in the database)"""
+        return json.dumps({
+            'keys': base64.b64encode(self._keys).decode('ascii'),
+            'durations': _to_le('q', self._durations),
+            'requesters': _to_le('Q', self._requesters),
+            'long_keys': self._long_keys,
+        })
+
+    def load_tail(self, data: str, limit: Optional[int] = None) -> int:
+        """Append records saved by dump_tail, at most ``limit`` of them; returns their total duration"""
+        tail = json.loads(data)
+        keys = bytearray(base64.b64decode(tail['keys']))
+        durations = array('l', _from_le('q', tail['durations']))
+        requesters = _from_le('Q', tail['requesters'])
+        count = len(durations) if limit is None else max(0, min(limit, len(durations)))
+        del keys[count * KEY_SLOT:], durations[count:], requesters[count:]
+        if tail['long_keys']:
+            # Long keys are stored by index: shift them past the ones this queue already has
+            offset = len(self._long_keys)
+            for slot in range(0, len(keys), KEY_SLOT):
+                if keys[slot] & 0x7f == TAG_LONG:
+                    index = int.from_bytes(keys[slot + 1:slot + 9], 'little') + offset
+                    keys[slot + 1:slot + 9] = index.to_bytes(8, 'little')
+            self._long_keys.extend(tail['long_keys'])
+            self._long_live += sum(keys[slot] & 0x7f == TAG_LONG for slot in range(0, len(keys), KEY_SLOT))
+        self._insert_records(len(self._durations), (keys, durations, requesters))
+        self._refill()
+        return sum(durations)
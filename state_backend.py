@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class StateBackendError(RuntimeError):
+    """Raised when the shared state store rejects a command or can't be reached"""
+
+class GuildOwnedElsewhere(RuntimeError):
+    """Raised when another node holds the playback lease for a guild"""
+
+class StateBackend:
+    """Key-value store for guild state shared between bot nodes
+
+    Values are strings. Leases are keys that expire unless their owner renews
+    them, so exactly one node drives playback in a guild at a time.
+    """
+
+    # Whether other processes read the store; state is only saved to shared stores
+    shared = True
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set_many(self, items: Dict[str, str]):
+        """Write several keys in one round trip"""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take a lease if it is free or already ours; returns whether we hold it"""
+        raise NotImplementedError
+
+    async def renew_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Extend a lease we hold; returns False if it expired or was taken"""
+        raise NotImplementedError
+
+    async def release_lease(self, name: str, owner: str):
+        """Give up a lease if we still hold it"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class MemoryStateBackend(StateBackend):
+    """In-process backend for single-node deployments
+
+    Nothing outside this process reads it, so guild state is never written
+    here (the player's own state is the only copy); only leases are kept.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[str, str] = {}
+        self._leases: Dict[str, Tuple[str, float]] = {}  # name -> (owner, expires at)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._values.get(key)
+
+    async def set_many(self, items: Dict[str, str]):
+        self._values.update(items)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    def _holder(self, name: str) -> Optional[str]:
+        lease = self._leases.get(name)
+        if lease and lease[1] <= time.monotonic():
+            del self._leases[name]
+            return None
+        return lease[0] if lease else None
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        if self._holder(name) not in (None, owner):
+            return False
+        self._leases[name] = (owner, time.monotonic() + ttl)
+        return True
+
+    async def renew_lease(self, name: str, owner: str, ttl: float) -> bool:
+        if self._holder(name) != owner:
+            return False
+        self._leases[name] = (owner, time.monotonic() + ttl)
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        if self._holder(name) == owner:
+            del self._leases[name]
+
+# Compare-and-set scripts so a node never renews or deletes a lease another node now holds
+_RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+class RedisStateBackend(StateBackend):
+    """Backend for any server speaking the Redis protocol (RESP)
+
+    Uses a single connection; commands issued together are pipelined. The URL
+    has the form redis://[:password@]host[:port][/db].
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=Config.STATE_TIMEOUT)
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            await self._roundtrip(setup)
+        logger.info(f"Connected to state store at {self.host}:{self.port}/{self.db}")
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("State store closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise StateBackendError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [await self._read_reply() for _ in range(length)]
+        raise StateBackendError(f"Unexpected reply from state store: {line!r}")
+
+    async def _roundtrip(self, commands: List[Tuple]) -> List:
+        self._writer.write(b''.join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        replies = []
+        for _ in commands:
+            try:
+                replies.append(await self._read_reply())
+            except StateBackendError as e:
+                replies.append(e)
+        return replies
+
+    async def execute(self, *commands: Tuple) -> List:
+        """Send commands in one pipeline and return their replies in order"""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None or self._writer.is_closing():
+                        await self._connect()
+                    replies = await asyncio.wait_for(self._roundtrip(list(commands)), timeout=Config.STATE_TIMEOUT)
+                    break
+                except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    # The connection is in an unknown state: drop it and retry once on a new one
+                    await self._disconnect()
+                    if attempt:
+                        raise StateBackendError(f"State store unavailable: {e}") from e
+        for reply in replies:
+            if isinstance(reply, StateBackendError):
+                raise reply
+        return replies
+
+    async def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    async def get(self, key: str) -> Optional[str]:
+        return (await self.execute(('GET', key)))[0]
+
+    async def set_many(self, items: Dict[str, str]):
+        if items:
+            await self.execute(('MSET', *[part for item in items.items() for part in item]))
+
+    async def delete(self, key: str):
+        await self.execute(('DEL', key))
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        ttl_ms = int(ttl * 1000)
+        taken, renewed = await self.execute(('SET', name, owner, 'NX', 'PX', ttl_ms),
+                                            ('EVAL', _RENEW_SCRIPT, 1, name, owner, ttl_ms))
+        return taken == 'OK' or renewed == 1
+
+    async def renew_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return (await self.execute(('EVAL', _RENEW_SCRIPT, 1, name, owner, int(ttl * 1000))))[0] == 1
+
+    async def release_lease(self, name: str, owner: str):
+        await self.execute(('EVAL', _RELEASE_SCRIPT, 1, name, owner))
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+
+def create_backend(url: str) -> StateBackend:
+    """Create the backend named by STATE_BACKEND ('memory' or a redis:// URL)"""
+    if url.startswith(('redis://', 'rediss://')):
+        if url.startswith('rediss://'):
+            raise ValueError("TLS connections to the state store are not supported")
+        return RedisStateBackend(url)
+    if url != 'memory':
+        logger.warning(f"Unknown STATE_BACKEND '{url}', using in-memory state")
+    return MemoryStateBackend()
+
+class GuildStateSync:
+    """Keeps the guilds this node plays in leased and their state saved
+
+    State changes only mark a guild dirty; a background task writes all dirty
+    guilds in one batch every STATE_FLUSH_INTERVAL seconds, so playback never
+    waits on the store. Leases are renewed every third of STATE_LEASE_TTL and
+    ``on_lease_lost`` is called if one can't be.
+
+    Large, rarely changing pieces of state (``parts``) are stored under keys
+    of their own as (version, dump) pairs and only dumped and written when
+    their version changed since the last successful write.
+    """
+
+    def __init__(self, backend: StateBackend, node_id: str,
+                 snapshot: Callable[[int], Dict], on_lease_lost: Callable[[int], None],
+                 parts: Optional[Callable[[int], Dict[str, Tuple[int, Callable[[], str]]]]] = None):
+        self.backend = backend
+        self.node_id = node_id
+        self._snapshot = snapshot
+        self._on_lease_lost = on_lease_lost
+        self._parts = parts
+        self.owned: Set[int] = set()
+        self._dirty: Set[int] = set()
+        self._part_versions: Dict[Tuple[int, str], int] = {}  # (guild_id, part) -> version last written
+        self._flush_task: Optional[asyncio.Task] = None
+        self._renew_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.writes = 0
+
+    def _state_key(self, guild_id: int) -> str:
+        return f"{Config.STATE_KEY_PREFIX}guild:{guild_id}:state"
+
+    def _lease_key(self, guild_id: int) -> str:
+        return f"{Config.STATE_KEY_PREFIX}guild:{guild_id}:owner"
+
+    def _part_key(self, guild_id: int, name: str) -> str:
+        return f"{Config.STATE_KEY_PREFIX}guild:{guild_id}:{name}"
+
+    def _serialize(self, guild_id: int, items: Dict[str, str], versions: Dict[Tuple[int, str], int]):
+        """Add a guild's state, and the parts that changed since they were last written, to a batch"""
+        state = self._snapshot(guild_id)
+        parts = self._parts(guild_id) if self._parts else {}
+        state['parts'] = sorted(parts)
+        for name, (version, dump) in parts.items():
+            if self._part_versions.get((guild_id, name)) != version:
+                items[self._part_key(guild_id, name)] = dump()
+                versions[(guild_id, name)] = version
+        items[self._state_key(guild_id)] = json.dumps(state)
+
+    async def acquire(self, guild_id: int) -> Optional[Dict]:
+        """Take the guild's playback lease and return its saved state, if any
+
+        Raises GuildOwnedElsewhere if another node holds the lease.
+        """
+        if not await self.backend.acquire_lease(self._lease_key(guild_id), self.node_id, Config.STATE_LEASE_TTL):
+            raise GuildOwnedElsewhere(f"Guild {guild_id} is owned by another node")
+        self.owned.add(guild_id)
+        self._ensure_tasks()
+        saved = await self.backend.get(self._state_key(guild_id))
+        if not saved:
+            return None
+        saved = json.loads(saved)
+        saved['part_values'] = {name: await self.backend.get(self._part_key(guild_id, name))
+                                for name in saved.get('parts', ())}
+        return saved
+
+    async def release(self, guild_id: int):
+        """Save the guild's state one last time and give up its lease"""
+        if guild_id not in self.owned:
+            return
+        try:
+            if guild_id in self._dirty:
+                self._dirty.discard(guild_id)
+                items, versions = {}, {}
+                self._serialize(guild_id, items, versions)
+                await self.backend.set_many(items)
+            await self.backend.release_lease(self._lease_key(guild_id), self.node_id)
+        except Exception as e:
+            logger.warning(f"Could not release guild {guild_id} cleanly: {e}")
+        finally:
+            self.forget(guild_id)
+
+    def forget(self, guild_id: int):
+        """Stop tracking a guild without writing anything (its lease is gone)"""
+        self.owned.discard(guild_id)
+        self._dirty.discard(guild_id)
+        for key in [key for key in self._part_versions if key[0] == guild_id]:
+            del self._part_versions[key]
+
+    def mark_dirty(self, guild_id: int):
+        """Schedule a guild's state to be written with the next batch (shared stores only)"""
+        if guild_id in self.owned and self.backend.shared:
+            self._dirty.add(guild_id)
+
+    def _ensure_tasks(self):
+        loop = asyncio.get_running_loop()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_periodically())
+        if self._renew_task is None or self._renew_task.done():
+            self._renew_task = loop.create_task(self._renew_periodically())
+
+    async def flush(self):
+        """Write every dirty guild's state in one batch"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        items, versions = {}, {}
+        for guild_id in dirty:
+            try:
+                self._serialize(guild_id, items, versions)
+            except Exception as e:
+                logger.error(f"Could not serialize state for guild {guild_id}: {e}")
+        try:
+            await self.backend.set_many(items)
+            self._part_versions.update((key, version) for key, version in versions.items() if key[0] in self.owned)
+            self.flushes += 1
+            self.writes += len(items)
+        except Exception as e:
+            logger.warning(f"Could not save guild state, will retry: {e}")
+            self._dirty |= dirty & self.owned
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(Config.STATE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def _renew_periodically(self):
+        while True:
+            await asyncio.sleep(Config.STATE_LEASE_TTL / 3)
+            for guild_id in list(self.owned):
+                try:
+                    renewed = await self.backend.renew_lease(self._lease_key(guild_id), self.node_id, Config.STATE_LEASE_TTL)
+                except Exception as e:
+                    # Keep playing through a short outage; the lease only lapses after the full TTL
+                    logger.warning(f"Could not renew lease for guild {guild_id}: {e}")
+                    continue
+                if not renewed and guild_id in self.owned:
+                    logger.error(f"Lost playback lease for guild {guild_id}")
+                    self.forget(guild_id)
+                    self._on_lease_lost(guild_id)
+
+    async def close(self):
+        """Flush outstanding writes, release all leases and close the backend"""
+        for task in (self._flush_task, self._renew_task):
+            if task:
+                task.cancel()
+        await self.flush()
+        for guild_id in list(self.owned):
+            await self.release(guild_id)
+        await self.backend.close()
@@ -0,0 +1,253 @@
+import discord
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Discord voice frames are 20 ms of audio
+FRAMES_PER_SECOND = 50
+
+class _Broadcast:
+    """One FFmpeg decode of a track, shared by every guild playing it
+
+    A producer thread reads PCM frames from the source into a buffer. Readers
+    keep their own frame index into it. The producer stays at most
+    ``lead`` frames ahead of the fastest reader. While the join window is open
+    the buffer keeps the track from its first frame so late guilds can start
+    at the beginning; after that, frames every reader has passed are dropped.
+    """
+
+    def __init__(self, key: str, url: str, source: discord.AudioSource, on_close: Callable[['_Broadcast'], None]):
+        self.key = key
+        self.url = url
+        self.source = source
+        self.started_at = time.monotonic()
+        self.frames: Deque[bytes] = deque()
+        self.base = 0        # absolute index of frames[0]
+        self.written = 0     # absolute index of the next frame to produce
+        self.finished = False
+        self.closed = False
+        self.readers: Set['BrokeredAudioSource'] = set()
+        self.joins = 0
+        self.lead = max(1, int(Config.BROKER_LEAD_SECONDS * FRAMES_PER_SECOND))
+        # Enough to keep the first frame for the whole join window at real-time playback
+        window = int((Config.BROKER_JOIN_WINDOW + Config.BROKER_LEAD_SECONDS) * FRAMES_PER_SECOND)
+        self.capacity = max(window, int(Config.BROKER_BUFFER_SECONDS * FRAMES_PER_SECOND))
+        self._condition = threading.Condition()
+        self._on_close = on_close
+        self._thread = threading.Thread(target=self._produce, name=f"broadcast-{key}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def window_open(self) -> bool:
+        return time.monotonic() - self.started_at <= Config.BROKER_JOIN_WINDOW
+
+    def joinable(self) -> bool:
+        """Whether a new reader can still start this track from its beginning"""
+        with self._condition:
+            return not self.closed and bool(self.readers) and self.base == 0 and self.window_open
+
+    def attach(self, reader: 'BrokeredAudioSource') -> bool:
+        with self._condition:
+            if self.closed:
+                return False
+            self.readers.add(reader)
+            self.joins += 1
+            self._condition.notify_all()
+            return True
+
+    def detach(self, reader: 'BrokeredAudioSource'):
+        with self._condition:
+            self.readers.discard(reader)
+            self._condition.notify_all()
+            done = self.finished and not self.readers
+        if done:
+            self.close()
+
+    def _produce(self):
+        """Decode frames into the buffer until the track ends or nobody listens"""
+        try:
+            while True:
+                with self._condition:
+                    while not self.closed and self.readers and self.written - self._fastest() >= self.lead:
+                        self._condition.wait(0.1)
+                    if self.closed or not self.readers:
+                        break
+
+                frame = self.source.read()  # blocks on FFmpeg, so outside the lock
+
+                if not frame:
+                    # FFmpeg is done; readers drain the buffer and the last one out closes it
+                    self.source.cleanup()
+                    with self._condition:
+                        self.finished = True
+                        self._condition.notify_all()
+                        if self.readers:
+                            return
+                    break
+
+                with self._condition:
+                    self.frames.append(frame)
+                    self.written += 1
+                    self._trim()
+                    self._condition.notify_all()
+        except Exception as e:
+            logger.error(f"Error in shared stream {self.key}: {e}")
+        self.close()
+
+    def _fastest(self) -> int:
+        return max(reader.index for reader in self.readers)
+
+    def _trim(self):
+        """Drop frames nobody needs any more (caller holds the lock)"""
+        cutoff = self.written - self.capacity
+        if not self.window_open and self.readers:
+            cutoff = max(cutoff, min(reader.index for reader in self.readers))
+        while self.base < cutoff and self.frames:
+            self.frames.popleft()
+            self.base += 1
+
+    def read(self, reader: 'BrokeredAudioSource') -> Optional[bytes]:
+        """Get a reader's next frame; b'' at the end, None if it can't be served from the buffer"""
+        with self._condition:
+            while True:
+                if reader.index < self.base:
+                    return None
+                if reader.index < self.written:
+                    frame = self.frames[reader.index - self.base]
+                    reader.index += 1
+                    self._condition.notify_all()
+                    return frame
+                if self.finished or reader not in self.readers:
+                    return b''
+                if self.closed:
+                    # The decode failed mid-track
+                    return None
+                self._condition.wait(1.0)
+
+    def close(self):
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.frames.clear()
+            self.base = self.written
+            self._condition.notify_all()
+        try:
+            self.source.cleanup()
+        except Exception as e:
+            logger.warning(f"Error cleaning up shared stream {self.key}: {e}")
+        self._on_close(self)
+
+class BrokeredAudioSource(discord.AudioSource):
+    """Reads a guild's audio from a shared broadcast
+
+    If the guild falls too far behind (e.g. it was paused for longer than the
+    buffer holds), it switches to a private source started at its own
+    position, created by ``fallback``.
+    """
+
+    def __init__(self, broadcast: _Broadcast, fallback: Callable[[float], discord.AudioSource]):
+        self.broadcast = broadcast
+        self.index = 0
+        self._fallback_factory = fallback
+        self._fallback: Optional[discord.AudioSource] = None
+
+    @property
+    def original(self) -> Optional[discord.AudioSource]:
+        """The private source, once this reader has left the broadcast"""
+        return self._fallback
+
+    def read(self) -> bytes:
+        if self._fallback is not None:
+            return self._fallback.read()
+
+        frame = self.broadcast.read(self)
+        if frame is None:
+            position = self.index / FRAMES_PER_SECOND
+            logger.info(f"Reader fell behind shared stream {self.broadcast.key}, continuing privately at {position:.1f}s")
+            self.broadcast.detach(self)
+            self._fallback = self._fallback_factory(position)
+            return self._fallback.read()
+        return frame
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self.broadcast.detach(self)
+        if self._fallback is not None:
+            self._fallback.cleanup()
+
+class StreamBroker:
+    """Deduplicates decoding when several guilds play the same track
+
+    The first guild to play a track starts a broadcast; guilds that start the
+    same track within BROKER_JOIN_WINDOW seconds read from it instead of
+    extracting and decoding it again.
+    """
+
+    def __init__(self, ffmpeg_supervisor):
+        self.ffmpeg = ffmpeg_supervisor
+        self._broadcasts: Dict[str, _Broadcast] = {}  # video id -> broadcast
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+        self.fallbacks = 0
+
+    def joinable_url(self, key: Optional[str]) -> Optional[str]:
+        """Stream URL of a broadcast that a new guild could join, if any"""
+        if not Config.BROKER_ENABLED or not key:
+            return None
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+        return broadcast.url if broadcast and broadcast.joinable() else None
+
+    def open(self, key: str, url: str, fallback: Callable[[float], discord.AudioSource]) -> BrokeredAudioSource:
+        """Get a source for a track, joining a running broadcast when possible"""
+        def counted_fallback(position: float) -> discord.AudioSource:
+            self.fallbacks += 1
+            return fallback(position)
+
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            if broadcast and broadcast.joinable():
+                reader = BrokeredAudioSource(broadcast, counted_fallback)
+                if broadcast.attach(reader):
+                    self.joined += 1
+                    logger.info(f"Joined shared stream {key} ({len(broadcast.readers)} listeners)")
+                    return reader
+
+            # Decoded once for everyone, so it isn't owned by any one guild
+            source = self.ffmpeg.create_source(None, url, **Config.FFMPEG_OPTIONS)
+            broadcast = _Broadcast(key, url, source, self._forget)
+            reader = BrokeredAudioSource(broadcast, counted_fallback)
+            broadcast.attach(reader)
+            self._broadcasts[key] = broadcast
+            self.started += 1
+
+        broadcast.start()
+        return reader
+
+    def _forget(self, broadcast: _Broadcast):
+        with self._lock:
+            if self._broadcasts.get(broadcast.key) is broadcast:
+                del self._broadcasts[broadcast.key]
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            broadcasts = list(self._broadcasts.values())
+        return {
+            'active': len(broadcasts),
+            'listeners': sum(len(b.readers) for b in broadcasts),
+            'buffered_frames': sum(len(b.frames) for b in broadcasts),
+            'started': self.started,
+            'joined': self.joined,
+            'fallbacks': self.fallbacks,
+        }
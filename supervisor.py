@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque, Optional
+import aiohttp
+import discord
+from discord.ext import commands
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Gateway close codes that will not succeed on retry (bad token, bad intents, ...)
+FATAL_CLOSE_CODES = {4004, 4010, 4011, 4012, 4013, 4014}
+
+class GatewaySupervisor:
+    """Keeps the bot connected to Discord inside one long-lived event loop
+    
+    Failed connections are retried with jittered exponential backoff on the
+    same Bot object, so MusicPlayer queues and voice sessions survive a
+    gateway outage. Reconnect latency (disconnect to ready/resumed) is
+    recorded for diagnostics.
+    """
+    
+    def __init__(self, bot: commands.Bot, token: str):
+        self.bot = bot
+        self.token = token
+        self.attempt = 0
+        self.reconnects = 0
+        self.reconnect_latencies: Deque[float] = deque(maxlen=50)
+        self._disconnected_at: Optional[float] = None
+    
+    def note_disconnect(self):
+        """Record the start of an outage (first disconnect only)"""
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+    
+    def note_connected(self):
+        """Record the end of an outage and reset the backoff"""
+        self.attempt = 0
+        if self._disconnected_at is None:
+            return
+        latency = time.monotonic() - self._disconnected_at
+        self._disconnected_at = None
+        self.reconnects += 1
+        self.reconnect_latencies.append(latency)
+        logger.info(f"Reconnected to Discord after {latency:.2f}s (reconnect #{self.reconnects})")
+    
+    def backoff_delay(self) -> float:
+        """Full-jitter exponential backoff for the current attempt"""
+        ceiling = min(Config.RECONNECT_MAX_DELAY, Config.RECONNECT_BASE_DELAY * (2 ** self.attempt))
+        return random.uniform(0, ceiling)
+    
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, discord.ConnectionClosed):
+            return error.code not in FATAL_CLOSE_CODES
+        if isinstance(error, discord.HTTPException):
+            return error.status >= 500 or error.status == 429
+        return isinstance(error, (discord.GatewayNotFound, OSError, aiohttp.ClientError, asyncio.TimeoutError))
+    
+    async def _wait_before_retry(self, error: Exception):
+        """Sleep before the next attempt, or re-raise once retries run out"""
+        self.note_disconnect()
+        self.attempt += 1
+        if Config.RECONNECT_MAX_RETRIES and self.attempt > Config.RECONNECT_MAX_RETRIES:
+            logger.error(f"Giving up after {Config.RECONNECT_MAX_RETRIES} reconnect attempts")
+            raise error
+        
+        delay = self.backoff_delay()
+        logger.warning(f"Connection to Discord failed ({type(error).__name__}: {error}), "
+                       f"retrying in {delay:.1f}s (attempt {self.attempt})")
+        await asyncio.sleep(delay)
+    
+    async def run(self):
+        """Log in and stay connected until the bot is closed"""
+        async with self.bot:
+            while True:
+                try:
+                    await self.bot.login(self.token)
+                    break
+                except Exception as e:
+                    if not self._is_retryable(e):
+                        raise
+                    await self._wait_before_retry(e)
+            
+            while not self.bot.is_closed():
+                try:
+                    # discord.py resumes short drops itself; this only returns or raises for
+                    # failures it gives up on
+                    await self.bot.connect(reconnect=True)
+                except Exception as e:
+                    if self.bot.is_closed() or not self._is_retryable(e):
+                        raise
+                    await self._wait_before_retry(e)
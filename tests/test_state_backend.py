@@ -0,0 +1,161 @@
+"""RedisStateBackend and GuildStateSync against the RESP stand-in server
+
+    python -m pytest tests
+"""
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from resp_standin import RespStandIn
+from state_backend import GuildStateSync, RedisStateBackend, StateBackendError
+
+class StandInTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = RespStandIn()
+        await self.server.start()
+        self.backends = []
+
+    async def asyncTearDown(self):
+        for backend in self.backends:
+            await backend.close()
+        await self.server.close()
+
+    def backend(self) -> RedisStateBackend:
+        backend = RedisStateBackend(self.server.url)
+        self.backends.append(backend)
+        return backend
+
+class LeaseTests(StandInTestCase):
+    async def test_acquire_sets_lease_only_if_free(self):
+        first, second = self.backend(), self.backend()
+        self.assertTrue(await first.acquire_lease('lease', 'node-1', 15))
+        self.assertIn(['SET', 'lease', 'node-1', 'NX', 'PX', '15000'], self.server.commands)
+        self.assertFalse(await second.acquire_lease('lease', 'node-2', 15))
+        # Acquiring a lease we already hold extends it
+        self.assertTrue(await first.acquire_lease('lease', 'node-1', 15))
+        self.assertEqual(self.server.get('lease'), 'node-1')
+
+    async def test_lease_can_be_taken_after_it_expires(self):
+        first, second = self.backend(), self.backend()
+        self.assertTrue(await first.acquire_lease('lease', 'node-1', 0.05))
+        await asyncio.sleep(0.1)
+        self.assertTrue(await second.acquire_lease('lease', 'node-2', 15))
+        self.assertFalse(await first.renew_lease('lease', 'node-1', 15))
+
+    async def test_renew_and_release_refuse_a_foreign_owner(self):
+        owner, other = self.backend(), self.backend()
+        await owner.acquire_lease('lease', 'node-1', 15)
+        self.assertFalse(await other.renew_lease('lease', 'node-2', 15))
+        await other.release_lease('lease', 'node-2')
+        self.assertEqual(self.server.get('lease'), 'node-1')
+
+        self.assertTrue(await owner.renew_lease('lease', 'node-1', 15))
+        await owner.release_lease('lease', 'node-1')
+        self.assertIsNone(self.server.get('lease'))
+
+class BackendTests(StandInTestCase):
+    async def test_errors_are_raised(self):
+        backend = self.backend()
+        self.server.fail['GET'] = 'ERR broken'
+        with self.assertRaises(StateBackendError):
+            await backend.get('key')
+
+    async def test_reconnects_after_the_connection_drops(self):
+        backend = self.backend()
+        await backend.set_many({'key': 'value'})
+        backend._writer.close()
+        self.assertEqual(await backend.get('key'), 'value')
+        self.assertEqual(self.server.connections, 2)
+
+    async def test_password_is_sent(self):
+        await self.server.close()
+        self.server = RespStandIn(password='secret')
+        await self.server.start()
+        backend = self.backend()
+        await backend.set_many({'key': 'value'})
+        self.assertEqual(self.server.commands[0], ['AUTH', 'secret'])
+        self.assertEqual(self.server.get('key'), 'value')
+
+class GuildStateSyncTests(StandInTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.lost = []
+        self.sync = GuildStateSync(self.backend(), 'node-1', lambda guild_id: {'guild': guild_id}, self.lost.append)
+
+    async def asyncTearDown(self):
+        for task in (self.sync._flush_task, self.sync._renew_task):
+            if task:
+                task.cancel()
+        await super().asyncTearDown()
+
+    async def test_one_mset_per_flush(self):
+        for guild_id in (1, 2, 3):
+            await self.sync.acquire(guild_id)
+            self.sync.mark_dirty(guild_id)
+        self.server.commands.clear()
+        await self.sync.flush()
+        self.assertEqual(self.server.names(), ['MSET'])
+        for guild_id in (1, 2, 3):
+            saved = json.loads(self.server.get(f"{Config.STATE_KEY_PREFIX}guild:{guild_id}:state"))
+            self.assertEqual(saved['guild'], guild_id)
+
+        # Nothing dirty: nothing sent
+        await self.sync.flush()
+        self.assertEqual(self.server.names(), ['MSET'])
+
+    async def test_failed_write_marks_guilds_dirty_again(self):
+        for guild_id in (1, 2):
+            await self.sync.acquire(guild_id)
+            self.sync.mark_dirty(guild_id)
+        self.server.fail['MSET'] = 'ERR out of memory'
+        await self.sync.flush()
+        self.assertEqual(self.sync._dirty, {1, 2})
+        self.assertEqual(self.sync.writes, 0)
+
+        del self.server.fail['MSET']
+        await self.sync.flush()
+        self.assertEqual(self.sync._dirty, set())
+        self.assertEqual(self.sync.writes, 2)
+        self.assertIsNotNone(self.server.get(f"{Config.STATE_KEY_PREFIX}guild:2:state"))
+
+    async def test_unchanged_parts_are_not_rewritten(self):
+        versions = {'tail': 1}
+        dumps = []
+
+        def parts(guild_id):
+            return {'tail': (versions['tail'], lambda: dumps.append(guild_id) or 'packed')}
+
+        self.sync._parts = parts
+        await self.sync.acquire(1)
+        self.sync.mark_dirty(1)
+        await self.sync.flush()
+        self.sync.mark_dirty(1)
+        await self.sync.flush()
+        self.assertEqual(dumps, [1])
+
+        versions['tail'] = 2
+        self.sync.mark_dirty(1)
+        await self.sync.flush()
+        self.assertEqual(dumps, [1, 1])
+
+        other = GuildStateSync(self.backend(), 'node-2', None, None)
+        await self.sync.release(1)
+        saved = await other.acquire(1)
+        self.assertEqual(saved['part_values'], {'tail': 'packed'})
+        other._flush_task.cancel()
+        other._renew_task.cancel()
+
+    async def test_guild_owned_elsewhere_is_refused(self):
+        from state_backend import GuildOwnedElsewhere
+        other = GuildStateSync(self.backend(), 'node-2', None, None)
+        await self.sync.acquire(1)
+        with self.assertRaises(GuildOwnedElsewhere):
+            await other.acquire(1)
+
+if __name__ == '__main__':
+    unittest.main()
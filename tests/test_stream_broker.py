@@ -0,0 +1,88 @@
+"""Falling back from a shared stream to a private FFmpeg source
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_supervisor import FFmpegSupervisor
+from music_player import MusicPlayer
+from stream_broker import BrokeredAudioSource
+
+FRAME = b'\0' * 3840
+
+class FakeSource:
+    def __init__(self):
+        self.cleaned_up = False
+
+    def read(self) -> bytes:
+        return FRAME
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+class RecordingSupervisor(FFmpegSupervisor):
+    """Hands out fake sources instead of starting FFmpeg"""
+
+    def __init__(self):
+        super().__init__()
+        self.created = []
+
+    def create_source(self, guild_id, url, **ffmpeg_options):
+        source = FakeSource()
+        self.created.append((guild_id, url, ffmpeg_options, source))
+        return source
+
+class ExhaustedBroadcast:
+    """A broadcast the reader has fallen too far behind to keep reading"""
+    key = 'video'
+
+    def __init__(self):
+        self.detached = []
+
+    def read(self, reader):
+        return None
+
+    def detach(self, reader):
+        self.detached.append(reader)
+
+class FallbackTests(unittest.IsolatedAsyncioTestCase):
+    async def test_fallback_on_the_audio_thread(self):
+        player = MusicPlayer.__new__(MusicPlayer)
+        player.ffmpeg = RecordingSupervisor()
+        broadcast = ExhaustedBroadcast()
+        reader = BrokeredAudioSource(broadcast, lambda position: player._ffmpeg_source(1, 'https://example.com/a', position))
+        reader.index = 500
+
+        # discord.py reads sources on its own player thread, where no event loop runs
+        frames, errors = [], []
+
+        def play():
+            try:
+                frames.append(reader.read())
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=play)
+        thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(frames, [FRAME])
+        self.assertEqual(broadcast.detached, [reader])
+        guild_id, url, options, source = player.ffmpeg.created[0]
+        self.assertEqual(guild_id, 1)
+        self.assertIn('-ss 10.00', options['before_options'])
+
+        # The private source belongs to the reader, so the player's cleanup reaches it
+        self.assertIs(reader.original, source)
+        reader.cleanup()
+        self.assertTrue(source.cleaned_up)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import asyncio
+import discord
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class MonitoredVoiceClient(discord.VoiceClient):
+    """VoiceClient that records packet sends so stalls can be detected"""
+
+    def __init__(self, client: discord.Client, channel: discord.abc.Connectable):
+        super().__init__(client, channel)
+        self.packets_sent = 0
+        self.packet_errors = 0
+        self.gaps = 0
+        self.longest_gap = 0.0
+        self.last_packet_at: Optional[float] = None
+        self.play_started_at: Optional[float] = None
+        self.intentional_disconnect = False
+
+    def play(self, source: discord.AudioSource, *, after=None, **kwargs):
+        self.play_started_at = time.monotonic()
+        self.last_packet_at = None
+        super().play(source, after=after, **kwargs)
+
+    def resume(self):
+        # A pause is not a gap
+        self.last_packet_at = None
+        super().resume()
+
+    def send_audio_packet(self, data: bytes, *, encode: bool = True):
+        # Called from the audio player thread once per 20 ms frame
+        now = time.monotonic()
+        if self.last_packet_at is not None:
+            gap = now - self.last_packet_at
+            if gap > Config.VOICE_GAP_THRESHOLD:
+                self.gaps += 1
+                self.longest_gap = max(self.longest_gap, gap)
+        try:
+            super().send_audio_packet(data, encode=encode)
+        except Exception:
+            self.packet_errors += 1
+            raise
+        else:
+            self.packets_sent += 1
+        finally:
+            self.last_packet_at = now
+
+    async def disconnect(self, *, force: bool = False):
+        self.intentional_disconnect = True
+        await super().disconnect(force=force)
+
+class VoiceHealthMonitor:
+    """Watches each guild's voice connection and re-establishes it when it dies
+
+    A connection is considered dead when it stays disconnected for longer than
+    VOICE_DEAD_TIMEOUT, and stalled when it is playing but no packet has been
+    sent for VOICE_STALL_TIMEOUT. Recovery reconnects to the same channel and
+    resumes the current song at its last position.
+    """
+
+    def __init__(self, music_player):
+        self.music_player = music_player
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._recovering: Set[int] = set()
+        self.recoveries: Dict[int, int] = {}   # guild_id -> successful recoveries
+        self.failures: Dict[int, int] = {}     # guild_id -> failed recoveries
+        self.recovery_times: Deque[float] = deque(maxlen=100)
+
+    def start(self, guild_id: int):
+        """Start watching a guild's voice connection"""
+        task = self._tasks.get(guild_id)
+        if task is None or task.done():
+            self._tasks[guild_id] = asyncio.get_running_loop().create_task(self._watch(guild_id))
+
+    def stop(self, guild_id: int):
+        """Stop watching a guild's voice connection"""
+        if guild_id in self._recovering:
+            return
+        task = self._tasks.pop(guild_id, None)
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+    def is_recovering(self, guild_id: int) -> bool:
+        return guild_id in self._recovering
+
+    async def _watch(self, guild_id: int):
+        """Periodically check one guild's connection"""
+        disconnected_since = None
+        while True:
+            await asyncio.sleep(Config.VOICE_HEALTH_INTERVAL)
+            if guild_id in self._recovering:
+                continue
+
+            voice_client = self.music_player.voice_clients.get(guild_id)
+            if voice_client is None or getattr(voice_client, 'intentional_disconnect', False):
+                self._tasks.pop(guild_id, None)
+                return
+
+            now = time.monotonic()
+            if not voice_client.is_connected():
+                # Give discord.py a moment to resume the voice session itself
+                disconnected_since = disconnected_since or now
+                if now - disconnected_since >= Config.VOICE_DEAD_TIMEOUT:
+                    disconnected_since = None
+                    await self.recover(guild_id, "connection lost")
+                continue
+            disconnected_since = None
+
+            if voice_client.is_playing() and isinstance(voice_client, MonitoredVoiceClient):
+                last_activity = max(voice_client.last_packet_at or 0.0, voice_client.play_started_at or 0.0)
+                if last_activity and now - last_activity >= Config.VOICE_STALL_TIMEOUT:
+                    await self.recover(guild_id, f"no packets sent for {now - last_activity:.1f}s")
+
+    async def recover(self, guild_id: int, reason: str) -> bool:
+        """Reconnect a guild's voice connection and resume the current song"""
+        if guild_id in self._recovering:
+            return False
+        self._recovering.add(guild_id)
+        started = time.monotonic()
+
+        try:
+            voice_client = self.music_player.voice_clients.get(guild_id)
+            channel = voice_client.channel if voice_client else None
+            if channel is None:
+                return False
+
+            song = self.music_player.now_playing.get(guild_id)
+            position = self.music_player.get_position(guild_id) or 0.0
+            logger.warning(f"Voice connection unhealthy in guild {guild_id} ({reason}), reconnecting...")
+
+            # Tear down the old connection without advancing the queue; the old source's
+            # 'after' may fire late or not at all, so release its FFmpeg process here
+            old_source = voice_client.source
+            self.music_player.suppress_advance(guild_id)
+            if voice_client.is_playing() or voice_client.is_paused():
+                voice_client.stop()
+            try:
+                await voice_client.disconnect(force=True)
+            except Exception as e:
+                logger.warning(f"Error closing stale voice connection in guild {guild_id}: {e}")
+            if old_source is not None:
+                old_source.cleanup()
+            self.music_player.ffmpeg.reap(guild_id)
+
+            new_client = None
+            for attempt in range(Config.VOICE_RECONNECT_ATTEMPTS):
+                try:
+                    new_client = await channel.connect(cls=MonitoredVoiceClient, timeout=Config.VOICE_CONNECT_TIMEOUT)
+                    break
+                except Exception as e:
+                    logger.warning(f"Voice reconnect attempt {attempt + 1} failed in guild {guild_id}: {e}")
+                    await asyncio.sleep(attempt + 1)
+
+            if new_client is None:
+                logger.error(f"Could not re-establish voice in guild {guild_id}")
+                self.failures[guild_id] = self.failures.get(guild_id, 0) + 1
+                self.music_player.voice_clients.pop(guild_id, None)
+                return False
+
+            self.music_player.voice_clients[guild_id] = new_client
+
+            # Resume where we left off, or carry on with the queue
+            if song and await self.music_player.seek(guild_id, position, restart=True):
+                pass
+            elif self.music_player.get_queue(guild_id):
+                self.music_player.now_playing.pop(guild_id, None)
+                await self.music_player.play_next(guild_id)
+
+            elapsed = time.monotonic() - started
+            self.recovery_times.append(elapsed)
+            self.recoveries[guild_id] = self.recoveries.get(guild_id, 0) + 1
+            logger.info(f"Recovered voice in guild {guild_id} in {elapsed:.2f}s"
+                        + (f", resumed '{song.title}' at {position:.1f}s" if song else ""))
+            return True
+        finally:
+            self._recovering.discard(guild_id)
+
+    def get_stats(self, guild_id: int) -> Dict:
+        """Get health information for a guild's voice connection"""
+        voice_client = self.music_player.voice_clients.get(guild_id)
+        stats = {
+            'connected': bool(voice_client and voice_client.is_connected()),
+            'latency': voice_client.latency if voice_client else None,
+            'recoveries': self.recoveries.get(guild_id, 0),
+            'failures': self.failures.get(guild_id, 0),
+        }
+        if isinstance(voice_client, MonitoredVoiceClient):
+            stats.update({
+                'packets_sent': voice_client.packets_sent,
+                'packet_errors': voice_client.packet_errors,
+                'gaps': voice_client.gaps,
+                'longest_gap': voice_client.longest_gap,
+            })
+        return stats